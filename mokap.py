@@ -2,6 +2,7 @@
 import sys
 from mokap.core import MultiCam
 from mokap.gui import QApplication, MainWindow
+from mokap.gui.glvideo import GLVideoFeed
 from mokap.core.hardware import MQTTLogger
 
 
@@ -19,6 +20,10 @@ mc.gain = 0
 
 
 if __name__ == '__main__':
+    # The OpenGL video feeds need a compatibility context, and this has to be set before the QApplication exists
+    if mc.config_dict.get('gui_opengl', False):
+        GLVideoFeed.set_default_format()
+
     app = QApplication(sys.argv)
 
     if mc.nb_cameras == 0:
@@ -1,5 +1,6 @@
 from collections import defaultdict, deque
 from pathlib import Path
+import threading
 import numpy as np
 np.set_printoptions(precision=3, suppress=True, threshold=5)
 import cv2
@@ -7,12 +8,23 @@ import toml
 import scipy.stats as stats
 from scipy.spatial.distance import cdist
 from mokap.utils import geometry, generate_charuco
-from mokap.calibration import monocular, multiview
+from mokap.calibration import monocular, multiview, bundle_adjustment
 from typing import List
 
 
 class DetectionTool:
-    def __init__(self, board_params):
+    """
+        Detects the ChArUco board's points in images
+
+        With pyramid_level > 0, the markers are looked for in a downscaled image (by 2 ** pyramid_level), which is
+        where most of the time goes at full resolution, and only their corners and the board's points are refined on
+        the full resolution image, around them.
+    """
+    def __init__(self, board_params, pyramid_level=0):
+
+        self.pyramid_level = pyramid_level
+
+        self._board_params = {k: board_params[k] for k in ('rows', 'cols', 'square_length', 'markers_size')}
 
         # Charuco board and detector parameters
         self.board = generate_charuco(
@@ -61,7 +73,24 @@ class DetectionTool:
     def board_dims(self):
         return self._n_cols, self._n_rows
 
-    def detect(self, frame, camera_matrix=None, dist_coeffs=None, refine_markers=True, refine_points=False):
+    @property
+    def settings(self):
+        """ The board and detector parameters, i.e. everything that changes what detect() finds """
+        detector = {}
+        for name in dir(self.detector_parameters):
+            value = getattr(self.detector_parameters, name)
+            if not name.startswith('_') and isinstance(value, (bool, int, float)):
+                detector[name] = value
+        return {'board': dict(self._board_params), 'detector': detector, 'pyramid_level': self.pyramid_level}
+
+    def detect(self, frame, camera_matrix=None, dist_coeffs=None, refine_markers=True, refine_points=False, roi=None):
+
+        if roi is not None:
+            # Only look in a part of the frame (x0, y0, x1, y1): it's like a smaller frame with the principal point moved
+            frame = frame[roi[1]:roi[3], roi[0]:roi[2]]
+            if camera_matrix is not None:
+                camera_matrix = camera_matrix.copy()
+                camera_matrix[:2, 2] -= roi[:2]
 
         if frame.ndim == 3:
             frame = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
@@ -69,19 +98,30 @@ class DetectionTool:
         points2d_coords = None
         points2d_ids = None
 
+        # Markers are detected on the coarse level (i.e. the frame itself if pyramid_level is 0)
+        coarse = frame
+        for _ in range(self.pyramid_level):
+            coarse = cv2.pyrDown(coarse)
+        scale = 2 ** self.pyramid_level
+
+        coarse_camera_matrix = camera_matrix
+        if camera_matrix is not None and scale != 1:
+            # pyrDown keeps the even pixels, so a coarse pixel's coordinates are just the full ones divided by scale
+            coarse_camera_matrix = np.diag([1.0 / scale, 1.0 / scale, 1.0]) @ camera_matrix
+
         # Detect and refine aruco markers
-        markers_coords, marker_ids, rejected = self.detector.detectMarkers(frame)
+        markers_coords, marker_ids, rejected = self.detector.detectMarkers(coarse)
 
         if refine_markers:
             markers_coords, marker_ids, rejected, recovered = cv2.aruco.refineDetectedMarkers(
-                image=frame,
+                image=coarse,
                 board=self.board,
                 detectedCorners=markers_coords,     # Input/Output /!\
                 detectedIds=marker_ids,             # Input/Output /!\
                 rejectedCorners=rejected,           # Input/Output /!\
                 parameters=self.detector_parameters,
                 # Known bug with refineDetectedMarkers, fixed in OpenCV 4.9: https://github.com/opencv/opencv/pull/24139
-                cameraMatrix=camera_matrix if cv2.getVersionMajor() >= 4 and cv2.getVersionMinor() >= 9 else None,
+                cameraMatrix=coarse_camera_matrix if cv2.getVersionMajor() >= 4 and cv2.getVersionMinor() >= 9 else None,
                 distCoeffs=dist_coeffs)
 
         # If no marker detected, abort
@@ -90,6 +130,18 @@ class DetectionTool:
 
         # If any marker has been detected, try to detect the chessboard corners
         else:
+            if scale != 1:
+                # Back to full resolution, the markers corners are refined in a window about the size of a coarse pixel
+                coarse_corners = np.concatenate(markers_coords).reshape(-1, 1, 2) * scale
+                try:
+                    full_corners = cv2.cornerSubPix(frame, coarse_corners.astype(np.float32),
+                                                    winSize=(scale + 1, scale + 1),
+                                                    zeroZone=(-1, -1),
+                                                    criteria=(cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01))
+                except cv2.error:
+                    full_corners = coarse_corners.astype(np.float32)
+                markers_coords = tuple(full_corners.reshape(-1, 1, 4, 2))
+
             nb_chessboard_points, chessboard_points, chessboard_points_ids = cv2.aruco.interpolateCornersCharuco(
                 markerCorners=markers_coords,
                 markerIds=marker_ids,
@@ -114,6 +166,8 @@ class DetectionTool:
             if chessboard_points is not None and len(chessboard_points_ids[:, 0]) > 1:
                 points2d_coords = chessboard_points[:, 0, :]
                 points2d_ids = chessboard_points_ids[:, 0]
+                if roi is not None:
+                    points2d_coords = points2d_coords + np.asarray(roi[:2], dtype=np.float32)
 
         return points2d_coords, points2d_ids
 
@@ -121,10 +175,36 @@ class DetectionTool:
 class MonocularCalibrationTool:
     """
         This object is stateful for the intrinsics *only*
+
+        With track_roi, detect() only looks for the board around where it was in the previous frame (the area grows
+        when it's not found), and the whole frame is searched again every FULL_SEARCH_EVERY frames, or when the board
+        is lost for more than ROI_MAX_MISSES frames
     """
-    def __init__(self, board_params, imsize_hw=None, min_stack=15, max_stack=100, focal_mm=None, sensor_size=None):
+    ROI_MARGIN = 0.5            # Around the detected points, relative to their extent
+    ROI_GROWTH = 1.5            # Each frame the board isn't found in the region
+    ROI_MAX_MISSES = 3
+    FULL_SEARCH_EVERY = 30      # frames
+
+    # Samples selection (see select_samples())
+    TILT_CLASSES = (10, 20, 35)     # Edges of the board tilt classes, in degrees (the tilted ones are also split by
+    AZIMUTH_CLASSES = 8             # direction)
+    DISTANCE_CLASSES = 4
+    POSE_WEIGHT = 0.5           # Of a new tilt or distance class, relative to a sample's coverage
+    REPEAT_DECAY = 0.5          # Each time a grid cell or class is covered again, it's worth this much less
+
+    def __init__(self, board_params, imsize_hw=None, min_stack=15, max_stack=100, focal_mm=None, sensor_size=None,
+                 pyramid_level=0, track_roi=False, camera=None):
 
-        self.dt = DetectionTool(board_params=board_params)
+        self.dt = DetectionTool(board_params=board_params, pyramid_level=pyramid_level)
+
+        # Identifies this camera's undistortion maps in the shared cache (see monocular.undistortion_maps())
+        self._camera = camera if camera is not None else id(self)
+
+        # Board tracking
+        self.track_roi = track_roi
+        self._roi = None
+        self._roi_misses = 0
+        self._frames_since_full_search = 0
 
         # self._min_pts = 3   # SQPNP method needs at least 3 points
         # self._min_pts = 4   # ITERATIVE method needs at least 4 points
@@ -179,6 +259,11 @@ class MonocularCalibrationTool:
         self._stack_error: float = np.inf      # This will be the mean of the last_best_errors
         self.curr_error: float = np.inf
 
+        # Intrinsics computations can run elsewhere (see prepare_intrinsics()), these tell which results are outdated
+        self._intrinsics_epoch = 0          # Incremented when the intrinsics are set or cleared from outside
+        self._intrinsics_job_id = 0
+        self._intrinsics_applied_id = 0
+
         self.set_visualisation_scale(scale=1)
 
     def _update_imsize(self, new_size):
@@ -197,6 +282,8 @@ class MonocularCalibrationTool:
         # Create a weight grid for the coverage cells
         self._coverage_weight_grid = self._create_weight_grid()
 
+        self.reset_roi()
+
     def set_visualisation_scale(self, scale=1):
         self.BIT_SHIFT = 4
         self.SCALE = scale
@@ -276,7 +363,13 @@ class MonocularCalibrationTool:
 
         return (f_mm_x + f_mm_y) / 2.0
 
+    def _drop_undistortion_maps(self):
+        # The maps of the previous intrinsics won't be used again
+        monocular.clear_undistortion_maps(self._camera)
+
     def set_intrinsics(self, camera_matrix, dist_coeffs, errors=None):
+        self._intrinsics_epoch += 1
+        self._drop_undistortion_maps()
         self._camera_matrix = np.asarray(camera_matrix)
         dist_coeffs = np.asarray(dist_coeffs)
         if len(dist_coeffs) < 4:
@@ -287,6 +380,8 @@ class MonocularCalibrationTool:
             self.last_best_errors = errors
 
     def clear_intrinsics(self):
+        self._intrinsics_epoch += 1
+        self._drop_undistortion_maps()
         if self._ideal_camera_matrix is not None:
             self._camera_matrix = self._ideal_camera_matrix.copy()
             self._dist_coeffs = np.zeros(5, dtype=np.float32)
@@ -390,14 +485,132 @@ class MonocularCalibrationTool:
         col = min(max(col, 0), nb_cols - 1)
         return row, col
 
-    def compute_intrinsics(self, clear_stack=True, fix_aspect_ratio=True, simple_distortion=False, complex_distortion=False):
+    def _samples_features(self):
+        """
+            What each sample of the stack brings to the calibration, as weights of (nb_samples, nb_features): the
+            coverage grid cells its points are in (weighted like in _compute_new_area()), the board's tilt class, and
+            its distance class
+        """
+        h, w = self.imsize
+        grid_h, grid_w = self._coverage_grid_shape
+        nb_cells = grid_h * grid_w
+        nb_tilts = 1 + len(self.TILT_CLASSES) * self.AZIMUTH_CLASSES     # The frontal class has no direction
+        nb_samples = len(self.stack_points2d)
+
+        # If there are no intrinsics yet, a rough camera matrix is enough for the tilt
+        if self.has_intrinsics:
+            camera_matrix = self._camera_matrix
+        else:
+            camera_matrix = np.array([[max(h, w), 0, w / 2], [0, max(h, w), h / 2], [0, 0, 1]], dtype=np.float64)
+        camera_matrix_inv = np.linalg.inv(camera_matrix)
+
+        coverage = np.zeros((nb_samples, nb_cells))
+        tilts = np.zeros(nb_samples, dtype=int)
+        distances = np.full(nb_samples, np.nan)
+        weights = self._coverage_weight_grid.ravel()
+
+        for i, (points2d, points_ids) in enumerate(zip(self.stack_points2d, self.stack_points_ids)):
+            points2d, points_ids = points2d.reshape(-1, 2), points_ids.ravel()
+
+            rows = np.clip((points2d[:, 1] // (h / grid_h)).astype(int), 0, grid_h - 1)
+            cols = np.clip((points2d[:, 0] // (w / grid_w)).astype(int), 0, grid_w - 1)
+            cells = np.unique(rows * grid_w + cols)
+            coverage[i, cells] = weights[cells]
+
+            # The board's pose from its homography: H ~ K [r1 r2 t]
+            homography, _ = cv2.findHomography(self.dt.points3d[points_ids, :2], points2d)
+            if homography is None:
+                continue
+            m = camera_matrix_inv @ homography
+            scale = 2.0 / (np.linalg.norm(m[:, 0]) + np.linalg.norm(m[:, 1]))
+            normal = np.cross(m[:, 0], m[:, 1])
+            normal *= np.sign(normal[2]) or 1.0      # The plane's normal, on the camera's side
+            tilt = np.rad2deg(np.arccos(np.clip(normal[2] / np.linalg.norm(normal), 0, 1)))
+            tilt_class = np.searchsorted(self.TILT_CLASSES, tilt)
+            if tilt_class > 0:
+                azimuth = np.arctan2(normal[1], normal[0])
+                azimuth_class = int((azimuth + np.pi) / (2 * np.pi) * self.AZIMUTH_CLASSES) % self.AZIMUTH_CLASSES
+                tilts[i] = 1 + (tilt_class - 1) * self.AZIMUTH_CLASSES + azimuth_class
+            distances[i] = abs(m[2, 2] * scale)
+
+        # The distance classes are relative to the range of the samples
+        valid = np.isfinite(distances) & (distances > 0)
+        distance_classes = np.zeros(nb_samples, dtype=int)
+        if valid.sum() > 1:
+            log_dist = np.log(distances[valid])
+            span = max(log_dist.max() - log_dist.min(), 1e-9)
+            distance_classes[valid] = np.minimum((log_dist - log_dist.min()) / span * self.DISTANCE_CLASSES,
+                                                 self.DISTANCE_CLASSES - 1).astype(int)
+
+        pose_weight = self.POSE_WEIGHT * coverage.sum(axis=1).mean()
+        pose = np.zeros((nb_samples, nb_tilts + self.DISTANCE_CLASSES))
+        pose[np.flatnonzero(valid), tilts[valid]] = pose_weight
+        pose[np.flatnonzero(valid), nb_tilts + distance_classes[valid]] = pose_weight
+
+        return np.hstack([coverage, pose])
+
+    def select_samples(self, nb_samples):
+        """
+            Picks the nb_samples samples of the stack that together cover the image, the board tilts (and directions)
+            and distances the best, greedily: each time, the sample whose grid cells and classes are the least
+            covered by the ones already picked
+
+            Returns
+            -------
+            np.ndarray
+                Indices of the picked samples in the stack (in the stack's order)
+        """
+        if nb_samples >= len(self.stack_points2d):
+            return np.arange(len(self.stack_points2d))
+
+        features = self._samples_features()
+        # Slightly prefer the samples with more points when there's nothing else to decide
+        tie_breaker = np.array([p.shape[1] for p in self.stack_points2d]) * 1e-6
+
+        times_covered = np.zeros(features.shape[1])
+        available = np.ones(len(features), dtype=bool)
+        selected = []
+        for _ in range(nb_samples):
+            gains = features @ (self.REPEAT_DECAY ** times_covered) + tie_breaker
+            gains[~available] = -np.inf
+            best = int(np.argmax(gains))
+            selected.append(best)
+            available[best] = False
+            times_covered += features[best] > 0
+
+        return np.sort(selected)
+
+    def compute_intrinsics(self, clear_stack=True, fix_aspect_ratio=True, simple_distortion=False, complex_distortion=False,
+                           max_samples=None):
+        job = self.prepare_intrinsics(clear_stack=clear_stack,
+                                      fix_aspect_ratio=fix_aspect_ratio,
+                                      simple_distortion=simple_distortion,
+                                      complex_distortion=complex_distortion,
+                                      max_samples=max_samples)
+        if job is not None:
+            self.apply_intrinsics(self.calibrate_intrinsics(job))
+
+    def prepare_intrinsics(self, clear_stack=True, fix_aspect_ratio=True, simple_distortion=False, complex_distortion=False,
+                           max_samples=None):
+        """
+            Takes a snapshot of the samples stack and of the current intrinsics for an intrinsics computation, so that
+            calibrate_intrinsics() can run in another thread while the detection and sampling go on. Its result goes
+            to apply_intrinsics(), in this object's thread.
+
+            If max_samples is given and the stack is larger, only the most informative samples are used
+            (see select_samples())
 
+            Returns
+            -------
+            dict or None
+                The computation's inputs, or None if there aren't enough samples
+        """
         if simple_distortion and complex_distortion:
             raise AttributeError("Can't enable simple and complex distortion modes at the same time!")
 
         # If there is fewer than 5 images (no matter the self._min_stack value), this will NOT be enough
         if len(self.stack_points2d) < 5:
-            return  # Abort and keep the stacks
+            return None  # Abort and keep the stacks
 
         if self._camera_matrix is None and fix_aspect_ratio:
             print('No current camera matrix guess, unfixing aspect ratio.')
@@ -417,78 +630,125 @@ class MonocularCalibrationTool:
 
         calib_flags |= cv2.CALIB_FIX_PRINCIPAL_POINT
 
-        # We need to copy to a new array, because OpenCV uses these as Input/Output buffers
-        if self.has_intrinsics:
-            current_camera_matrix = np.copy(self._camera_matrix)
-            current_dist_coeffs = np.copy(self._dist_coeffs)
+        if max_samples is not None and len(self.stack_points2d) > max_samples:
+            selected = self.select_samples(max_samples)
+            points2d = [self.stack_points2d[i] for i in selected]
+            points_ids = [self.stack_points_ids[i] for i in selected]
         else:
-            current_camera_matrix = None
-            current_dist_coeffs = None
+            points2d, points_ids = list(self.stack_points2d), list(self.stack_points_ids)
+
+        # We need to copy to a new array, because OpenCV uses these as Input/Output buffers
+        self._intrinsics_job_id += 1
+        job = {'id': self._intrinsics_job_id,
+               'epoch': self._intrinsics_epoch,
+               'points2d': points2d,
+               'points_ids': points_ids,
+               'imsize': self.imsize.copy(),
+               'camera_matrix': np.copy(self._camera_matrix) if self.has_intrinsics else None,
+               'dist_coeffs': np.copy(self._dist_coeffs) if self.has_intrinsics else None,
+               'flags': calib_flags}
+
+        if clear_stack:
+            self.clear_stacks()
+        return job
 
+    def calibrate_intrinsics(self, job):
+        """
+            Runs the intrinsics computation prepared by prepare_intrinsics() (this only reads the job, so it can run
+            in any thread)
+        """
+        result = {'id': job['id'], 'epoch': job['epoch'], 'imsize': job['imsize']}
         try:
             # Compute calibration using all the frames we selected
             global_error, new_camera_matrix, new_dist_coeffs, stack_rvecs, stack_tvecs, std_intrinsics, std_extrinsics, stack_errors = cv2.aruco.calibrateCameraCharucoExtended(
-                charucoCorners=self.stack_points2d,
-                charucoIds=self.stack_points_ids,
+                charucoCorners=job['points2d'],
+                charucoIds=job['points_ids'],
                 board=self.dt.board,
-                imageSize=np.flip(self.imsize),
-                cameraMatrix=current_camera_matrix,     # Input/Output /!\
-                distCoeffs=current_dist_coeffs,         # Input/Output /!\
-                flags=calib_flags)
+                imageSize=np.flip(job['imsize']),
+                cameraMatrix=job['camera_matrix'],     # Input/Output /!\
+                distCoeffs=job['dist_coeffs'],         # Input/Output /!\
+                flags=job['flags'])
 
             # std_cam_mat, std_dist_coeffs = np.split(std_intrinsics.squeeze(), [4])
             # std_rvecs, std_tvecs = std_extrinsics.reshape(2, -1, 3)
             # TODO - Use these std values in the plot - or to decide if the new round of calibrateCamera is good or not?
 
-            new_dist_coeffs = new_dist_coeffs.squeeze()
+            result['camera_matrix'] = new_camera_matrix
+            result['dist_coeffs'] = new_dist_coeffs.squeeze()
             # stack_rvecs = np.stack(stack_rvecs).squeeze()       # Unused for now
             # stack_tvecs = np.stack(stack_tvecs).squeeze()       # Unused for now
-            stack_errors = stack_errors.squeeze() / self._err_norm  # Normalise errors on image diagonal
-
-            # Note:
-            # ---------------
-            #
-            # The per-view reprojection error as returned by calibrateCamera() is:
-            #   the square root of the sum of the 2 means in x and y of the squared diff
-            #       np.sqrt(np.sum(np.mean(sq_diff, axis=0)))
-            #
-            # This is NOT the same as the per-view reprojection error as returned by solvePnP():
-            #   this one is the square root of the mean of the squared diff over both x and y
-            #        np.sqrt(np.mean(sq_diff, axis=(0, 1)))
-            #
-            # ...in other words, the first one is larger by a factor sqrt(2)
-            #
-            # ----------------------------------------------
-            #
-            # The global calibration error in calibrateCamera is:
-            #       np.sqrt(np.sum([sq_diff for view in stack])) / np.sum([len(view) for view in stack]))
-            #
-
-            # The following things should not be possible ; if any happens, then we trash the stack and abort
-            if (new_camera_matrix < 0).any() or (new_camera_matrix[:2, 2] >= np.flip(self.imsize)).any():
-                self.clear_stacks()
-                return
-
-            # Update the intrinsics if this stack's errors are better (or if it is the very first stack computed)
-            if not self.has_intrinsics or np.any(self.last_best_errors == np.inf):
-                self._camera_matrix = new_camera_matrix
-                self._dist_coeffs = new_dist_coeffs
-                self.last_best_errors = stack_errors
-                self._stack_error = np.mean(self.last_best_errors)
-                print(f"---Computed intrinsics---")
-
-            elif self._check_new_errors(stack_errors, self.last_best_errors):
-                self._camera_matrix = new_camera_matrix
-                self._dist_coeffs = new_dist_coeffs
-                self.last_best_errors = stack_errors
-                self._stack_error = np.mean(self.last_best_errors)
-                print(f"---Updated intrinsics---")
+            result['errors'] = stack_errors.squeeze() / self._err_norm  # Normalise errors on image diagonal
 
         except cv2.error as e:
             print(e)
+            result['camera_matrix'] = None
+        return result
 
-        if clear_stack:
+    def apply_intrinsics(self, result):
+        """
+            Updates the intrinsics with the result of calibrate_intrinsics() if it is better than the current ones,
+            and if it's not outdated: the intrinsics were set or cleared since it was prepared, or a computation
+            prepared after it has already been applied
+
+            Returns
+            -------
+            bool
+                Whether the intrinsics were updated
+        """
+        if result is None or result['camera_matrix'] is None:
+            return False
+
+        if result['epoch'] != self._intrinsics_epoch or result['id'] < self._intrinsics_applied_id:
+            return False
+
+        # Note:
+        # ---------------
+        #
+        # The per-view reprojection error as returned by calibrateCamera() is:
+        #   the square root of the sum of the 2 means in x and y of the squared diff
+        #       np.sqrt(np.sum(np.mean(sq_diff, axis=0)))
+        #
+        # This is NOT the same as the per-view reprojection error as returned by solvePnP():
+        #   this one is the square root of the mean of the squared diff over both x and y
+        #        np.sqrt(np.mean(sq_diff, axis=(0, 1)))
+        #
+        # ...in other words, the first one is larger by a factor sqrt(2)
+        #
+        # ----------------------------------------------
+        #
+        # The global calibration error in calibrateCamera is:
+        #       np.sqrt(np.sum([sq_diff for view in stack])) / np.sum([len(view) for view in stack]))
+        #
+
+        new_camera_matrix, new_dist_coeffs, stack_errors = result['camera_matrix'], result['dist_coeffs'], result['errors']
+
+        # The following things should not be possible ; if any happens, then we trash the stack and abort
+        if (new_camera_matrix < 0).any() or (new_camera_matrix[:2, 2] >= np.flip(result['imsize'])).any():
             self.clear_stacks()
+            return False
+
+        # Update the intrinsics if this stack's errors are better (or if it is the very first stack computed)
+        if not self.has_intrinsics or np.any(np.isinf(self.last_best_errors)):
+            self._camera_matrix = new_camera_matrix
+            self._dist_coeffs = new_dist_coeffs
+            self.last_best_errors = stack_errors
+            self._stack_error = np.mean(self.last_best_errors)
+            self._intrinsics_applied_id = result['id']
+            self._drop_undistortion_maps()
+            print(f"---Computed intrinsics---")
+            return True
+
+        elif self._check_new_errors(stack_errors, self.last_best_errors):
+            self._camera_matrix = new_camera_matrix
+            self._dist_coeffs = new_dist_coeffs
+            self.last_best_errors = stack_errors
+            self._stack_error = np.mean(self.last_best_errors)
+            self._intrinsics_applied_id = result['id']
+            self._drop_undistortion_maps()
+            print(f"---Updated intrinsics---")
+            return True
+
+        return False
 
     def compute_extrinsics(self, refine=True):
 
@@ -592,12 +852,62 @@ class MonocularCalibrationTool:
         # Load frame
         np.copyto(self._frame_in[:], frame)
 
+        roi = None
+        if self.track_roi and self._frames_since_full_search < self.FULL_SEARCH_EVERY:
+            roi = self._roi
+
         # Detect
         self._points2d, self._points_ids = self.dt.detect(self._frame_in,
                                               camera_matrix=self._camera_matrix,
                                               dist_coeffs=self._dist_coeffs,
                                               refine_markers=True,
-                                              refine_points=True)
+                                              refine_points=True,
+                                              roi=roi)
+
+        if self.track_roi:
+            self._update_roi(full_search=roi is None)
+
+    @property
+    def roi(self):
+        """ Where the next detection will look for the board (x0, y0, x1, y1), or None for the whole frame """
+        return self._roi
+
+    def _update_roi(self, full_search):
+
+        self._frames_since_full_search = 0 if full_search else self._frames_since_full_search + 1
+        h, w = self.imsize
+
+        if self._points2d is not None:
+            # The markers are outside of the points, the margin covers them and the board's motion
+            (x0, y0), (x1, y1) = self._points2d.min(axis=0), self._points2d.max(axis=0)
+            margin = self.ROI_MARGIN * max(x1 - x0, y1 - y0)
+            self._roi_misses = 0
+
+        elif self._roi is not None:
+            self._roi_misses += 1
+            if self._roi_misses > self.ROI_MAX_MISSES:
+                self.reset_roi()
+                return
+            x0, y0, x1, y1 = self._roi
+            margin = (self.ROI_GROWTH - 1) / 2 * max(x1 - x0, y1 - y0)
+        else:
+            return
+
+        self._roi = (max(int(x0 - margin), 0), max(int(y0 - margin), 0),
+                     min(int(np.ceil(x1 + margin)), w), min(int(np.ceil(y1 + margin)), h))
+
+    def reset_roi(self):
+        """ Search the whole frame next time """
+        self._roi = None
+        self._roi_misses = 0
+
+    def set_detection(self, points2d, points_ids, imsize_hw=None):
+        """
+            Uses a detection made elsewhere (e.g. offline, in another process) as if it came from detect()
+        """
+        if imsize_hw is not None and (self.imsize is None or np.any(self.imsize != np.asarray(imsize_hw)[:2])):
+            self._update_imsize(imsize_hw)
+        self._points2d, self._points_ids = points2d, points_ids
 
     def auto_register_area_based(self, area_threshold=0.2, nb_points_threshold=4):
 
@@ -610,7 +920,7 @@ class MonocularCalibrationTool:
             return False
 
     def auto_compute_intrinsics(self, coverage_threshold=80, stack_length_threshold=15,
-                                simple_focal=False, simple_distortion=False, complex_distortion=False):
+                                simple_focal=False, simple_distortion=False, complex_distortion=False, max_samples=None):
         """
             Trigger computation if the percentage of grid cells marked as covered exceeds the threshold
              and there are enough samples
@@ -618,7 +928,8 @@ class MonocularCalibrationTool:
         if self.coverage >= coverage_threshold and self.nb_samples > stack_length_threshold:
             self.compute_intrinsics(fix_aspect_ratio=simple_focal,
                                     simple_distortion=simple_distortion,
-                                    complex_distortion=complex_distortion)
+                                    complex_distortion=complex_distortion,
+                                    max_samples=max_samples)
             return True
         else:
             return False
@@ -698,12 +1009,10 @@ class MonocularCalibrationTool:
         # Draw grid-based coverage overlay
         frame_out = self.draw_coverage_grid(frame_out)
 
-        # Undistort image
+        # Undistort image (the maps are only computed when the intrinsics change)
         if self.has_intrinsics:
-            optimal_camera_matrix, roi = cv2.getOptimalNewCameraMatrix(self._camera_matrix,
-                                                                       self._dist_coeffs,
-                                                                       np.flip(self.imsize), 1.0, np.flip(self.imsize))
-            frame_out = cv2.undistort(frame_out, self._camera_matrix, self._dist_coeffs, None, optimal_camera_matrix)
+            frame_out, optimal_camera_matrix = monocular.undistort_frame(frame_out, self._camera_matrix, self._dist_coeffs,
+                                                                      camera=self._camera)
 
             # Display board perimeter in purple AFTER undistortion, so that the lines are straight
             if self.has_extrinsics:
@@ -743,10 +1052,13 @@ class MultiviewCalibrationTool:
         Class to aggregate multiple monocular detections into multi-view samples, compute, and refine cameras poses
     """
 
-    def __init__(self, nb_cameras, origin_camera=0, min_poses=15, max_poses=100, min_detections=15, max_detections=100):
+    def __init__(self, nb_cameras, board_params=None, origin_camera=0, min_poses=15, max_poses=100, min_detections=15, max_detections=100):
 
         self.nb_cameras = nb_cameras
 
+        # The board points are needed for the refinement (they set the scale)
+        self._board_points_3d = DetectionTool(board_params).points3d if board_params is not None else None
+
         self._multi_intrinsics = np.zeros((nb_cameras, 3, 3))
         self._multi_intrinsics_refined = np.zeros((nb_cameras, 3, 3))
         self._multi_dist_coeffs = np.zeros((nb_cameras, 14))
@@ -761,6 +1073,9 @@ class MultiviewCalibrationTool:
         self._min_detections = min_detections
 
         self._detections_stack = deque(maxlen=max_detections)
+        self._detections_added = 0      # Total number of samples that went into the stack
+        self._refined_on = 0            # How many had been added when the last refinement started
+        self._refinement_converged = True
         # self._poses_stack = deque(maxlen=max_poses)
         self._poses_per_camera = {i: [] for i in range(nb_cameras)}
 
@@ -769,6 +1084,10 @@ class MultiviewCalibrationTool:
         self._refined_rvecs = None
         self._refined_tvecs = None
         self._refined = False
+        self._last_refinement = None
+
+        # The refinement runs in another thread, so the detections stack and the results are shared
+        self._lock = threading.Lock()
 
     @property
     def nb_detection_samples(self):
@@ -786,6 +1105,7 @@ class MultiviewCalibrationTool:
     def origin_camera(self, value: int):
         self._origin_idx = value
         self.clear_poses()
+        self.clear_refined()
 
     @property
     def has_extrinsics(self):
@@ -801,20 +1121,33 @@ class MultiviewCalibrationTool:
 
     @property
     def extrinsics(self):
-        if self._refined:
-            return self._refined_rvecs, self._refined_tvecs
-        else:
-            return self._optimised_rvecs, self._optimised_tvecs
+        with self._lock:
+            if self._refined:
+                return self._refined_rvecs, self._refined_tvecs
+            else:
+                return self._optimised_rvecs, self._optimised_tvecs
+
+    @property
+    def needs_refinement(self):
+        """ Whether there are enough detection samples for a refinement, and new ones (or the last one ran out of time) """
+        return (self.has_extrinsics and self.nb_detection_samples >= self._min_detections
+                and (self._detections_added > self._refined_on or not self._refinement_converged))
+
+    @property
+    def last_refinement(self):
+        """ Statistics of the last refinement (reprojection errors, iterations, duration...), or None """
+        return self._last_refinement
 
     def register_intrinsics(self, cam_idx: int, camera_matrix: np.ndarray, dist_coeffs: np.ndarray):
         self._multi_intrinsics[cam_idx, :, :] = camera_matrix
         self._multi_dist_coeffs[cam_idx, :len(dist_coeffs)] = dist_coeffs
 
     def intrinsics(self):
-        if self._refined:
-            return self._multi_intrinsics_refined
-        else:
-            return self._multi_intrinsics
+        with self._lock:
+            if self._refined:
+                return self._multi_intrinsics_refined, self._multi_dist_coeffs_refined
+            else:
+                return self._multi_intrinsics, self._multi_dist_coeffs
 
     def register_extrinsics(self, frame_idx: int, cam_idx: int, rvec: np.ndarray, tvec: np.ndarray, similarity_threshold=10.0):
         """
@@ -845,7 +1178,7 @@ class MultiviewCalibrationTool:
             # if np.all(deltas > 0):  # 0 threshold for testing
             #     self._poses_stack.append(remapped_poses)
 
-    def register_detection(self, frame_idx: int, cam_idx: int, points2d: np.ndarray, points_ids: np.ndarray):
+    def register_detection(self, frame_idx: int, cam_idx: int, points2d: np.ndarray, points_ids: np.ndarray, triangulate=True):
         """
             This registers points detections from multiple cameras and
             stores them as a complete detection samples if all cameras have one
@@ -857,7 +1190,12 @@ class MultiviewCalibrationTool:
             dbf = self._detections_by_frame.pop(frame_idx)
             # list of lists of tuples of arrays: M[N[(P_points, P_ids)]] because the number of points P is variable
             sample = [dbf[cidx] for cidx in range(self.nb_cameras)]
-            self._detections_stack.append(sample)
+            with self._lock:
+                self._detections_stack.append(sample)
+                self._detections_added += 1
+
+            if not triangulate:
+                return
 
             # Prepare data for triangulation
             points2d_list = [det[0] for det in sample]
@@ -877,14 +1215,38 @@ class MultiviewCalibrationTool:
             else:
                 print("Extrinsics not available yet; cannot triangulate.")
 
+    def flush_detections(self, min_cameras=2):
+        """
+            Stores the frames that are still waiting for some cameras as detection samples (with (None, None) for the
+            missing cameras) if at least min_cameras saw the board, and drops the others. This is for offline use,
+            when no more detections will come for these frames
+        """
+        with self._lock:
+            for frame_idx in sorted(self._detections_by_frame):
+                dbf = self._detections_by_frame[frame_idx]
+                if len(dbf) >= min_cameras:
+                    self._detections_stack.append([dbf.get(cidx, (None, None)) for cidx in range(self.nb_cameras)])
+                    self._detections_added += 1
+        self._detections_by_frame = defaultdict(dict)
+
     def clear_poses(self):
         self._poses_per_camera = {i: [] for i in range(self.nb_cameras)}
         self._poses_by_frame = defaultdict(dict)
 
     def clear_detections(self):
-        self._detections_stack.clear()
+        with self._lock:
+            self._detections_stack.clear()
         self._detections_by_frame = defaultdict(dict)
 
+    def clear_refined(self):
+        with self._lock:
+            self._refined_rvecs = None
+            self._refined_tvecs = None
+            self._refined = False
+            self._refined_on = 0
+            self._refinement_converged = True
+            self._detections_added = len(self._detections_stack)
+
     def compute_estimation(self, clear_poses_stack=True):
         """
             This uses the complete pose samples to compute a first estimate of the cameras arrangement
@@ -916,23 +1278,77 @@ class MultiviewCalibrationTool:
         if clear_poses_stack:
             self.clear_poses()
 
-    # def compute_refined(self, clear_detections_stack=True):
-    #     """
-    #         This uses the complete detections samples to refine the cameras poses and intrinsics with bundle adjustment
-    #     """
-    #
-    #     if self.nb_detection_samples < self._min_detections:
-    #         return
-    #
-    #     print(f"[MultiviewCalibrationTool] Refining cameras poses...")
-    #
-    #     this_m_points2d = [cam.loc[fr] for cam in test_points_2d]
-    #     this_m_points2d_ids = [cam.loc[fr] for cam in test_points_2d_ids]
-    #
-    #     points3d_svd, points3d_ids = multicam.triangulation(this_m_points2d, this_m_points2d_ids,
-    #                                                         n_optimised_rvecs, n_optimised_tvecs,
-    #                                                         n_camera_matrices, n_dist_coeffs)
-    #
-    #     # if clear_detections_stack:
-    #     #     self.clear_detections()
+    def compute_refined(self, max_time=5.0, simple_focal=True, simple_distortion=True, complex_distortion=False,
+                        clear_detections_stack=False):
+        """
+            This uses the complete detections samples to refine the cameras poses and intrinsics with bundle adjustment
+
+            The first estimate (or the previous refinement) is the starting point, and the optimisation stops after
+            max_time seconds (the next call picks up from there, even without new samples). It is safe to call this from another thread than the one registering the detections:
+            it works on a copy of the stack, and the results are swapped in at the end.
+
+            Returns
+            -------
+            bool
+                Whether the refinement ran
+        """
+        if not self.needs_refinement or self._board_points_3d is None:
+            return False
+
+        with self._lock:
+            stack = list(self._detections_stack)
+            self._refined_on = self._detections_added
+            if self._refined:
+                rvecs, tvecs = self._refined_rvecs, self._refined_tvecs
+                camera_matrices, dist_coeffs = self._multi_intrinsics_refined, self._multi_dist_coeffs_refined
+            else:
+                rvecs, tvecs = self._optimised_rvecs, self._optimised_tvecs
+                camera_matrices, dist_coeffs = self._multi_intrinsics, self._multi_dist_coeffs
+            camera_matrices, dist_coeffs = camera_matrices.copy(), dist_coeffs.copy()
+            rvecs, tvecs = rvecs.copy(), tvecs.copy()
+            origin = self._origin_idx
+
+        if np.any(camera_matrices[:, 0, 0] == 0):
+            print("[WARN] [MultiviewCalibrationTool] Some cameras don't have intrinsics yet, can't refine.")
+            return False
+
+        print(f"[INFO] [MultiviewCalibrationTool] Refining cameras poses and intrinsics on {len(stack)} samples...")
+
+        # The stack is M[N[(points, ids)]], the bundle adjustment wants N[M[points]] and N[M[ids]]
+        points_2d = [[sample[n][0] for sample in stack] for n in range(self.nb_cameras)]
+        points_ids = [[sample[n][1] for sample in stack] for n in range(self.nb_cameras)]
+
+        camera_matrices_opt, dist_coeffs_opt, rvecs_opt, tvecs_opt, info = bundle_adjustment.run_bundle_adjustment(
+            camera_matrices, dist_coeffs, rvecs, tvecs, points_2d, points_ids, self._board_points_3d,
+            origin_camera=origin,
+            simple_focal=simple_focal,
+            simple_distortion=simple_distortion,
+            complex_distortion=complex_distortion,
+            max_time=max_time,
+            verbose=False,
+            full_output=True)
+
+        if not np.isfinite(info['rms_after']) or info['rms_after'] > info['rms_before']:
+            print(f"[WARN] [MultiviewCalibrationTool] Refinement did not improve the reprojection error "
+                  f"({info['rms_before']:.3f} px > {info['rms_after']:.3f} px), discarding it.")
+            return False
+
+        with self._lock:
+            if origin != self._origin_idx:
+                return False     # The origin changed meanwhile, these are relative to the wrong camera
+            self._multi_intrinsics_refined = camera_matrices_opt
+            self._multi_dist_coeffs_refined = np.zeros((self.nb_cameras, 14))
+            self._multi_dist_coeffs_refined[:, :dist_coeffs_opt.shape[1]] = dist_coeffs_opt
+            self._refined_rvecs, self._refined_tvecs = rvecs_opt, tvecs_opt
+            self._refined = True
+            self._refinement_converged = bool(info['success'])
+            self._last_refinement = {k: info[k] for k in ('rms_before', 'rms_after', 'per_camera_rms', 'iterations',
+                                                          'elapsed', 'message') if k in info}
+
+        print(f"[INFO] [MultiviewCalibrationTool] Refined: {info['rms_before']:.3f} px > {info['rms_after']:.3f} px "
+              f"({info.get('elapsed', 0):.1f} s, {info['message']})")
+
+        if clear_detections_stack:
+            self.clear_detections()
+        return True
 
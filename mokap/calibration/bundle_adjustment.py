@@ -1,8 +1,11 @@
+import time
 import numpy as np
+import cv2
 from scipy.optimize import least_squares
+from scipy.sparse import csr_matrix
+from scipy.spatial.transform import Rotation
 from alive_progress import alive_bar
-from mokap.calibration import multiview
-from mokap.utils import CallbackOutputStream
+from mokap.utils import CallbackOutputStream, geometry
 
 
 def flatten_extrinsics(m_rvecs, m_tvecs):
@@ -43,6 +46,7 @@ def flatten_intrinsics(n_camera_matrices, n_distortion_coeffs, simple_focal=True
             compl_dc = np.zeros((dc.shape[0], 8))
             compl_dc[:, :dc.shape[1]] = dc
             dc = compl_dc
+        dc = dc[:, :8]
     else:
         dc = dc[:, :5]
     return np.hstack([cm, dc]).ravel()
@@ -112,80 +116,753 @@ def unflatten_params(params, nb_cams, simple_focal=True, simple_distortion=False
 
     return n_camera_matrices, n_distortion_coeffs, m_rvecs, m_tvecs
 
-# params, points_3d_th = x0, detector.points3d
-def cost_func(params, points_2d, points_ids, points_3d_th, weight_2d_reproj=1.0, weight_3d_consistency=1.0, simple_focal=True, simple_distortion=False, complex_distortion=False, interpolate=False):
-    N = len(points_2d)
-    M = len(points_2d[0])
-
-    max_nb_points = points_3d_th.shape[0]
-    max_nb_dists = int((max_nb_points * (max_nb_points - 1)) / 2.0)
-
-    camera_matrices, distortion_coeffs, rvecs, tvecs = unflatten_params(params,
-                                                                        nb_cams=N,
-                                                                        simple_focal=simple_focal,
-                                                                        simple_distortion=simple_distortion,
-                                                                        complex_distortion=complex_distortion)
-
-    all_errors_reproj = np.zeros((M, N, max_nb_points, 2))
-    all_errors_consistency = np.zeros((M, max_nb_dists))
-
-    for m in range(M):
-        this_m_points2d = [cam[m] for cam in points_2d]
-        this_m_points2d_ids = [cam[m] for cam in points_ids]
-
-        points3d_svd, points3d_ids = multiview.triangulation(this_m_points2d, this_m_points2d_ids,
-                                                             rvecs, tvecs,
-                                                             camera_matrices, distortion_coeffs)
-
-        if points3d_svd is not None:
-
-            if interpolate:
-                points3d_svd, points3d_ids = multiview.interpolate3d(points3d_svd, points3d_ids, points_3d_th)
-
-            errors_reproj, errors_consistency = multiview.compute_3d_errors(this_m_points2d,
-                                                                            this_m_points2d_ids,
-                                                                            points3d_svd,
-                                                                            points3d_ids,
-                                                                            points_3d_th,
-                                                                            rvecs,
-                                                                            tvecs,
-                                                                            camera_matrices,
-                                                                            distortion_coeffs,
-                                                                            fill_value='median')
-            all_errors_reproj[m, :, :, :] = errors_reproj
-            all_errors_consistency[m, :] = errors_consistency
-        else:
-            all_errors_reproj[m, :, :, :] = 0.0
-            all_errors_consistency[m, :] = 0.0
-
-    return np.concatenate([all_errors_reproj.ravel() * weight_2d_reproj, all_errors_consistency.ravel() * weight_3d_consistency])
 
+def flatten_observations(points_2d, points_ids):
+    """
+        Takes the detections from N cameras for M samples, as nested lists N[M[(P_i, 2)]] (and N[M[(P_i,)]] for the
+        points IDs), where a camera that did not see the board in a sample has None or an empty array,
+        and returns them as four flat arrays (one entry per observed point)
+
+        Returns
+        -------
+        cams_idx, samples_idx, points_idx : np.ndarray of int
+        points2d : np.ndarray
+            shape (K, 2)
+    """
+    cams_idx, samples_idx, points_idx, points2d = [], [], [], []
+    for n, (cam_points, cam_ids) in enumerate(zip(points_2d, points_ids)):
+        for m, (pts, ids) in enumerate(zip(cam_points, cam_ids)):
+            if pts is None or ids is None or len(ids) == 0:
+                continue
+            ids = np.asarray(ids, dtype=np.int64).ravel()
+            cams_idx.append(np.full(len(ids), n))
+            samples_idx.append(np.full(len(ids), m))
+            points_idx.append(ids)
+            points2d.append(np.asarray(pts, dtype=np.float64).reshape(-1, 2))
+
+    if not cams_idx:
+        return (np.empty(0, dtype=np.int64),) * 3 + (np.empty((0, 2)),)
+    return np.concatenate(cams_idx), np.concatenate(samples_idx), np.concatenate(points_idx), np.concatenate(points2d)
+
+
+def estimate_board_poses(camera_matrices, distortion_coeffs, rvecs, tvecs, points_2d, points_ids, points_3d,
+                         min_points=6, nb_candidates=3, samples=None):
+    """
+        First guess of the pose of the board (board-to-world) in each of M samples
 
-def run_bundle_adjustment(camera_matrices, distortion_coeffs, rvecs, tvecs, points_2d, points_ids, points_3d, reproj_weight=1.0, consistency_weight=2.0, simple_focal=True, simple_distortion=False, complex_distortion=False, interpolate=False):
+        The pose is estimated by PnP in the few cameras that see the most points (planar boards have two possible
+        poses in each), moved to world coordinates with that camera's pose (camera-to-world), and the candidate that
+        reprojects best in all the cameras that saw the board is kept.
+        Only the samples listed in samples are estimated, if given.
 
+        Returns
+        -------
+        board_rvecs, board_tvecs : np.ndarray
+            shape (M, 3), NaN for the samples where no camera saw at least min_points points
+    """
     nb_cams = len(camera_matrices)
+    nb_samples = max(len(cam_points) for cam_points in points_2d)
+    board_rvecs = np.full((nb_samples, 3), np.nan)
+    board_tvecs = np.full((nb_samples, 3), np.nan)
+
+    camera_matrices = [np.asarray(K, dtype=np.float64) for K in camera_matrices]
+    dists = []
+    for dc in distortion_coeffs:
+        dist = np.zeros(max(4, len(dc)))
+        dist[:len(dc)] = dc
+        dists.append(dist)
+    cams_to_world = [geometry.extrinsics_matrix(rvecs[n], tvecs[n], hom=True) for n in range(nb_cams)]
+    planar = np.ptp(np.asarray(points_3d)[:, 2]) == 0
+
+    for m in (range(nb_samples) if samples is None else samples):
+        seen = {}
+        for n in range(nb_cams):
+            if m < len(points_ids[n]) and points_ids[n][m] is not None and len(points_ids[n][m]) >= min_points:
+                seen[n] = (np.asarray(points_ids[n][m], dtype=np.int64).ravel(),
+                           np.asarray(points_2d[n][m], dtype=np.float64).reshape(-1, 2))
+        if not seen:
+            continue
+
+        candidates = []
+        for n in sorted(seen, key=lambda c: len(seen[c][0]), reverse=True)[:nb_candidates]:
+            ids, pts = seen[n]
+            try:
+                nb_sol, sol_rvecs, sol_tvecs, _ = cv2.solvePnPGeneric(points_3d[ids].astype(np.float64), pts,
+                                                                      camera_matrices[n], dists[n],
+                                                                      flags=cv2.SOLVEPNP_IPPE if planar else cv2.SOLVEPNP_ITERATIVE)
+            except cv2.error:
+                continue
+            for rvec, tvec in zip(sol_rvecs, sol_tvecs):
+                candidates.append(cams_to_world[n] @ geometry.extrinsics_matrix(rvec, tvec, hom=True))
+
+        best, best_error = None, np.inf
+        for board_to_world in candidates:
+            errors = []
+            for n, (ids, pts) in seen.items():
+                board_to_cam = np.linalg.inv(cams_to_world[n]) @ board_to_world
+                if np.any(points_3d[ids] @ board_to_cam[2, :3] + board_to_cam[2, 3] <= 0):
+                    errors.append(np.full(len(ids), np.inf))      # Behind that camera
+                    continue
+                r, t = geometry.extmat_to_rtvecs(board_to_cam)
+                proj = cv2.projectPoints(points_3d[ids].astype(np.float64), r, t, camera_matrices[n], dists[n])[0]
+                errors.append(np.linalg.norm(proj.reshape(-1, 2) - pts, axis=1))
+            error = np.median(np.concatenate(errors))
+            if error < best_error:
+                best, best_error = board_to_world, error
+
+        if best is not None:
+            board_rvecs[m], board_tvecs[m] = geometry.extmat_to_rtvecs(best)
+
+    return board_rvecs, board_tvecs
+
+
+def _skew(v):
+    """
+        Cross product matrices (..., 3, 3) of vectors (..., 3)
+    """
+    S = np.zeros(v.shape[:-1] + (3, 3))
+    S[..., 0, 1], S[..., 0, 2] = -v[..., 2], v[..., 1]
+    S[..., 1, 0], S[..., 1, 2] = v[..., 2], -v[..., 0]
+    S[..., 2, 0], S[..., 2, 1] = -v[..., 1], v[..., 0]
+    return S
 
-    # Flatten all the optimisable variables into a 1-D array
-    x0 = flatten_params(camera_matrices, distortion_coeffs, rvecs, tvecs, simple_focal=simple_focal, simple_distortion=simple_distortion, complex_distortion=complex_distortion)
+
+def _left_jacobians(rvecs):
+    """
+        Left Jacobians of SO(3) (K, 3, 3): rotating by rvec + d is, for a small d, rotating by rvec and then by J @ d
+    """
+    theta = np.linalg.norm(rvecs, axis=1)[:, None, None]
+    small = theta < 1e-8
+    theta = np.where(small, 1.0, theta)
+    a = np.where(small, 0.5, (1 - np.cos(theta)) / theta ** 2)
+    b = np.where(small, 1 / 6, (theta - np.sin(theta)) / theta ** 3)
+    S = _skew(rvecs)
+    return np.eye(3) + a * S + b * (S @ S)
+
+
+class BundleProblem:
+    """
+        Reprojection error of a calibration board seen by N cameras in M samples, as a function of the cameras'
+        intrinsics, the cameras' poses (camera-to-world) and the board's pose in each sample (board-to-world)
+
+        The pose of the origin camera is fixed (it defines the world), and so is the board geometry (it defines the
+        scale). The residuals and the Jacobian are computed for all the observations at once, and each pair of residuals
+        only depends on the parameters of one camera and one sample, so the Jacobian is stored as a sparse matrix.
+
+        Parameters are packed as: [intrinsics of each camera] [rvec, tvec of each camera except the origin]
+        [rvec, tvec of each board pose], with the intrinsics laid out like flatten_intrinsics()
+    """
+
+    def __init__(self, camera_matrices, distortion_coeffs, rvecs, tvecs, board_rvecs, board_tvecs, points_3d,
+                 cams_idx, samples_idx, points_idx, points2d, origin_camera=0,
+                 simple_focal=True, simple_distortion=False, complex_distortion=False, fix_intrinsics=False):
+
+        if simple_distortion and complex_distortion:
+            raise AssertionError('Distortion cannot be both simple and complex.')
+
+        self.nb_cams = len(camera_matrices)
+        self.nb_samples = len(board_rvecs)
+        self.origin = origin_camera
+
+        self.simple_focal = simple_focal
+        self.simple_distortion = simple_distortion
+        self.complex_distortion = complex_distortion
+        self.fix_intrinsics = fix_intrinsics
+
+        self.n_cm = 3 if simple_focal else 4
+        self.n_dc = 4 if simple_distortion else 8 if complex_distortion else 5
+        self.n_intr = 0 if fix_intrinsics else self.n_cm + self.n_dc
+
+        # The full distortion model always has 8 coefficients, the ones that are not optimised keep their value
+        self._camera_matrices = np.array(camera_matrices, dtype=np.float64).reshape(-1, 3, 3)
+        self._dist = np.zeros((self.nb_cams, 8))
+        for n, dc in enumerate(distortion_coeffs):
+            dc = np.asarray(dc, dtype=np.float64).ravel()[:8]
+            self._dist[n, :len(dc)] = dc
+        self._rvecs = np.array(rvecs, dtype=np.float64).reshape(-1, 3)
+        self._tvecs = np.array(tvecs, dtype=np.float64).reshape(-1, 3)
+        self._board_rvecs = np.array(board_rvecs, dtype=np.float64).reshape(-1, 3)
+        self._board_tvecs = np.array(board_tvecs, dtype=np.float64).reshape(-1, 3)
+        self._points3d = np.asarray(points_3d, dtype=np.float64)
+
+        # Observations of samples without a board pose can't be used
+        keep = ~np.isnan(self._board_rvecs[samples_idx]).any(axis=1) & ~np.isnan(points2d).any(axis=1)
+        self.cams_idx = np.asarray(cams_idx)[keep]
+        self.samples_idx = np.asarray(samples_idx)[keep]
+        self.points_idx = np.asarray(points_idx)[keep]
+        self.points2d = np.asarray(points2d, dtype=np.float64)[keep]
+        self._board_rvecs[np.isnan(self._board_rvecs).any(axis=1)] = 0.0
+        self._board_tvecs[np.isnan(self._board_tvecs).any(axis=1)] = 0.0
+
+        # Columns of each block of parameters
+        self._extr_cams = np.array([n for n in range(self.nb_cams) if n != self.origin])
+        self._extr_col = np.full(self.nb_cams, -1)
+        self._extr_col[self._extr_cams] = self.nb_cams * self.n_intr + 6 * np.arange(len(self._extr_cams))
+        self._board_col = self.nb_cams * self.n_intr + 6 * len(self._extr_cams)
+        self.nb_params = self._board_col + 6 * self.nb_samples
+
+        # Observations of the same (camera, sample) pair share the board-to-camera transform
+        pairs, self.pair_idx = np.unique(self.cams_idx * self.nb_samples + self.samples_idx, return_inverse=True)
+        self.pair_cams, self.pair_samples = pairs // self.nb_samples, pairs % self.nb_samples
+
+        self._structure = self._jacobian_structure()
+
+    @property
+    def nb_observations(self):
+        return len(self.points2d)
+
+    def pack(self):
+        """
+            The parameters vector, from the current values
+        """
+        blocks = []
+        if not self.fix_intrinsics:
+            blocks.append(flatten_intrinsics(self._camera_matrices, self._dist,
+                                             simple_focal=self.simple_focal,
+                                             simple_distortion=self.simple_distortion,
+                                             complex_distortion=self.complex_distortion))
+        blocks.append(flatten_extrinsics(self._rvecs[self._extr_cams], self._tvecs[self._extr_cams]).ravel())
+        blocks.append(flatten_extrinsics(self._board_rvecs, self._board_tvecs))
+        return np.concatenate(blocks)
+
+    def unpack(self, params):
+        """
+            Camera matrices (N, 3, 3), distortion coefficients (N, 8), cameras rvecs and tvecs (N, 3),
+            board rvecs and tvecs (M, 3) from a parameters vector
+        """
+        camera_matrices, dist = self._camera_matrices.copy(), self._dist.copy()
+        if not self.fix_intrinsics:
+            cm, dc = unflatten_intrinsics(params[:self.nb_cams * self.n_intr],
+                                          simple_focal=self.simple_focal,
+                                          simple_distortion=self.simple_distortion,
+                                          complex_distortion=self.complex_distortion)
+            camera_matrices = cm
+            dist[:, :self.n_dc] = dc
+
+        rvecs, tvecs = self._rvecs.copy(), self._tvecs.copy()
+        if len(self._extr_cams):
+            r, t = unflatten_extrinsics(params[self.nb_cams * self.n_intr:self._board_col])
+            rvecs[self._extr_cams], tvecs[self._extr_cams] = r, t
+        board_rvecs, board_tvecs = unflatten_extrinsics(params[self._board_col:])
+
+        return camera_matrices, dist, rvecs, tvecs, board_rvecs, board_tvecs
+
+    def _jacobian_structure(self):
+        """
+            Rows and columns of the non-zero entries of the Jacobian, in the order _project() fills them
+        """
+        nb_obs = self.nb_observations
+        rows_pair = np.stack([2 * np.arange(nb_obs), 2 * np.arange(nb_obs) + 1], axis=1)     # (K, 2)
+
+        def block(first_col, width, mask=slice(None)):
+            cols = first_col[:, None] + np.arange(width)[None, :]                           # (k, w)
+            rows = np.broadcast_to(rows_pair[mask][:, :, None], (len(cols), 2, width))
+            cols = np.broadcast_to(cols[:, None, :], (len(cols), 2, width))
+            return rows.ravel(), cols.ravel()
+
+        blocks = [block(self.cams_idx * self.n_intr, self.n_intr)]
+        not_origin = self.cams_idx != self.origin
+        blocks.append(block(self._extr_col[self.cams_idx[not_origin]], 6, not_origin))
+        blocks.append(block(self._board_col + 6 * self.samples_idx, 6))
+
+        rows = np.concatenate([b[0] for b in blocks])
+        cols = np.concatenate([b[1] for b in blocks])
+        return rows, cols
+
+    def sparsity(self):
+        """
+            Sparsity structure of the Jacobian (for finite differences)
+        """
+        rows, cols = self._structure
+        return csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(2 * self.nb_observations, self.nb_params))
+
+    def _project(self, params, with_jacobian=False):
+
+        camera_matrices, dist, rvecs, tvecs, board_rvecs, board_tvecs = self.unpack(params)
+        n, pair = self.cams_idx, self.pair_idx
+        pn, pm = self.pair_cams, self.pair_samples
+
+        Rct = Rotation.from_rotvec(rvecs).as_matrix().transpose(0, 2, 1)
+        R_boards = Rotation.from_rotvec(board_rvecs).as_matrix()
+
+        # Board -> camera, for each (camera, sample) pair: X = Rc^T (Rb Xb + tb - tc)
+        R_pairs = Rct[pn] @ R_boards[pm]
+        t_pairs = np.einsum('qij,qj->qi', Rct[pn], board_tvecs[pm] - tvecs[pn])
+        cam_points = (R_pairs @ self._points3d.T + t_pairs[:, :, None])[pair, :, self.points_idx]      # (K, 3)
+
+        X, Y, Z = cam_points.T
+        x, y = X / Z, Y / Z
+        r2 = x * x + y * y
+        r4, r6 = r2 * r2, r2 * r2 * r2
+        k1, k2, p1, p2, k3, k4, k5, k6 = dist[n].T
+        a = 1 + k1 * r2 + k2 * r4 + k3 * r6
+        b = 1 + k4 * r2 + k5 * r4 + k6 * r6
+        s = a / b
+        xd = x * s + 2 * p1 * x * y + p2 * (r2 + 2 * x * x)
+        yd = y * s + p1 * (r2 + 2 * y * y) + 2 * p2 * x * y
+
+        fx, fy = camera_matrices[n, 0, 0], camera_matrices[n, 1, 1]
+        cx, cy = camera_matrices[n, 0, 2], camera_matrices[n, 1, 2]
+        projected = np.stack([fx * xd + cx, fy * yd + cy], axis=1)
+
+        if not with_jacobian:
+            return projected, None
+
+        nb_obs = len(x)
+
+        J_intr = np.zeros((nb_obs, 2, self.n_intr))
+        if self.n_intr:
+            if self.simple_focal:
+                J_intr[:, 0, 0], J_intr[:, 1, 0] = xd, yd
+                J_intr[:, 0, 1], J_intr[:, 1, 2] = 1.0, 1.0
+            else:
+                J_intr[:, 0, 0], J_intr[:, 0, 1] = xd, 1.0
+                J_intr[:, 1, 2], J_intr[:, 1, 3] = yd, 1.0
+
+            # In OpenCV's order: k1, k2, p1, p2, k3, k4, k5, k6 (times fx or fy)
+            rb = np.stack([r2, r4, r6], axis=1) / b[:, None]
+            J_dist = np.empty((nb_obs, 2, 8))
+            J_dist[:, 0, [0, 1, 4]] = x[:, None] * rb
+            J_dist[:, 1, [0, 1, 4]] = y[:, None] * rb
+            J_dist[:, 0, 5:] = -(x * s)[:, None] * rb
+            J_dist[:, 1, 5:] = -(y * s)[:, None] * rb
+            J_dist[:, 0, 2], J_dist[:, 0, 3] = 2 * x * y, r2 + 2 * x * x
+            J_dist[:, 1, 2], J_dist[:, 1, 3] = r2 + 2 * y * y, 2 * x * y
+            J_dist[:, 0] *= fx[:, None]
+            J_dist[:, 1] *= fy[:, None]
+            J_intr[:, :, self.n_cm:] = J_dist[:, :, :self.n_dc]
+
+        # Projection w.r.t. the point in camera coordinates
+        ds = ((k1 + 2 * k2 * r2 + 3 * k3 * r4) * b - a * (k4 + 2 * k5 * r2 + 3 * k6 * r4)) / (b * b)
+        dxd_dx = s + 2 * x * x * ds + 2 * p1 * y + 6 * p2 * x
+        dxd_dy = 2 * x * y * ds + 2 * p1 * x + 2 * p2 * y
+        dyd_dx = 2 * x * y * ds + 2 * p1 * x + 2 * p2 * y
+        dyd_dy = s + 2 * y * y * ds + 6 * p1 * y + 2 * p2 * x
+
+        duv_dxy = np.empty((nb_obs, 2, 2))
+        duv_dxy[:, 0, 0], duv_dxy[:, 0, 1] = fx * dxd_dx, fx * dxd_dy
+        duv_dxy[:, 1, 0], duv_dxy[:, 1, 1] = fy * dyd_dx, fy * dyd_dy
+        dxy_dX = np.zeros((nb_obs, 2, 3))
+        dxy_dX[:, 0, 0], dxy_dX[:, 0, 2] = 1 / Z, -x / Z
+        dxy_dX[:, 1, 1], dxy_dX[:, 1, 2] = 1 / Z, -y / Z
+        duv_dX = duv_dxy @ dxy_dX                                                            # (K, 2, 3)
+
+        # Translations: dX/dtb = Rc^T and dX/dtc = -Rc^T
+        J_cam = np.empty((nb_obs, 2, 6))
+        J_board = np.empty((nb_obs, 2, 6))
+        J_board[:, :, 3:] = duv_dX @ np.take(Rct, n, axis=0)
+        J_cam[:, :, 3:] = -J_board[:, :, 3:]
+
+        # Rotations, with the left Jacobians: Rb Xb moves by (Jl(rb) d) x (Rb Xb) when rb moves by d, so
+        # dX/drb = -[X - t]x Rc^T Jl(rb), and similarly dX/drc = [X]x Rc^T Jl(rc)
+        B_pairs = Rct[pn] @ _left_jacobians(board_rvecs)[pm]
+        C_cams = Rct @ _left_jacobians(rvecs)
+        J_board[:, :, :3] = np.cross((cam_points - np.take(t_pairs, pair, axis=0))[:, None, :], duv_dX) @ np.take(B_pairs, pair, axis=0)
+        J_cam[:, :, :3] = np.cross(duv_dX, cam_points[:, None, :]) @ np.take(C_cams, n, axis=0)
+
+        return projected, (J_intr, J_cam, J_board)
+
+    def residuals(self, params):
+        """
+            Reprojection errors (in pixels) of all the observations, as [u0, v0, u1, v1, ...]
+        """
+        projected, _ = self._project(params)
+        return (projected - self.points2d).ravel()
+
+    def jacobian_blocks(self, params):
+        """
+            Residuals (K, 2), and the non-zero blocks of the Jacobian for each observation: w.r.t. its camera's
+            intrinsics (K, 2, n_intr), its camera's pose (K, 2, 6) and the board pose (K, 2, 6)
+        """
+        projected, blocks = self._project(params, with_jacobian=True)
+        return projected - self.points2d, blocks
+
+    def jacobian(self, params):
+        """
+            Analytic Jacobian of the residuals, as a sparse (2K, nb_params) matrix
+        """
+        _, (J_intr, J_cam, J_board) = self._project(params, with_jacobian=True)
+        not_origin = self.cams_idx != self.origin
+        data = [J_intr.ravel(), J_cam[not_origin].ravel(), J_board.ravel()]
+        rows, cols = self._structure
+        return csr_matrix((np.concatenate(data), (rows, cols)), shape=(2 * self.nb_observations, self.nb_params))
+
+    def errors(self, params):
+        """
+            Per-observation reprojection error (euclidean distance, in pixels)
+        """
+        return np.linalg.norm(self.residuals(params).reshape(-1, 2), axis=1)
+
+
+# Robust losses, as in scipy.optimize.least_squares: rho(z) and rho'(z), with z the squared error over f_scale squared
+LOSSES = {
+    'linear': lambda z: (z, np.ones_like(z)),
+    'soft_l1': lambda z: (2 * (np.sqrt(1 + z) - 1), 1 / np.sqrt(1 + z)),
+    'huber': lambda z: (np.where(z <= 1, z, 2 * np.sqrt(z) - 1), np.where(z <= 1, 1.0, 1 / np.sqrt(np.maximum(z, 1)))),
+    'cauchy': lambda z: (np.log1p(z), 1 / (1 + z)),
+    'arctan': lambda z: (np.arctan(z), 1 / (1 + z * z)),
+}
+
+
+def schur_levenberg_marquardt(problem, x0, loss='soft_l1', f_scale=1.0, max_iterations=100, ftol=1e-8, xtol=1e-10,
+                              max_time=None, verbose=False):
+    """
+        Levenberg-Marquardt for a BundleProblem, with the board poses eliminated by a Schur complement
+
+        Each observation depends on one camera and one board pose only, so the board poses part of the normal
+        equations is block-diagonal (6x6 per sample) and cheap to invert, which leaves a small dense system for the
+        cameras parameters. Robust losses are applied by reweighting each observation (on its 2D error).
+        If max_time (in seconds) is given, no new iteration is started after that, and the best parameters so far
+        are returned.
+
+        Returns
+        -------
+        x : np.ndarray
+            The optimised parameters
+        info : dict
+            'cost', 'initial_cost', 'iterations', 'nfev', 'njev', 'success' and 'message'
+    """
+    if loss not in LOSSES:
+        raise ValueError(f"Unknown loss '{loss}' (must be one of {', '.join(LOSSES)})")
+    rho = LOSSES[loss]
+    f2 = float(f_scale) ** 2
+
+    nb_cams, nb_samples = problem.nb_cams, problem.nb_samples
+    n_intr = problem.n_intr
+    p = n_intr + 6
+    q = p + 6
+
+    def robust_cost(res):
+        values, weights = rho((res ** 2).sum(axis=1) / f2)
+        return 0.5 * f2 * values.sum(), weights
+
+    # Group the observations by (camera, sample) pair, and pad the pairs to the same number of observations
+    pairs, pair_idx = np.unique(problem.cams_idx * nb_samples + problem.samples_idx, return_inverse=True)
+    order = np.argsort(pair_idx, kind='stable')
+    counts = np.bincount(pair_idx, minlength=len(pairs))
+    slots = np.arange(len(order)) - np.repeat(np.cumsum(counts) - counts, counts)
+    pair_cams, pair_samples = pairs // nb_samples, pairs % nb_samples
+    pair_sorted = pair_idx[order]
+    max_count = counts.max() if len(counts) else 0
+
+    # The origin camera's pose is fixed, and samples without observations keep their (meaningless) pose
+    dead = np.zeros((nb_cams, p), dtype=bool)
+    dead[problem.origin, n_intr:] = True
+    dead = dead.ravel()
+    unseen = np.bincount(pair_samples, minlength=nb_samples) == 0
+
+    def normal_equations(res, blocks, weights):
+        J = np.concatenate(blocks, axis=2) * np.sqrt(weights)[:, None, None]          # (K, 2, q)
+        r = res * np.sqrt(weights)[:, None]
+        A = np.empty((len(pairs), q, q))
+        g = np.empty((len(pairs), q))
+        chunk = max(1, 2 ** 23 // (max_count * 2 * q))
+        for start in range(0, len(pairs), chunk):
+            stop = min(start + chunk, len(pairs))
+            sel = (pair_sorted >= start) & (pair_sorted < stop)
+            Jp = np.zeros((stop - start, max_count, 2, q))
+            rp = np.zeros((stop - start, max_count, 2))
+            Jp[pair_sorted[sel] - start, slots[sel]] = J[order[sel]]
+            rp[pair_sorted[sel] - start, slots[sel]] = r[order[sel]]
+            Jp = Jp.reshape(stop - start, -1, q)
+            A[start:stop] = Jp.transpose(0, 2, 1) @ Jp
+            g[start:stop] = np.einsum('pli,pl->pi', Jp, rp.reshape(stop - start, -1))
+
+        U = np.zeros((nb_cams, p, p))
+        V = np.zeros((nb_samples, 6, 6))
+        W = np.zeros((nb_cams, nb_samples, p, 6))
+        g_cams = np.zeros((nb_cams, p))
+        g_boards = np.zeros((nb_samples, 6))
+        np.add.at(U, pair_cams, A[:, :p, :p])
+        np.add.at(V, pair_samples, A[:, p:, p:])
+        W[pair_cams, pair_samples] = A[:, :p, p:]
+        np.add.at(g_cams, pair_cams, g[:, :p])
+        np.add.at(g_boards, pair_samples, g[:, p:])
+        V[unseen] = np.eye(6)
+        return U, V, W, g_cams, g_boards
+
+    def solve(U, V, W, g_cams, g_boards, lam):
+        diag_U = np.einsum('nii->ni', U)
+        U_damped = U + lam * np.einsum('ni,ij->nij', np.maximum(diag_U, 1e-12), np.eye(p))
+        V_damped = V + lam * np.einsum('mi,ij->mij', np.maximum(np.einsum('mii->mi', V), 1e-12), np.eye(6))
+        V_inv = np.linalg.inv(V_damped)
+
+        W_mat = W.transpose(0, 2, 1, 3).reshape(nb_cams * p, nb_samples * 6)
+        Y_mat = np.einsum('nmpi,mij->nmpj', W, V_inv).transpose(0, 2, 1, 3).reshape(nb_cams * p, nb_samples * 6)
+
+        S = -(Y_mat @ W_mat.T)
+        for n in range(nb_cams):
+            S[n * p:(n + 1) * p, n * p:(n + 1) * p] += U_damped[n]
+        rhs = -g_cams.ravel() + Y_mat @ g_boards.ravel()
+
+        S[dead, :] = 0.0
+        S[:, dead] = 0.0
+        S[dead, dead] = 1.0
+        rhs[dead] = 0.0
+
+        try:
+            delta_cams = np.linalg.solve(S, rhs)
+        except np.linalg.LinAlgError:
+            delta_cams = np.linalg.lstsq(S, rhs, rcond=None)[0]
+
+        delta_boards = np.einsum('mij,mj->mi', V_inv, -g_boards - W_mat.T.dot(delta_cams).reshape(nb_samples, 6))
+
+        delta = np.zeros(problem.nb_params)
+        delta_cams = delta_cams.reshape(nb_cams, p)
+        delta[:nb_cams * n_intr] = delta_cams[:, :n_intr].ravel()
+        delta[nb_cams * n_intr:problem._board_col] = delta_cams[problem._extr_cams, n_intr:].ravel()
+        delta[problem._board_col:] = delta_boards.ravel()
+        return delta
+
+    start_time = time.perf_counter()
+    x = np.array(x0, dtype=np.float64)
+    res, blocks = problem.jacobian_blocks(x)
+    cost, weights = robust_cost(res)
+    initial_cost = cost
+    nfev, njev = 1, 1
+    lam = 1e-3
+    message, success = 'The maximum number of iterations is exceeded.', False
+
+    if verbose:
+        print(f"{'Iteration':>10} {'Cost':>14} {'Cost reduction':>15} {'Step norm':>12} {'Damping':>10}")
+        print(f"{0:>10} {cost:>14.4e}")
+
+    iteration = 0
+    for iteration in range(1, max_iterations + 1):
+        if max_time is not None and time.perf_counter() - start_time > max_time:
+            message, success, iteration = 'The time budget is exceeded.', False, iteration - 1
+            break
+
+        U, V, W, g_cams, g_boards = normal_equations(res, blocks, weights)
+
+        while True:
+            delta = solve(U, V, W, g_cams, g_boards, lam)
+            x_new = x + delta
+            res_new = problem.residuals(x_new).reshape(-1, 2)
+            nfev += 1
+            cost_new, weights_new = robust_cost(res_new)
+            if np.isfinite(cost_new) and cost_new < cost:
+                lam = max(lam / 10, 1e-12)
+                break
+            lam *= 10
+            if lam > 1e12:
+                break
+
+        if not (np.isfinite(cost_new) and cost_new < cost):
+            message, success = 'The cost can not be reduced anymore.', True
+            break
+
+        reduction = cost - cost_new
+        step = np.linalg.norm(delta)
+        x, cost = x_new, cost_new
+
+        if verbose:
+            print(f"{iteration:>10} {cost:>14.4e} {reduction:>15.2e} {step:>12.2e} {lam:>10.1e}")
+
+        if reduction < ftol * cost:
+            message, success = '`ftol` termination condition is satisfied.', True
+            break
+        if step < xtol * (xtol + np.linalg.norm(x)):
+            message, success = '`xtol` termination condition is satisfied.', True
+            break
+
+        res, blocks = problem.jacobian_blocks(x)
+        weights = robust_cost(res)[1]
+        njev += 1
+
+    return x, {'cost': cost,
+               'initial_cost': initial_cost,
+               'iterations': iteration,
+               'nfev': nfev,
+               'njev': njev,
+               'success': success,
+               'message': message}
+
+
+def _samples_errors(problem, errors):
+    """
+        Median error of each sample in the camera where it is the worst (NaN for the samples without observations)
+    """
+    # Sort the errors by (camera, sample) pair to take the median of each pair at once
+    order = np.lexsort((errors, problem.pair_idx))
+    counts = np.bincount(problem.pair_idx, minlength=len(problem.pair_cams))
+    starts = np.cumsum(counts) - counts
+    sorted_errors = errors[order]
+    pair_medians = 0.5 * (sorted_errors[starts + (counts - 1) // 2] + sorted_errors[starts + counts // 2])
+
+    medians = np.full(problem.nb_samples, -np.inf)
+    np.maximum.at(medians, problem.pair_samples, pair_medians)
+    medians[np.isinf(medians)] = np.nan
+    return medians
+
+
+def reseed_board_poses(problem, params, points_2d, points_ids, points_3d, min_error=2.0, factor=5.0):
+    """
+        Planar boards have two plausible poses from some points of view, and a sample that started in the wrong one
+        does not get out of it. This re-estimates the pose of the samples that still reproject badly in at least one
+        camera (median error above min_error pixels and factor times the overall median), using the refined cameras.
+
+        Returns
+        -------
+        params : np.ndarray
+            The parameters, with the new board poses
+        samples : list of int
+            The samples whose pose was replaced (the new pose reprojects better)
+    """
+    errors = problem.errors(params)
+    if len(errors) == 0:
+        return params, []
+
+    medians = _samples_errors(problem, errors)
+    bad = np.flatnonzero(medians > max(min_error, factor * np.median(errors)))
+    if len(bad) == 0:
+        return params, []
+
+    camera_matrices, dist, rvecs, tvecs, board_rvecs, board_tvecs = problem.unpack(params)
+    new_rvecs, new_tvecs = estimate_board_poses(camera_matrices, dist, rvecs, tvecs,
+                                                points_2d, points_ids, points_3d, samples=bad)
+    candidate = params.copy()
+    for m in bad:
+        if not np.isnan(new_rvecs[m]).any():
+            candidate[problem._board_col + 6 * m:problem._board_col + 6 * (m + 1)] = np.r_[new_rvecs[m], new_tvecs[m]]
+
+    new_medians = _samples_errors(problem, problem.errors(candidate))
+    improved = [int(m) for m in bad if new_medians[m] < medians[m]]
+
+    updated = params.copy()
+    for m in improved:
+        cols = slice(problem._board_col + 6 * m, problem._board_col + 6 * (m + 1))
+        updated[cols] = candidate[cols]
+    return updated, improved
+
+
+def run_bundle_adjustment(camera_matrices, distortion_coeffs, rvecs, tvecs, points_2d, points_ids, points_3d,
+                          board_rvecs=None, board_tvecs=None, origin_camera=0,
+                          simple_focal=True, simple_distortion=False, complex_distortion=False, fix_intrinsics=False,
+                          solver='schur', jacobian='analytic', loss='soft_l1', f_scale=1.0, ftol=1e-8,
+                          max_iterations=100, max_time=None, reseed=2, verbose=True, full_output=False):
+    """
+        Refines the cameras intrinsics and poses (camera-to-world), and the pose of the board in each sample,
+        by minimising the reprojection error of the board points in every camera that saw them
+
+        Parameters
+        ----------
+        camera_matrices, distortion_coeffs, rvecs, tvecs
+            Initial guess for the N cameras
+        points_2d, points_ids : nested lists N[M[array]]
+            Detected points and their IDs, for each of N cameras in each of M samples (None or empty if not seen)
+        points_3d : np.ndarray
+            Board points, in board coordinates (they are fixed, so they set the scale)
+        board_rvecs, board_tvecs : np.ndarray or None
+            Initial board poses (board-to-world) for the M samples, estimated with estimate_board_poses() if None
+        origin_camera : int
+            The camera whose pose is kept fixed
+        solver : str
+            'schur' (Levenberg-Marquardt with the board poses eliminated), or 'scipy' (least_squares with a sparse
+            Jacobian, slower but useful for comparison)
+        jacobian : str
+            Only for the 'scipy' solver: 'analytic', or a finite differences scheme ('2-point', '3-point'...)
+        loss, f_scale
+            Robust loss on the reprojection errors (in pixels), see scipy.optimize.least_squares
+        max_time : float or None
+            Only for the 'schur' solver: time budget (in seconds) for the whole thing, after which the best
+            parameters so far are returned
+        reseed : int
+            How many times the board poses that are still off after optimising can be re-estimated (and the
+            optimisation run again)
+        full_output : bool
+            Also return a dict with the board poses and a few statistics
+
+        Returns
+        -------
+        camera_matrices, distortion_coeffs, rvecs, tvecs (and a dict if full_output)
+    """
+
+    start_time = time.perf_counter()
+
+    def remaining_time():
+        return None if max_time is None else max(0.0, max_time - (time.perf_counter() - start_time))
+
+    if board_rvecs is None or board_tvecs is None:
+        board_rvecs, board_tvecs = estimate_board_poses(camera_matrices, distortion_coeffs, rvecs, tvecs,
+                                                        points_2d, points_ids, points_3d)
+
+    problem = BundleProblem(camera_matrices, distortion_coeffs, rvecs, tvecs, board_rvecs, board_tvecs, points_3d,
+                            *flatten_observations(points_2d, points_ids),
+                            origin_camera=origin_camera,
+                            simple_focal=simple_focal,
+                            simple_distortion=simple_distortion,
+                            complex_distortion=complex_distortion,
+                            fix_intrinsics=fix_intrinsics)
 
     # Note: Points 2D, points 3D and points IDs are fixed - We do not optimise those!
+    x0 = problem.pack()
 
-    with alive_bar(title='Bundle adjustment...', force_tty=True) as bar:
-        with CallbackOutputStream(bar, keep_stdout=False):
-            result = least_squares(cost_func, x0,       # x0 contains all the optimisable variables
-                                   verbose=2,
-                                   x_scale='jac',
-                                   ftol=1e-8,
-                                   method='trf',
-                                   loss='cauchy',
-                                   f_scale=0.75,
-                                   args=(points_2d,     # Passed as a fixed parameters
-                                         points_ids,    # Passed as a fixed parameters
-                                         points_3d,     # Passed as a fixed parameters
-                                         reproj_weight, consistency_weight,     # Weights for the two types of errors
-                                         simple_focal, simple_distortion, complex_distortion,
-                                         interpolate))
-
-    camera_matrices_opt, distortion_coeffs_opt, rvecs_opt, tvecs_opt = unflatten_params(result.x, nb_cams=nb_cams, simple_focal=simple_focal, simple_distortion=simple_distortion)
-
-    return camera_matrices_opt, distortion_coeffs_opt, rvecs_opt, tvecs_opt
\ No newline at end of file
+    if solver == 'schur':
+        def optimise(x, iterations):
+            return schur_levenberg_marquardt(problem, x, loss=loss, f_scale=f_scale, ftol=ftol,
+                                             max_iterations=iterations, max_time=remaining_time(), verbose=verbose)
+
+    elif solver == 'scipy':
+        if jacobian == 'analytic':
+            jac_kwargs = {'jac': problem.jacobian}
+        else:
+            jac_kwargs = {'jac': jacobian, 'jac_sparsity': problem.sparsity()}
+
+        def optimise(x, iterations):
+            # LSMR needs tight tolerances here, or the trust region steps are too poor to converge
+            result = least_squares(problem.residuals, x, x_scale='jac', ftol=ftol, method='trf',
+                                   tr_solver='lsmr', tr_options={'atol': 1e-12, 'btol': 1e-12},
+                                   loss=loss, f_scale=f_scale, max_nfev=iterations,
+                                   verbose=2 if verbose else 0, **jac_kwargs)
+            return result.x, {'cost': result.cost, 'nfev': result.nfev, 'njev': result.njev,
+                              'success': result.success, 'message': result.message}
+    else:
+        raise ValueError(f"Unknown solver '{solver}' (must be 'schur' or 'scipy')")
+
+    def optimise_and_reseed():
+        # The cameras only need to be roughly right to find the boards that are stuck in the wrong pose,
+        # so the first pass is kept short when reseeding is enabled
+        x, result = optimise(x0, min(max_iterations, 20) if reseed else max_iterations)
+        nfev, njev, reseeded = result['nfev'], result['njev'], []
+        for _ in range(reseed):
+            if remaining_time() == 0:
+                break
+            x, samples = reseed_board_poses(problem, x, points_2d, points_ids, points_3d)
+            if not samples and result['success']:
+                break
+            reseeded += samples
+            x, result = optimise(x, max_iterations)
+            nfev, njev = nfev + result['nfev'], njev + result['njev']
+        result.update(nfev=nfev, njev=njev, reseeded=sorted(set(reseeded)), elapsed=time.perf_counter() - start_time)
+        return x, result
+
+    if verbose:
+        with alive_bar(title='Bundle adjustment...', force_tty=True) as bar:
+            with CallbackOutputStream(bar, keep_stdout=False):
+                x, result = optimise_and_reseed()
+    else:
+        x, result = optimise_and_reseed()
+
+    camera_matrices_opt, dist_opt, rvecs_opt, tvecs_opt, board_rvecs_opt, board_tvecs_opt = problem.unpack(x)
+    distortion_coeffs_opt = dist_opt[:, :8 if complex_distortion else 5]
+
+    if not full_output:
+        return camera_matrices_opt, distortion_coeffs_opt, rvecs_opt, tvecs_opt
+
+    # Samples without any usable observation have no pose
+    unseen = np.bincount(problem.samples_idx, minlength=problem.nb_samples) == 0
+    board_rvecs_opt[unseen], board_tvecs_opt[unseen] = np.nan, np.nan
+
+    errors_before, errors_after = problem.errors(x0), problem.errors(x)
+    info = {'board_rvecs': board_rvecs_opt,
+            'board_tvecs': board_tvecs_opt,
+            'nb_observations': problem.nb_observations,
+            'nb_params': problem.nb_params,
+            'rms_before': float(np.sqrt(np.mean(errors_before ** 2))) if len(errors_before) else np.nan,
+            'rms_after': float(np.sqrt(np.mean(errors_after ** 2))) if len(errors_after) else np.nan,
+            'per_camera_rms': np.array([np.sqrt(np.mean(errors_after[problem.cams_idx == n] ** 2))
+                                        if (problem.cams_idx == n).any() else np.nan for n in range(problem.nb_cams)]),
+            **result}
+
+    return camera_matrices_opt, distortion_coeffs_opt, rvecs_opt, tvecs_opt, info
@@ -1,3 +1,5 @@
+import threading
+from collections import OrderedDict
 import numpy as np
 np.set_printoptions(precision=3, suppress=True, threshold=150)
 import cv2
@@ -152,4 +154,82 @@ def undistortion(points2d, camera_matrix, dist_coeffs):
         dist_coeffs = dist_coeffs_minimal
     points_undist = cv2.undistortPoints(points2d, cameraMatrix=camera_matrix, distCoeffs=dist_coeffs, P=camera_matrix)
 
-    return points_undist.squeeze()
\ No newline at end of file
+    return points_undist.squeeze()
+
+
+##
+
+# Undistortion maps, shared by everything that needs undistorted frames (least recently used ones dropped beyond this)
+UNDISTORTION_CACHE_BYTES = 256 * 1024 ** 2
+
+_undistortion_cache = OrderedDict()
+_undistortion_cache_bytes = 0
+_undistortion_cache_lock = threading.Lock()
+
+
+def undistortion_maps(camera_matrix, dist_coeffs, imsize_hw, alpha=1.0, camera=None):
+    """
+        Maps for cv2.remap() to undistort frames of the given size, like cv2.undistort() with the new camera matrix from
+        cv2.getOptimalNewCameraMatrix(alpha). They are computed once per camera, intrinsics and size, and kept in a cache
+        of at most UNDISTORTION_CACHE_BYTES (the maps are in fixed-point, i.e. 6 bytes per pixel)
+
+        Parameters
+        ----------
+        camera : hashable or None
+            Optional camera identifier, to be able to drop its maps with clear_undistortion_maps()
+
+        Returns
+        -------
+        map1, map2, new_camera_matrix
+    """
+    global _undistortion_cache_bytes
+
+    camera_matrix = np.ascontiguousarray(camera_matrix, dtype=np.float64)
+    dist_coeffs = np.ascontiguousarray(dist_coeffs, dtype=np.float64).ravel()
+    h, w = int(imsize_hw[0]), int(imsize_hw[1])
+    key = (camera, camera_matrix.tobytes(), dist_coeffs.tobytes(), h, w, float(alpha))
+
+    with _undistortion_cache_lock:
+        maps = _undistortion_cache.get(key)
+        if maps is not None:
+            _undistortion_cache.move_to_end(key)
+            return maps
+
+    # Computed outside of the lock, the other cameras don't need to wait for this one
+    new_camera_matrix, _ = cv2.getOptimalNewCameraMatrix(camera_matrix, dist_coeffs, (w, h), alpha, (w, h))
+    map1, map2 = cv2.initUndistortRectifyMap(camera_matrix, dist_coeffs, None, new_camera_matrix, (w, h), cv2.CV_16SC2)
+    maps = (map1, map2, new_camera_matrix)
+    nb_bytes = map1.nbytes + map2.nbytes
+
+    with _undistortion_cache_lock:
+        if key not in _undistortion_cache:
+            _undistortion_cache[key] = maps
+            _undistortion_cache_bytes += nb_bytes
+            while _undistortion_cache_bytes > UNDISTORTION_CACHE_BYTES and len(_undistortion_cache) > 1:
+                _, (old_map1, old_map2, _) = _undistortion_cache.popitem(last=False)
+                _undistortion_cache_bytes -= old_map1.nbytes + old_map2.nbytes
+    return maps
+
+
+def clear_undistortion_maps(camera=None):
+    """
+        Drops the cached undistortion maps of a camera (all of them if camera is None)
+    """
+    global _undistortion_cache_bytes
+
+    with _undistortion_cache_lock:
+        for key in [k for k in _undistortion_cache if camera is None or k[0] == camera]:
+            map1, map2, _ = _undistortion_cache.pop(key)
+            _undistortion_cache_bytes -= map1.nbytes + map2.nbytes
+
+
+def undistort_frame(frame, camera_matrix, dist_coeffs, alpha=1.0, camera=None):
+    """
+        Undistorts a frame with the cached maps (see undistortion_maps())
+
+        Returns
+        -------
+        undistorted frame, new_camera_matrix
+    """
+    map1, map2, new_camera_matrix = undistortion_maps(camera_matrix, dist_coeffs, frame.shape[:2], alpha=alpha, camera=camera)
+    return cv2.remap(frame, map1, map2, cv2.INTER_LINEAR), new_camera_matrix
@@ -0,0 +1,359 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Union, Callable
+import numpy as np
+import cv2
+from alive_progress import alive_bar
+from mokap.calibration import DetectionTool, MonocularCalibrationTool, MultiviewCalibrationTool
+from mokap.core.replay import session_sources, open_stream
+from mokap.utils import fileio
+
+##
+
+# Each process gets its own detector (the aruco objects can't be pickled)
+_worker_detector: Union[DetectionTool, None] = None
+
+_DETECT_KWARGS = {'refine_markers': True, 'refine_points': True}
+
+# Bump this if DetectionTool.detect() changes in a way that changes the detections, to invalidate the caches
+_CACHE_VERSION = 1
+
+
+def _init_worker(board_params: dict):
+    global _worker_detector
+    cv2.setNumThreads(1)    # The parallelism is across processes
+    _worker_detector = DetectionTool(board_params)
+
+
+def _detect_chunk(cam_idx: int, source: dict, start: int, stop: int, stride: int):
+    """
+        Detects the board in frames [start, stop) of one camera's stream (every stride-th frame)
+    """
+    reader = open_stream(source['path'], shape=source['shape'], first=source['first'], count=source['count'])
+    numbers = reader.frame_numbers
+    detections = []
+    try:
+        for i in range(start, min(stop, reader.nb_frames), stride):
+            frame = reader.read(i)
+            if frame is None:
+                continue
+            points2d, points_ids = _worker_detector.detect(frame, **_DETECT_KWARGS)
+            if points2d is not None:
+                number = int(numbers[i]) if numbers is not None else i
+                detections.append((i, number, points2d, points_ids))
+    finally:
+        reader.close()
+    return cam_idx, len(range(start, min(stop, reader.nb_frames), stride)), detections
+
+
+def detection_settings_hash(board_params: dict, stride: int = 1) -> str:
+    """
+        Hash of everything (other than the video itself) that changes the detections: the board and detector
+        parameters, the detect() options and the stride
+    """
+    settings = DetectionTool(board_params).settings
+    settings.update(detect=_DETECT_KWARGS, stride=stride, version=_CACHE_VERSION)
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+def detections_cache_path(path: Union[Path, str], session: int = 0) -> Path:
+    path = Path(path)
+    if path.is_file():
+        path = path.parent
+    return path / f'detections_session{session}.npz'
+
+
+def _stream_signature(source: dict) -> str:
+    """ Changes if the stream is replaced or modified (for a folder of images, if files are added or removed) """
+    stat = source['path'].stat()
+    return f"{source['path'].name}:{stat.st_size}:{stat.st_mtime_ns}:{source['first']}:{source['count']}"
+
+
+def write_detections_cache(filepath: Union[Path, str], settings_hash: str, signatures: list, by_number: bool,
+                           detections: list):
+    """
+        Writes the detections of all the cameras to a npz file, in columns: for each camera, the frames keys (frame
+        numbers if by_number, indices otherwise), the offsets of each frame's points, and all the points and ids one
+        after the other
+    """
+    filepath = Path(filepath)
+    arrays = {}
+    for cam_idx, cam_detections in enumerate(detections):
+        keys = np.array(sorted(cam_detections), dtype=np.int64)
+        counts = [len(cam_detections[k][1]) for k in keys]
+        arrays[f'keys_{cam_idx}'] = keys
+        arrays[f'offsets_{cam_idx}'] = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        arrays[f'points_{cam_idx}'] = (np.concatenate([cam_detections[k][0] for k in keys]).astype(np.float32)
+                                       if len(keys) else np.zeros((0, 2), dtype=np.float32))
+        arrays[f'ids_{cam_idx}'] = (np.concatenate([cam_detections[k][1] for k in keys]).astype(np.int32)
+                                    if len(keys) else np.zeros(0, dtype=np.int32))
+    header = {'settings': settings_hash, 'streams': signatures, 'by_number': by_number}
+
+    # Write to a temporary file first, so an interrupted run can't leave a broken cache behind
+    tmp = filepath.with_suffix('.tmp')
+    with open(tmp, 'wb') as f:
+        np.savez(f, header=np.array(json.dumps(header)), **arrays)
+    os.replace(tmp, filepath)
+
+
+def read_detections_cache(filepath: Union[Path, str], settings_hash: str, signatures: list, by_number: bool) -> list:
+    """
+        Reads the cached detections of the cameras whose stream and detection settings did not change since the cache
+        was written, as {frame_key: (points2d, points_ids)} (None for the others)
+    """
+    filepath = Path(filepath)
+    detections = [None] * len(signatures)
+    if not filepath.is_file():
+        return detections
+
+    try:
+        with np.load(filepath) as cache:
+            header = json.loads(str(cache['header']))
+            if header['settings'] != settings_hash or header['by_number'] != by_number:
+                return detections
+            for cam_idx, signature in enumerate(signatures):
+                if signature is None or cam_idx >= len(header['streams']) or header['streams'][cam_idx] != signature:
+                    continue
+                keys, offsets = cache[f'keys_{cam_idx}'], cache[f'offsets_{cam_idx}']
+                points, ids = cache[f'points_{cam_idx}'], cache[f'ids_{cam_idx}']
+                detections[cam_idx] = {int(k): (points[a:b], ids[a:b])
+                                       for k, a, b in zip(keys, offsets[:-1], offsets[1:])}
+    except (OSError, ValueError, KeyError) as e:
+        print(f"[WARN] Can't read the detections cache {filepath.name} ({e}), detecting again")
+        return [None] * len(signatures)
+    return detections
+
+
+def detect_session(path: Union[Path, str], board_params: dict, session: int = 0, workers: Union[int, None] = None,
+                   stride: int = 1, chunk_size: int = 250, callback: Union[Callable, None] = None, cache: bool = True,
+                   silent: bool = False):
+    """
+        Detects the calibration board in every frame of every camera of a recorded session, on a pool of processes
+
+        Each camera's stream is split in chunks of chunk_size frames (rounded up to a multiple of stride), so that all the cores are busy even with few
+        cameras, and video files are still decoded sequentially within a chunk.
+
+        The detections are cached in the acquisition folder (see detections_cache_path()), and only the cameras whose
+        stream, or the board, detector parameters or stride changed since are detected again.
+
+        Parameters
+        ----------
+        path : Path or str
+            The acquisition folder
+        board_params : dict
+            The board's 'rows', 'cols', 'square_length' and 'markers_size'
+        workers : int or None
+            Number of processes (all the cores if None)
+        stride : int
+            Only look at every stride-th frame
+        callback : callable or None
+            Called with (cam_idx, frame_key, points2d, points_ids) for each detection, as soon as its chunk is done
+            (so not in order)
+        cache : bool
+            Whether to use and update the detections cache
+
+        Returns
+        -------
+        dict
+            'cameras' (names), 'shapes', 'by_number' (whether the frames keys are the cameras' frame numbers, or the
+            frames indices), and 'detections': for each camera, {frame_key: (points2d, points_ids)}
+    """
+    path = Path(path)
+    metadata = fileio.read_metadata(path.parent if path.is_file() else path)
+    sources = session_sources(path, session)
+    session_metadata = metadata['sessions'][session]
+    names = [cam['name'] for cam in session_metadata['cameras']]
+
+    nb_frames = []
+    have_numbers = []
+    for name, source in zip(names, sources):
+        if source is None:
+            if not silent:
+                print(f"[WARN] Can't find the stream of camera {name}, skipping it")
+            nb_frames.append(0)
+            continue
+        reader = open_stream(source['path'], shape=source['shape'], first=source['first'], count=source['count'])
+        nb_frames.append(reader.nb_frames)
+        have_numbers.append(reader.frame_numbers is not None)
+        reader.close()
+
+    # Like in SessionReplay, frames are matched across cameras by frame number if possible, by index otherwise
+    by_number = bool(session_metadata.get('hardware_triggered', False)) and len(have_numbers) > 0 and all(have_numbers)
+
+    settings_hash = detection_settings_hash(board_params, stride)
+    signatures = [_stream_signature(source) if source is not None else None for source in sources]
+    cache_path = detections_cache_path(path, session)
+
+    cached = read_detections_cache(cache_path, settings_hash, signatures, by_number) if cache else [None] * len(names)
+    detections = [cam_cached if cam_cached is not None else {} for cam_cached in cached]
+    if callback is not None:
+        for cam_idx, cam_cached in enumerate(cached):
+            for key, (points2d, points_ids) in (cam_cached or {}).items():
+                callback(cam_idx, key, points2d, points_ids)
+    if not silent and any(c is not None for c in cached):
+        print(f"[INFO] Using the cached detections of camera(s) "
+              f"{', '.join(name for name, c in zip(names, cached) if c is not None)}")
+
+    # Chunks have to start on multiples of the stride, or the frames looked at would not be every stride-th one
+    chunk_size = -(-max(1, chunk_size) // stride) * stride
+    chunks = [(cam_idx, source, start, start + chunk_size, stride)
+              for cam_idx, source in enumerate(sources) if source is not None and cached[cam_idx] is None
+              for start in range(0, nb_frames[cam_idx], chunk_size)]
+
+    if chunks:
+        total = sum(len(range(0, n, stride)) for n, c in zip(nb_frames, cached) if c is None)
+
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                 initializer=_init_worker, initargs=(board_params,)) as executor:
+            futures = [executor.submit(_detect_chunk, *chunk) for chunk in chunks]
+
+            with alive_bar(total, title='Detecting board...', force_tty=True, disable=silent) as bar:
+                for future in as_completed(futures):
+                    cam_idx, nb_done, chunk_detections = future.result()
+                    for i, number, points2d, points_ids in chunk_detections:
+                        key = number if by_number else i
+                        detections[cam_idx][key] = (points2d, points_ids)
+                        if callback is not None:
+                            callback(cam_idx, key, points2d, points_ids)
+                    bar(nb_done)
+
+        if cache:
+            try:
+                write_detections_cache(cache_path, settings_hash, signatures, by_number, detections)
+            except OSError as e:
+                print(f"[WARN] Can't write the detections cache ({e})")
+
+    if not silent:
+        for name, n, cam_detections in zip(names, nb_frames, detections):
+            print(f"[INFO] Camera {name}: board found in {len(cam_detections)} of {len(range(0, n, stride))} frames")
+
+    return {'cameras': names,
+            'shapes': [tuple(s['shape'][:2]) if s is not None else None for s in sources],
+            'by_number': by_number,
+            'detections': detections}
+
+
+def calibrate_session(path: Union[Path, str], board_params: dict, session: int = 0, output: Union[Path, str, None] = None,
+                      origin_camera: int = 0, workers: Union[int, None] = None, stride: int = 1, max_samples: int = 200,
+                      simple_focal: bool = True, simple_distortion: bool = False, complex_distortion: bool = False,
+                      max_intrinsics_samples: Union[int, None] = 40, refine: bool = True, cache: bool = True,
+                      silent: bool = False):
+    """
+        Calibrates all the cameras (intrinsics and extrinsics) from a recorded calibration session, and writes the
+        parameters to a toml file (parameters.toml in the acquisition folder by default)
+
+        The board is detected in all the frames (see detect_session()), and the detections are streamed to one
+        MonocularCalibrationTool per camera for the intrinsics, as they come. Then, up to max_samples frames where at
+        least two cameras saw the board are picked (evenly spread over the session) for the MultiviewCalibrationTool:
+        the monocular poses give a first estimate of the cameras arrangement, which is refined with bundle adjustment.
+        The detections are cached, so running this again with other options (e.g. another distortion model) is quick.
+        The intrinsics of each camera are computed on the max_intrinsics_samples most informative samples (all of them
+        if None, but that's much slower and usually not better).
+
+        Returns
+        -------
+        dict
+            {camera_name: {'camera_matrix', 'dist_coeffs', 'rvec', 'tvec'}} (no 'rvec' and 'tvec' if the extrinsics
+            could not be computed)
+    """
+    path = Path(path)
+    if path.is_file():
+        path = path.parent
+    output = path / 'parameters.toml' if output is None else Path(output)
+
+    metadata = fileio.read_metadata(path)
+    cameras = metadata['sessions'][session]['cameras']
+    nb_cams = len(cameras)
+
+    # 1. Detection, with the intrinsics samples selected as the detections come in
+    mono_tools = [MonocularCalibrationTool(board_params=board_params,
+                                           imsize_hw=cam.get('shape', [cam['height'], cam['width']])[:2])
+                  for cam in cameras]
+
+    def register(cam_idx, key, points2d, points_ids):
+        mono_tools[cam_idx].set_detection(points2d, points_ids)
+        mono_tools[cam_idx].auto_register_area_based(area_threshold=0.2, nb_points_threshold=4)
+
+    result = detect_session(path, board_params, session=session, workers=workers, stride=stride,
+                            callback=register, cache=cache, silent=silent)
+    names, detections = result['cameras'], result['detections']
+
+    # 2. Intrinsics
+    calibrated = {}
+    for cam_idx, (name, tool) in enumerate(zip(names, mono_tools)):
+        # The first round uses the simple distortion model, then the full model starts from it
+        for _ in range(2):
+            tool.compute_intrinsics(clear_stack=False,
+                                    fix_aspect_ratio=simple_focal,
+                                    simple_distortion=simple_distortion,
+                                    complex_distortion=complex_distortion,
+                                    max_samples=max_intrinsics_samples)
+        if not tool.has_intrinsics:
+            print(f"[WARN] Could not compute the intrinsics of camera {name} ({tool.nb_samples} samples)")
+            continue
+        camera_matrix, dist_coeffs = tool.intrinsics
+        calibrated[name] = {'camera_matrix': camera_matrix, 'dist_coeffs': dist_coeffs, 'errors': tool.last_best_errors}
+        if not silent:
+            nb_used = tool.nb_samples if max_intrinsics_samples is None else min(tool.nb_samples, max_intrinsics_samples)
+            print(f"[INFO] Camera {name}: intrinsics from {nb_used} of {tool.nb_samples} samples, "
+                  f"mean error {np.mean(tool.last_best_errors):.3f} px")
+
+    # 3. Extrinsics, on the frames seen by at least two cameras
+    seen_by = {}
+    for cam_idx, cam_detections in enumerate(detections):
+        if names[cam_idx] in calibrated:
+            for key in cam_detections:
+                seen_by.setdefault(key, []).append(cam_idx)
+    shared = sorted(key for key, cams in seen_by.items() if len(cams) >= 2)
+    if len(shared) > max_samples:
+        shared = [shared[i] for i in np.unique(np.linspace(0, len(shared) - 1, max_samples).round().astype(int))]
+
+    if nb_cams > 1 and len(calibrated) == nb_cams and shared:
+        multi_tool = MultiviewCalibrationTool(nb_cams, board_params=board_params, origin_camera=origin_camera,
+                                              min_detections=min(15, len(shared)), max_detections=max_samples)
+        for cam_idx, name in enumerate(names):
+            multi_tool.register_intrinsics(cam_idx, calibrated[name]['camera_matrix'], calibrated[name]['dist_coeffs'])
+
+        for key in shared:
+            # A pose sample is stored as soon as the origin camera and another one are in, so the origin goes last
+            for cam_idx in sorted(seen_by[key], key=lambda c: c == origin_camera):
+                points2d, points_ids = detections[cam_idx][key]
+                tool = mono_tools[cam_idx]
+                tool.set_detection(points2d, points_ids)
+                tool.compute_extrinsics()
+                if tool.has_extrinsics:
+                    multi_tool.register_extrinsics(key, cam_idx, *tool.extrinsics)
+                multi_tool.register_detection(key, cam_idx, points2d, points_ids, triangulate=False)
+        multi_tool.flush_detections(min_cameras=2)
+
+        multi_tool.compute_estimation()
+        if not multi_tool.has_extrinsics:
+            print(f"[WARN] Not enough poses to estimate the cameras arrangement, "
+                  f"does every camera see the board at the same time as camera {names[origin_camera]}?")
+        else:
+            if refine:
+                multi_tool.compute_refined(max_time=None,
+                                           simple_focal=simple_focal,
+                                           simple_distortion=simple_distortion,
+                                           complex_distortion=complex_distortion)
+            rvecs, tvecs = multi_tool.extrinsics
+            camera_matrices, dist_coeffs = multi_tool.intrinsics()
+            for cam_idx, name in enumerate(names):
+                calibrated[name]['rvec'], calibrated[name]['tvec'] = rvecs[cam_idx], tvecs[cam_idx]
+                if multi_tool.is_refined:
+                    calibrated[name]['camera_matrix'] = camera_matrices[cam_idx]
+                    calibrated[name]['dist_coeffs'] = dist_coeffs[cam_idx, :8 if complex_distortion else 5]
+
+    elif nb_cams > 1:
+        print(f"[WARN] Can't compute the extrinsics (every camera needs intrinsics, and to share some frames with another one)")
+
+    # 4. Write everything
+    for name, params in calibrated.items():
+        fileio.write_intrinsics(output, name, params['camera_matrix'], params['dist_coeffs'], params.get('errors'))
+        if 'rvec' in params:
+            fileio.write_extrinsics(output, name, params['rvec'], params['tvec'])
+
+    return {name: {k: v for k, v in params.items() if k != 'errors'} for name, params in calibrated.items()}
@@ -1,4 +1,5 @@
 import subprocess
+import time
 from threading import Thread, Event
 from multiprocessing import RawArray
 from typing import NoReturn, Union, List
@@ -18,7 +19,15 @@ import shlex
 import re
 
 from mokap.utils import fileio
-from mokap.core.hardware import SSHTrigger, BaslerCamera, setup_ulimit, enumerate_basler_devices, SerialTrigger
+from mokap.core.hardware import SSHTrigger, BaslerCamera, FrameEventHandler, setup_ulimit, enumerate_basler_devices, SerialTrigger, suggest_buffer_count
+from mokap.core.storage import parse_volumes, parse_policy, measure_write_speed, assign_volumes, StorageManager
+from mokap.core.bandwidth import parse_topology, allocate_bandwidth
+from mokap.core.telemetry import TelemetryPoller
+from mokap.core.snapshot import SnapshotRequest, SnapshotSaver
+from mokap.core.framestats import compute_frame_stats
+from mokap.core.framebus import FramePublisher, bus_name
+from mokap.core.processing import FramePipeline
+from mokap.core.motion import MotionGate
 
 import csv
 
@@ -66,13 +75,16 @@ class MultiCam:
         else:
             self.trigger = None
 
-        self._base_folder = Path(self.config_dict.get('base_path', './')) / 'MokapRecordings'
-        if self._base_folder.parent.name == self._base_folder.name:
-            self._base_folder = self._base_folder.parent
-        if re.match(r'[A-Z]:', self._base_folder.parts[0]) and 'Darwin' in platform.system():
-            self._base_folder = Path(self._base_folder.as_posix()[2:].lstrip('/'))
-        self._base_folder.mkdir(parents=True, exist_ok=True)
-        fileio.clean_root_folder(self._base_folder)
+        # base_path can be a single folder or a list of folders (one per volume)
+        self._base_folders: List[Path] = parse_volumes(self.config_dict.get('base_path', './'))
+        for folder in self._base_folders:
+            folder.mkdir(parents=True, exist_ok=True)
+            fileio.clean_root_folder(folder)
+        # The first volume is the primary one (it holds the metadata file)
+        self._base_folder = self._base_folders[0]
+
+        self._storage_policy: str = parse_policy(self.config_dict.get('storage_policy', 'round-robin'))
+        self._volumes_bandwidth: Union[List[float], None] = None
 
         self._session_name: str = ''
         self._saving_ext = self.config_dict.get('save_format', 'bmp').lower()
@@ -89,7 +101,39 @@ class MultiCam:
             case 'png':
                 self._saving_qual = int(((saving_qual / 100) * -9) + 9)
 
-        self._estim_file_size = None
+        # Per-frame image statistics (brightness, saturation, focus...)
+        stats_config = self.config_dict.get('frame_stats') or {}
+        self._stats_enabled: bool = bool(stats_config.get('enabled', True))
+        self._stats_stride: int = max(1, int(stats_config.get('stride', 4)))
+        self._stats_every: int = max(1, int(stats_config.get('every', 1)))
+        stats_bins = int(stats_config.get('bins', 16))
+        if not 0 < stats_bins <= 256 or 256 % stats_bins != 0:
+            print(f"[WARN] frame_stats bins must divide 256 (got {stats_bins}), defaulting to 16.")
+            stats_bins = 16
+        self._stats_dtype = fileio.frame_stats_dtype(stats_bins)
+
+        # Live frames can be published to shared memory, for other processes
+        bus_config = self.config_dict.get('frame_bus') or {}
+        self._bus_enabled: bool = bool(bus_config.get('enabled', False))
+        self._bus_prefix: str = str(bus_config.get('name', 'mokap'))
+        self._bus_slots: int = int(bus_config.get('slots', 8))
+
+        # 'polling': the grabber threads retrieve the frames, 'callback': pylon's grab loop hands them over
+        self._grab_engine: str = str(self.config_dict.get('grab_engine', 'polling')).lower()
+        if self._grab_engine not in ('polling', 'callback'):
+            raise ValueError(f"Unknown grab_engine {self._grab_engine} (must be 'polling' or 'callback')")
+
+        # Recording can be started and stopped automatically when something moves
+        motion_config = self.config_dict.get('motion_trigger') or {}
+        self._motion_enabled: bool = bool(motion_config.get('enabled', False))
+        self._motion_config: dict = {'cameras': motion_config.get('cameras'),
+                                     'threshold': float(motion_config.get('threshold', 0.2)),
+                                     'lag': float(motion_config.get('lag', 0.2)),
+                                     'post_roll': float(motion_config.get('post_roll', 5.0)),
+                                     'warmup': float(motion_config.get('warmup', 5.0)),
+                                     'decimation': int(motion_config.get('decimation', 4))}
+        self._pre_roll: float = float(motion_config.get('pre_roll', 2.0))
+        self._motion_gate: Union[None, MotionGate] = None
 
         # self._executor: Union[ThreadPoolExecutor, None] = None
 
@@ -110,13 +154,19 @@ class MultiCam:
 
         # Initialise the other lists (buffers and events)
         self._l_display_buffers: List[np.array] = []
+        self._l_preview_sizes: List[Union[None, tuple[int, int]]] = []
+        self._l_full_frames: List[Union[None, np.array]] = []
         self._l_finished_saving: List[Event] = []
         self._l_all_frames: List[deque] = []
         self._l_latest_frames: List[deque] = []
         self._l_mqtt_readings: List[deque] = []
+        self._l_stats_frames: List[deque] = []
+        self._l_latest_stats: List[Union[None, np.void]] = []
+        self._l_preroll_frames: List[deque] = []
 
-        # Initialise a list of subprocesses
+        # Initialise a list of subprocesses (and where they write)
         self._videowriters: List[Union[bool, subprocess.Popen]] = []
+        self._videowriters_paths: List[Union[None, Path]] = []
 
         # Sort the sources according to their idx
         self._sources_list.sort(key=lambda x: x.idx)
@@ -125,17 +175,67 @@ class MultiCam:
         # and populate the lists
         for i, cam in enumerate(self._sources_list):
             self._l_display_buffers.append(np.zeros(cam.shape, dtype=np.uint8))
+            self._l_preview_sizes.append(None)
+            self._l_full_frames.append(None)
             self._l_finished_saving.append(Event())
             self._l_all_frames.append(deque())
             self._l_latest_frames.append(deque(maxlen=1))
             self._videowriters.append(False)
+            self._videowriters_paths.append(None)
             self._l_mqtt_readings.append(deque())
+            # If the stats can't keep up, the oldest frames are skipped (the frame numbers in the file show it)
+            self._l_stats_frames.append(deque(maxlen=64))
+            self._l_latest_stats.append(None)
+            self._l_preroll_frames.append(deque(maxlen=0))
+
+        # Decide which volume each camera writes to
+        self._cameras_volumes: List[int] = []
+        self._assign_volumes()
+
+        # Share the USB bandwidth between the cameras on the same controller
+        self._bandwidth_report: List[dict] = []
+
+        # Slow-changing camera values (temperature, etc) are polled in the background
+        sources = self.config_dict.get('sources') or {}
+        default_interval = self.config_dict.get('telemetry_interval', 2.0)
+        self._telemetry = TelemetryPoller(self._sources_list,
+                                          interval=[(sources.get(cam.name) or {}).get('telemetry_interval', default_interval)
+                                                    for cam in self._sources_list],
+                                          silent=self._silent)
+        self._telemetry.start()
+
+        # Free space monitoring
+        quota_config = self.config_dict.get('disk_quota') or {}
+        self._storage_manager = StorageManager(self,
+                                               policy=quota_config.get('policy', 'stop'),
+                                               min_free_gb=quota_config.get('min_free_gb', 10),
+                                               warn_minutes=quota_config.get('warn_minutes', 60),
+                                               interval=quota_config.get('interval', 5),
+                                               silent=self._silent)
 
         # Init frames counters
         self._cnt_grabbed = RawArray('I', int(self._nb_cams))
         self._cnt_displayed = RawArray('I', int(self._nb_cams))
         self._cnt_saved = RawArray('I', int(self._nb_cams))
 
+        # Bytes written to disk, and write throughput (in bytes/s), kept up to date by the writer threads
+        self._cnt_bytes = RawArray('Q', int(self._nb_cams))
+        self._write_rate = RawArray('d', int(self._nb_cams))
+
+        # Worst time the writer threads took to write a frame, and stream grabber counters at the start of the session
+        self._writer_stall = RawArray('d', int(self._nb_cams))
+        self._stream_stats_start: List[dict] = [{} for _ in range(self._nb_cams)]
+
+        # Pre-roll frames each camera put at the start of the current session
+        self._preroll_flushed = RawArray('Q', int(self._nb_cams))
+
+        # Latest frame number (ImageNumber) grabbed by each camera, and pending snapshots
+        self._latest_numbers = RawArray('q', [-1] * int(self._nb_cams))
+        self._snapshots: List[SnapshotRequest] = []
+
+        # Processors that run on the live frames (see mokap.core.processing)
+        self._pipeline = FramePipeline(self._nb_cams, sidecar_path=self._sidecar_path, silent=self._silent)
+
     @property
     def triggered(self) -> bool:
         return self._triggered
@@ -217,6 +317,16 @@ class MultiCam:
                     if source.serial == str(self.config_dict['sources'][n].get('serial', 'virtual')):
                         if self.config_dict['sources'][n].get('user_set') != None:
                             source.set_userset(str(self.config_dict['sources'][n].get('user_set')))
+
+                # Stream grabber buffers and USB throughput limit (per source, or a default for all of them)
+                source_config = next((self.config_dict['sources'][n] for n in config_sources_names
+                                      if source.serial == str(self.config_dict['sources'][n].get('serial', 'virtual'))), {})
+                max_buffers = source_config.get('max_buffers', self.config_dict.get('max_buffers'))
+                if max_buffers is not None:
+                    source.max_buffers = int(max_buffers)
+                if 'throughput_limit' in source_config or 'throughput_limit' in self.config_dict:
+                    limit = source_config.get('throughput_limit', self.config_dict.get('throughput_limit'))
+                    source.throughput_limit = None if limit in (None, False, 'off', 'Off') else int(float(limit))
                         
                 # Keep references of cameras as list and as dict for easy access
                 self._sources_list.append(source)
@@ -297,7 +407,8 @@ class MultiCam:
             self._binning = cam.binning
 
             # Need to update the display buffers to the new frame size
-            self._l_display_buffers[i] = np.zeros(cam.shape, dtype=np.uint8)
+            self._l_full_frames[i] = None
+            self.set_preview_size(i, self._l_preview_sizes[i])
 
     @binning_mode.setter
     def binning_mode(self, value: str) -> None:
@@ -312,6 +423,9 @@ class MultiCam:
 
     def disconnect(self) -> None:
 
+        self._telemetry.stop()
+        self._pipeline.close()
+
         for cam in self._sources_list:
             cam.disconnect()
 
@@ -321,13 +435,134 @@ class MultiCam:
             print(f"[INFO] Disconnected {self._nb_cams} camera{'s' if self._nb_cams > 1 else ''}")
         self._nb_cams = 0
 
+    def _assign_volumes(self) -> None:
+        """
+            Decides on which volume each camera writes, according to the storage policy
+        """
+        nb_volumes = len(self._base_folders)
+        if nb_volumes == 1:
+            self._cameras_volumes = [0] * self._nb_cams
+            return
+
+        sources = self.config_dict.get('sources') or {}
+        pins = [(sources.get(cam.name) or {}).get('volume') for cam in self._sources_list]
+
+        if self._storage_policy == 'bandwidth':
+            # Only measure the volumes once, it takes a bit of time
+            if self._volumes_bandwidth is None:
+                self._volumes_bandwidth = [measure_write_speed(f) for f in self._base_folders]
+                if not self._silent:
+                    for f, bw in zip(self._base_folders, self._volumes_bandwidth):
+                        print(f'[INFO] Measured write speed of {f}: {bw / 1e6:.0f} MB/s')
+            cameras_bandwidth = [cam.width * cam.height * cam.framerate for cam in self._sources_list]
+        else:
+            cameras_bandwidth = None
+
+        previous = self._cameras_volumes
+        self._cameras_volumes = assign_volumes(self._nb_cams, nb_volumes,
+                                               policy=self._storage_policy,
+                                               pins=pins,
+                                               volumes_bandwidth=self._volumes_bandwidth,
+                                               cameras_bandwidth=cameras_bandwidth)
+        if not self._silent and previous != self._cameras_volumes:
+            for cam, v in zip(self._sources_list, self._cameras_volumes):
+                print(f'[INFO] Camera {cam.name} will write to {self._base_folders[v]}')
+
+    def _allocate_bandwidth(self) -> List[dict]:
+        """
+            Sets the throughput limits of the cameras that share a USB controller (see 'usb_controllers' in the config),
+            and flags the cameras whose link can't carry what their framerate needs
+        """
+        sources = self.config_dict.get('sources') or {}
+        names = [cam.name for cam in self._sources_list]
+        groups = parse_topology(self.config_dict.get('usb_controllers'), names)
+        controllers = [None] * self._nb_cams
+
+        for group in groups:
+            cams = [self._sources_list[i] for i in group['cameras']]
+            for i in group['cameras']:
+                controllers[i] = group['name']
+
+            # A camera that has its own throughput limit in the config keeps it, the others share what's left
+            pinned = [c for c in cams if 'throughput_limit' in (sources.get(c.name) or {}) and c.throughput_limit is not None]
+            free = [c for c in cams if c not in pinned]
+            budget = max(0.0, group['budget'] - sum(c.throughput_limit for c in pinned))
+            link_max = min([c.max_throughput_limit or np.inf for c in free], default=np.inf)
+
+            limits = allocate_bandwidth([c.bandwidth for c in free], budget, link_max=None if np.isinf(link_max) else link_max)
+            for cam, limit in zip(free, limits):
+                cam.throughput_limit = int(limit)
+
+        report = []
+        for i, cam in enumerate(self._sources_list):
+            required = cam.bandwidth
+            limit = cam.throughput_limit if cam.throughput_limit is not None else cam.max_throughput_limit
+            frame_size = required / cam.framerate if cam.framerate > 0 else 0.0
+            entry = {'controller': controllers[i],
+                     'required': required,
+                     'limit': limit,
+                     'max_framerate': limit / frame_size if limit and frame_size else float('inf'),
+                     'ok': limit is None or required <= limit}
+            report.append(entry)
+
+            if not self._silent and not entry['ok']:
+                where = f" on controller {entry['controller']}" if entry['controller'] else ''
+                print(f"[WARN] Camera {cam.name} needs {required / 1e6:.0f} MB/s at {cam.framerate:g} fps, but its link{where} "
+                      f"is limited to {limit / 1e6:.0f} MB/s: it can only sustain {entry['max_framerate']:.1f} fps")
+
+        self._bandwidth_report = report
+        return report
+
+    def cam_path(self, cam_idx: int) -> Path:
+        """
+            The session folder, on the volume the given camera writes to
+        """
+        return self._base_folders[self._cameras_volumes[cam_idx]] / self.session_name
+
+    def _stream_name(self, cam_idx: int, session: int = None) -> str:
+        """
+            Name of the file (video mode) or folder (image mode) of a camera's stream
+        """
+        cam = self._sources_list[cam_idx]
+        if self._saving_ext in ('mp4', 'raw'):
+            if session is None:
+                session = len(self._metadata['sessions']) - 1
+            return f"{self.session_name}_cam{cam.idx}_{cam.name}_session{session}.{self._saving_ext}"
+        else:
+            return f"{self.session_name}_cam{cam_idx}_{cam.name}"
+
+    def _sidecar_name(self, cam_idx: int, ext: str, session: int = None) -> str:
+        """
+            Name of a file written alongside a camera's stream, for one recording session
+        """
+        cam = self._sources_list[cam_idx]
+        if session is None:
+            session = len(self._metadata['sessions']) - 1
+        return f"{self.session_name}_cam{cam.idx}_{cam.name}_session{session}.{ext}"
+
+    def _sidecar_path(self, cam_idx: Union[int, None], ext: str, session: int) -> Path:
+        """
+            Path of a file written alongside a camera's stream (or alongside the metadata if cam_idx is None)
+        """
+        if cam_idx is None:
+            return self.full_path / f"{self.session_name}_session{session}.{ext}"
+        return self.cam_path(cam_idx) / self._sidecar_name(cam_idx, ext, session)
+
+    def _write_metadata(self) -> None:
+        """
+            Writes the metadata file to the session folder of every volume in use
+        """
+        for folder in {self._base_folders[v] for v in self._cameras_volumes} | {self._base_folder}:
+            with open(folder / self.session_name / 'metadata.json', 'w', encoding='utf-8') as f:
+                json.dump(self._metadata, f, ensure_ascii=True, indent=4)
+
     def _init_videowriter(self, cam_idx: int):
         if self._saving_ext == 'mp4':
             cam = self._sources_list[cam_idx]
 
             if not self._videowriters[cam_idx]:
                 dummy_frame = np.zeros((cam.height, cam.width), dtype=np.uint8)
-                filepath = self.full_path / f"{self.session_name}_cam{cam.idx}_{cam.name}_session{len(self._metadata['sessions'])-1}.mp4"
+                filepath = self.cam_path(cam_idx) / self._stream_name(cam_idx)
 
                 # TODO - Get available hardware-accelerated encoders on user's system and choose the best one automatically
                 # TODO - Why is QSV not working????
@@ -368,6 +603,14 @@ class MultiCam:
 
                 p.stdin.write(dummy_frame.tobytes())
                 self._videowriters[cam_idx] = p
+                self._videowriters_paths[cam_idx] = filepath
+
+        elif self._saving_ext == 'raw':
+            # Uncompressed frames, each one preceded by its frame number (see fileio.raw_record_dtype)
+            if not self._videowriters[cam_idx]:
+                filepath = self.cam_path(cam_idx) / self._stream_name(cam_idx)
+                self._videowriters[cam_idx] = open(filepath, 'wb')
+                self._videowriters_paths[cam_idx] = filepath
         else:
             self._videowriters[cam_idx] = False
 
@@ -378,6 +621,10 @@ class MultiCam:
                 self._videowriters[cam_idx].stdin.close()
                 self._videowriters[cam_idx].wait()
                 self._videowriters[cam_idx] = False
+        elif self._saving_ext == 'raw':
+            if self._videowriters[cam_idx]:
+                self._videowriters[cam_idx].close()
+                self._videowriters[cam_idx] = False
 
     def _writer_thread(self, cam_idx: int) -> NoReturn:
         """
@@ -393,14 +640,10 @@ class MultiCam:
 
         h = self._sources_list[cam_idx].height
         w = self._sources_list[cam_idx].width
-        folder = self.full_path / f"{self.session_name}_cam{cam_idx}_{self._sources_list[cam_idx].name}"
+        folder = self.cam_path(cam_idx) / self._stream_name(cam_idx)
 
-        if 'mp4' not in self._saving_ext:
-            folder = self.full_path / f"{self.session_name}_cam{cam_idx}_{self._sources_list[cam_idx].name}"
-            folder.mkdir(parents=True, exist_ok=True)
-        
         if self._mqtt_recording:
-            csv_file_path = self.full_path / f"labels_cam{cam_idx}_{self._sources_list[cam_idx].name}.csv"
+            csv_file_path = self.cam_path(cam_idx) / f"labels_cam{cam_idx}_{self._sources_list[cam_idx].name}.csv"
             csv_file = open(csv_file_path, "w", newline='')
             csv_writer = csv.writer(csv_file, dialect='excel')
             header = ['Image']
@@ -409,49 +652,79 @@ class MultiCam:
             csv_writer.writerow(header)
 
 
+        # Bytes written by previous (closed) video files, and state for the throughput estimation
+        bytes_closed = 0
+        last_update = time.monotonic()
+        last_bytes = self._cnt_bytes[cam_idx]
+
+        def update_written_bytes(force=False):
+            """
+                Updates the bytes counter (video mode: size of the file ffmpeg is writing) and the throughput.
+                This runs at most once per second, unless forced
+            """
+            nonlocal last_update, last_bytes
+            now = time.monotonic()
+            if not force and now - last_update < 1.0:
+                return
+
+            if 'mp4' in self._saving_ext and self._videowriters_paths[cam_idx] is not None:
+                try:
+                    self._cnt_bytes[cam_idx] = bytes_closed + os.stat(self._videowriters_paths[cam_idx]).st_size
+                except OSError:
+                    pass
+
+            written = self._cnt_bytes[cam_idx]
+            self._write_rate[cam_idx] = max(0.0, (written - last_bytes) / (now - last_update))
+            last_update, last_bytes = now, written
+
         def save_frame(frame, number):
             """
                 Saves one frame and updates the saved frames counter
             """
+            start = time.perf_counter()
 
             # If video mode
             if 'mp4' in self._saving_ext:
                 self._videowriters[cam_idx].stdin.write(frame.tobytes())
-                if self._estim_file_size is None:
-                    self._estim_file_size = -1  # In case of video files, return -1 so the GUI knows what to do
+
+            elif self._saving_ext == 'raw':
+                self._videowriters[cam_idx].write(np.uint64(number).tobytes())
+                self._videowriters[cam_idx].write(frame.data)
+                self._cnt_bytes[cam_idx] += 8 + frame.nbytes
 
             else:
                 # If image mode
                 filepath = folder / f"{str(number).zfill(9)}.{self._saving_ext}"
                 filepath = folder / f"{str(number)}.{self._saving_ext}"
 
-                match self._saving_ext:
-                    case 'bmp':
-                        Image.frombuffer("L", (w, h), frame, 'raw', "L", 0, 1).save(filepath)
-                    case 'jpg' | 'jpeg':
-                        Image.frombuffer("L", (w, h), frame, 'raw', "L", 0, 1).save(filepath, quality=self._saving_qual, subsampling='4:2:0')
-                    case 'png':
-                        Image.frombuffer("L", (w, h), frame, 'raw', "L", 0, 1).save(filepath, compress_level=self._saving_qual, optimize=False)
-                    case 'tif' | 'tiff':
-                        if self._saving_qual == 100:
-                            Image.frombuffer("L", (w, h), frame, 'raw', "L", 0, 1).save(filepath, compression=None)
-                        else:
-                            Image.frombuffer("L", (w, h), frame, 'raw', "L", 0, 1).save(filepath, compression='jpeg', quality=self._saving_qual)
-                    case 'debug':
-                        print('Dummy save')
-
-                # Do this just once after one file has been written
-                if self._estim_file_size is None:
-                    try:
-                        self._estim_file_size = os.path.getsize(filepath)
-                    except:
-                        pass
+                # We open the file ourselves so we know exactly how many bytes were written
+                with open(filepath, 'wb') as f:
+                    match self._saving_ext:
+                        case 'bmp':
+                            Image.frombuffer("L", (w, h), frame, 'raw', "L", 0, 1).save(f, format='BMP')
+                        case 'jpg' | 'jpeg':
+                            Image.frombuffer("L", (w, h), frame, 'raw', "L", 0, 1).save(f, format='JPEG', quality=self._saving_qual, subsampling='4:2:0')
+                        case 'png':
+                            Image.frombuffer("L", (w, h), frame, 'raw', "L", 0, 1).save(f, format='PNG', compress_level=self._saving_qual, optimize=False)
+                        case 'tif' | 'tiff':
+                            if self._saving_qual == 100:
+                                Image.frombuffer("L", (w, h), frame, 'raw', "L", 0, 1).save(f, format='TIFF', compression=None)
+                            else:
+                                Image.frombuffer("L", (w, h), frame, 'raw', "L", 0, 1).save(f, format='TIFF', compression='jpeg', quality=self._saving_qual)
+                        case 'debug':
+                            print('Dummy save')
+                    self._cnt_bytes[cam_idx] += f.tell()
 
             # The following is a RawArray, so the count is not atomic!
             # But it is fine as this is only for a rough estimation
             # (the actual number of written files is counted in a safe way when recording stops)
             self._cnt_saved[cam_idx] += 1
 
+            # Longest time spent on a single frame in this session
+            stall = time.perf_counter() - start
+            if stall > self._writer_stall[cam_idx]:
+                self._writer_stall[cam_idx] = stall
+
         def save_labels(writer, number, values):
             csv_row = [str(number)]
             for item in values:
@@ -463,6 +736,8 @@ class MultiCam:
 
         started_saving = False
         while self._acquiring:
+            update_written_bytes()
+
             if self._recording:
                 # Recording is set - do actual work
                 self._init_videowriter(cam_idx)     # This does nothing if not in video mode
@@ -471,6 +746,11 @@ class MultiCam:
                 if not started_saving:
                     self._l_finished_saving[cam_idx].clear()
                     self._l_mqtt_readings[cam_idx].clear()
+                    # The camera may have been moved to another volume since the last session (image mode only,
+                    # _init_videowriter() takes care of this for the video files)
+                    folder = self.cam_path(cam_idx) / self._stream_name(cam_idx)
+                    if self._saving_ext not in ('mp4', 'raw'):
+                        folder.mkdir(parents=True, exist_ok=True)
                     started_saving = True
 
                 # Main state of this thread: If the queue is not empty, save a new frame
@@ -500,16 +780,84 @@ class MultiCam:
                         
                     else:
                         self._close_videowriter(cam_idx)     # This does nothing if not in video mode
+                        # Get the final size of the video file
+                        update_written_bytes(force=True)
+                        bytes_closed = self._cnt_bytes[cam_idx]
+                        self._videowriters_paths[cam_idx] = None
                         started_saving = False
                         self._l_finished_saving[cam_idx].set()
-                        csv_file.close()
+                        if self._mqtt_recording:
+                            csv_file.close()
                 else:
                     # Default state of this thread: if cameras are acquiring but we're not recording, just wait
                     timer.wait(0.1)
 
+    def _stats_thread(self, cam_idx: int) -> NoReturn:
+        """
+            This thread computes image statistics on the frames the grabber passes to it, keeps the latest ones
+            (for displaying) and writes them to a .stats file alongside the recording
+
+            Parameters
+            ----------
+            cam_idx: the index of the camera this threads belongs to
+        """
+
+        queue = self._l_stats_frames[cam_idx]
+        bins = self._stats_dtype['histogram'].shape[0]
+
+        # Records are written in small batches
+        records = np.zeros(64, dtype=self._stats_dtype)
+        nb_records = 0
+        file = None
+        file_session = -1
+
+        def close_file():
+            nonlocal file, nb_records
+            if file is not None:
+                file.write(records[:nb_records].tobytes())
+                file.close()
+                file = None
+            nb_records = 0
+
+        timer = Event()
+
+        while self._acquiring:
+            if not queue:
+                if not self._recording:
+                    close_file()
+                timer.wait(0.01)
+                continue
+
+            img_nb, timestamp, session, frame = queue.popleft()
+            mean, saturation, sharpness, histogram = compute_frame_stats(frame, stride=self._stats_stride, bins=bins)
+
+            record = records[nb_records]
+            record['number'] = img_nb
+            record['timestamp'] = timestamp
+            record['mean'] = mean
+            record['saturation'] = saturation
+            record['sharpness'] = sharpness
+            record['histogram'] = histogram
+            self._l_latest_stats[cam_idx] = record.copy()
+
+            if session != file_session:
+                close_file()
+                file_session = session
+                if session >= 0:
+                    file = open(self.cam_path(cam_idx) / self._sidecar_name(cam_idx, 'stats', session), 'ab')
+
+            if file is not None:
+                nb_records += 1
+                if nb_records == len(records):
+                    file.write(records.tobytes())
+                    nb_records = 0
+
+        close_file()
+
     def _display_updater_thread(self, cam_idx: int) -> NoReturn:
         """
             This thread updates the display buffers at a relatively slow pace (not super accurate timing but who cares)
+            If a preview size was requested for this camera, the frame is downsampled here, once
 
             Parameters
             ----------
@@ -522,7 +870,16 @@ class MultiCam:
         while self._acquiring:
             timer.wait(0.05)
             if queue:
-                np.copyto(self._l_display_buffers[cam_idx], queue.popleft())
+                frame = queue.popleft()
+                # Keep a reference to the full resolution frame (GetArray() returns a copy so this is safe)
+                self._l_full_frames[cam_idx] = frame
+
+                # The buffer may be swapped by set_preview_size() at any time, so always use its own shape
+                buffer = self._l_display_buffers[cam_idx]
+                if buffer.shape == frame.shape:
+                    np.copyto(buffer, frame)
+                else:
+                    cv2.resize(frame, (buffer.shape[1], buffer.shape[0]), dst=buffer, interpolation=cv2.INTER_AREA)
                 self._cnt_displayed[cam_idx] += 1
 
     def _grabber_thread(self, cam_idx: int) -> NoReturn:
@@ -537,59 +894,121 @@ class MultiCam:
         queue_latest = self._l_latest_frames[cam_idx]
         queue_all = self._l_all_frames[cam_idx]
         queue_mqtt = self._l_mqtt_readings[cam_idx]
+        queue_stats = self._l_stats_frames[cam_idx]
+
+        # The bus lives as long as this thread, so frames are never published to a closed bus
+        publisher = None
+        if self._bus_enabled:
+            publisher = FramePublisher(bus_name(self._bus_prefix, cam.name), cam.shape, nb_slots=self._bus_slots)
 
-        cam.start_grabbing()
+        handler = FrameEventHandler() if self._grab_engine == 'callback' else None
+        cam.start_grabbing(handler)
 
         while self._acquiring:
-            with cam.ptr.RetrieveResult(500, py.TimeoutHandling_Return) as res:
-                try:
-                    if res.GrabSucceeded():
-                        img_nb = res.ImageNumber
-                        frame = res.GetArray()
-                        if self._recording:
-                            queue_all.append((img_nb, frame))
-                            if self._mqtt_recording:
-                                queue_mqtt.append((img_nb, self.mqttlogger.values))
-                        queue_latest.append(frame)
-                        self._cnt_grabbed[cam_idx] += 1
-                except py.RuntimeException:     # This might happen if the camera stops grabbing during this loop
-                    pass
+            if handler is not None:
+                grabbed = handler.get(0.5)
+            else:
+                grabbed = []
+                with cam.ptr.RetrieveResult(500, py.TimeoutHandling_Return) as res:
+                    try:
+                        if res.GrabSucceeded():
+                            grabbed.append((res.ImageNumber, res.GetArray(), time.time()))
+                    except py.RuntimeException:     # This might happen if the camera stops grabbing during this loop
+                        pass
+
+            for img_nb, frame, timestamp in grabbed:
+                if publisher is not None:
+                    publisher.publish(frame, img_nb, timestamp)
+                if self._recording:
+                    preroll = self._l_preroll_frames[cam_idx]
+                    if preroll:
+                        # Frames grabbed just before the session started
+                        queue_all.extend(preroll)
+                        self._preroll_flushed[cam_idx] = len(preroll)
+                        preroll.clear()
+                    queue_all.append((img_nb, frame))
+                    if self._mqtt_recording:
+                        queue_mqtt.append((img_nb, self.mqttlogger.values))
+                elif self._motion_gate is not None:
+                    self._l_preroll_frames[cam_idx].append((img_nb, frame))
+                queue_latest.append(frame)
+                self._latest_numbers[cam_idx] = img_nb
+                if self._snapshots:
+                    for snapshot in list(self._snapshots):
+                        snapshot.offer(cam_idx, img_nb, frame)
+                session = len(self._metadata['sessions']) - 1 if self._recording else -1
+                if self._stats_enabled and self._cnt_grabbed[cam_idx] % self._stats_every == 0:
+                    queue_stats.append((img_nb, timestamp, session, frame))
+                if self._pipeline.active:
+                    self._pipeline.feed(cam_idx, img_nb, timestamp, frame, session)
+                self._cnt_grabbed[cam_idx] += 1
 
         cam.stop_grabbing()
 
-    def record(self) -> None:
+        if publisher is not None:
+            publisher.close()
+
+    def record(self, trigger: str = 'manual') -> None:
         """
             Start recording session
+
+            Parameters
+            ----------
+            trigger : str
+                What started the session (it is written to the metadata)
         """
         if self.acquiring:
             if not self._recording:
 
                 (self.full_path / 'recording').touch(exist_ok=True)
 
+                self._metadata['volumes'] = [f.resolve().as_posix() for f in self._base_folders]
+
                 session_metadata = {'start': datetime.now().timestamp(),
                                     'end': 0.0,
                                     'duration': 0.0,
                                     'hardware_triggered': self.triggered,
+                                    'trigger': trigger,
+                                    'pre_roll': 0.0,    # What the pre-roll actually held (set at the end)
                                     'cameras': [{
                                         'idx': c.idx,
                                         'name': c.name,
                                         'width': c.width,
                                         'height': c.height,
+                                        'shape': [int(v) for v in c.shape],
                                         'exposure': c.exposure,
                                         'gain': c.gain,
                                         'gamma': c.gamma,
-                                        'black_level': c.blacks} for c in self.cameras]}
+                                        'black_level': c.blacks,
+                                        'volume': self._cameras_volumes[i]} for i, c in enumerate(self.cameras)]}
+
+                if self._stats_enabled:
+                    session_metadata['stats_dtype'] = self._stats_dtype.descr
+                    session_metadata['stats_stride'] = self._stats_stride
 
                 self._metadata['sessions'].append(session_metadata)
 
-                with open(self.full_path / 'metadata.json', 'w', encoding='utf-8') as f:
-                    json.dump(self._metadata, f, ensure_ascii=False, indent=4)
+                # The stream grabber counters keep going for the whole acquisition, so only their increase is reported
+                for i in range(self._nb_cams):
+                    self._writer_stall[i] = 0.0
+                    self._preroll_flushed[i] = 0
+                    self._stream_stats_start[i] = self._read_stream_statistics(i)
+
+                # Where each stream lives (relative to the session folder on its volume)
+                for i in range(self._nb_cams):
+                    self._metadata['sessions'][-1]['cameras'][i]['file'] = self._stream_name(i)
+                    if self._stats_enabled:
+                        self._metadata['sessions'][-1]['cameras'][i]['stats_file'] = self._sidecar_name(i, 'stats')
+
+                self._write_metadata()
 
                 self._recording = True
 
                 if not self._silent:
                     if 'mp4' in self._saving_ext:
                         print(f'[INFO] Using {"hardware" if self._config_encoding_gpu else "software"} video encoding')
+                    elif self._saving_ext == 'raw':
+                        print('[INFO] Writing raw frames (no encoding)')
                     else:
                         print(f'[INFO] Using {self._saving_ext} image encoding')
                     print('[INFO] Recording started...')
@@ -616,7 +1035,7 @@ class MultiCam:
 
                 for i, cam in enumerate(self.cameras):
                     if 'mp4' in self._saving_ext:
-                        vid = self.full_path / f"{self.session_name}_cam{i}_{self._sources_list[i].name}_session{len(self._metadata['sessions']) - 1}.mp4"
+                        vid = self.cam_path(i) / self._stream_name(i)
                         if vid.is_file():
                             # Using cv2 here is much faster than calling ffprobe...
                             cap = cv2.VideoCapture(vid.as_posix())
@@ -624,27 +1043,149 @@ class MultiCam:
                             cap.release()
                         else:
                             saved_frames_curr_sess = 0
+                    elif self._saving_ext == 'raw':
+                        raw = self.cam_path(i) / self._stream_name(i)
+                        if raw.is_file():
+                            record_size = fileio.raw_record_dtype(cam.shape).itemsize
+                            saved_frames_curr_sess = raw.stat().st_size // record_size
+                        else:
+                            saved_frames_curr_sess = 0
                     else:
                         # Read back how many frames were recorded in previous sessions of this acquisition
+                        # (only the ones that went to the same folder)
                         previsouly_saved = sum([self._metadata['sessions'][p]['cameras'][i].get('frames', 0) for p in
-                                                range(len(self._metadata['sessions']))])
+                                                range(len(self._metadata['sessions']))
+                                                if self._metadata['sessions'][p]['cameras'][i].get('volume', 0) == self._cameras_volumes[i]])
 
                         # Wait for all files to finish being written and write the number of frames for this session
-                        saved_frames = self._safe_files_counter(self.full_path / f'{self.session_name}_cam{i}_{cam.name}')
+                        folder = self.cam_path(i) / self._stream_name(i)
+                        saved_frames = self._safe_files_counter(folder) if folder.is_dir() else 0
                         saved_frames_curr_sess = saved_frames - previsouly_saved
 
+                    # The pre-roll frames were grabbed before the session started, so they don't count for the framerate
+                    preroll_frames = int(self._preroll_flushed[i])
                     self._metadata['sessions'][-1]['cameras'][i]['frames'] = saved_frames_curr_sess
+                    self._metadata['sessions'][-1]['cameras'][i]['pre_roll_frames'] = preroll_frames
                     self._metadata['sessions'][-1]['cameras'][i]['framerate_theoretical'] = cam.framerate
-                    self._metadata['sessions'][-1]['cameras'][i]['framerate_actual'] = saved_frames_curr_sess / duration
+                    self._metadata['sessions'][-1]['cameras'][i]['framerate_actual'] = max(0, saved_frames_curr_sess - preroll_frames) / duration
+                    if cam.framerate:
+                        self._metadata['sessions'][-1]['pre_roll'] = max(self._metadata['sessions'][-1]['pre_roll'],
+                                                                         preroll_frames / cam.framerate)
 
-                with open(self.full_path / 'metadata.json', 'w', encoding='utf-8') as f:
-                    json.dump(self._metadata, f, ensure_ascii=True, indent=4)
+                    self._report_stream_statistics(i)
+
+                self._write_metadata()
 
                 (self.full_path / 'recording').unlink(missing_ok=True)
 
                 if not self._silent:
                     print('[INFO] Done saving')
 
+    def _read_stream_statistics(self, cam_idx: int) -> dict:
+        """
+            Current stream grabber counters of a camera (read now, not from the telemetry cache)
+        """
+        self._telemetry.poll(cam_idx)
+        return dict(self._telemetry.get(cam_idx, 'stream_statistics', {}))
+
+    def _report_stream_statistics(self, cam_idx: int) -> None:
+        """
+            Adds the stream grabber counters of the session that just ended to the metadata, along with the worst
+            writer stall and the number of buffers that would be needed to absorb it
+        """
+        cam = self._sources_list[cam_idx]
+        start = self._stream_stats_start[cam_idx]
+        end = self._read_stream_statistics(cam_idx)
+        # Counters go back to zero when grabbing restarts
+        stats = {k: v - start.get(k, 0) if v >= start.get(k, 0) else v for k, v in end.items()}
+
+        stall = float(self._writer_stall[cam_idx])
+        suggested = suggest_buffer_count(cam.framerate, stall)
+
+        cam_metadata = self._metadata['sessions'][-1]['cameras'][cam_idx]
+        cam_metadata['stream_statistics'] = stats
+        cam_metadata['max_buffers'] = cam.max_buffers
+        cam_metadata['throughput_limit'] = cam.throughput_limit
+        cam_metadata['writer_stall'] = stall
+        cam_metadata['suggested_buffers'] = suggested
+
+        if not self._silent:
+            errors = {k: stats[k] for k in BaslerCamera.STREAM_ERRORS if stats.get(k)}
+            if errors:
+                print(f"[WARN] Camera {cam.name} lost frames during this session ({', '.join(f'{k}: {v}' for k, v in errors.items())})")
+            if suggested > cam.max_buffers:
+                print(f'[WARN] Camera {cam.name}: the writer stalled for up to {stall * 1000:.0f} ms, '
+                      f'consider max_buffers: {suggested} (currently {cam.max_buffers})')
+
+    def snapshot(self,
+                 nb_frames: int = 1,
+                 frame_number: Union[int, None] = None,
+                 folder: Union[Path, str, None] = None,
+                 fmt: str = 'bmp',
+                 prefix: Union[str, None] = None,
+                 timeout: float = 5.0,
+                 callback=None) -> Union[SnapshotRequest, None]:
+        """
+            Captures full resolution frames from all cameras, straight from the grabbers, and writes them to disk
+            in a background thread. This returns immediately.
+
+            Parameters
+            ----------
+            nb_frames : int
+                Number of consecutive frames to capture from each camera
+            frame_number : int or None
+                Frame number (i.e. trigger pulse, if hardware-triggered) of the first frame to capture. If None,
+                the next frames are captured: with a hardware trigger, the same pulses for all cameras.
+            folder : Path or str or None
+                Where to write the frames (default: the acquisition folder). If False, nothing is written
+                and the frames are only available in the returned request
+            fmt : str
+                bmp, png, jpg, tif or npy
+            prefix : str or None
+                Start of the files names (default: snapshot_ and the current date and time)
+            timeout : float
+                How long to wait for the frames (in seconds)
+            callback : callable or None
+                Called (from the background thread) with the request, once the frames are written
+
+            Returns
+            -------
+            SnapshotRequest (or None if the cameras are not acquiring)
+        """
+        if not self._acquiring:
+            return None
+
+        latest = np.frombuffer(self._latest_numbers, dtype=np.int64)
+        if frame_number is not None:
+            first = [int(frame_number)] * self._nb_cams
+            if not self._silent and frame_number <= latest.max():
+                print(f'[WARN] Snapshot: frame {frame_number} was already grabbed by some cameras')
+        elif self._triggered:
+            # The cameras can be one frame apart, so start on a pulse none of them has seen yet
+            first = [int(latest.max()) + 1] * self._nb_cams
+        else:
+            # Without a trigger, frame numbers don't match between cameras anyway
+            first = [int(n) + 1 for n in latest]
+
+        request = SnapshotRequest(self._nb_cams, first, nb_frames=nb_frames)
+        self._snapshots.append(request)
+
+        if folder is None:
+            folder = self.full_path
+        if prefix is None:
+            prefix = f"snapshot_{datetime.now().strftime('%y%m%d-%H%M%S')}"
+
+        SnapshotSaver(request,
+                      folder=folder if folder is not False else None,
+                      names=[cam.name for cam in self._sources_list],
+                      prefix=prefix,
+                      fmt=fmt,
+                      timeout=timeout,
+                      on_capture_end=self._snapshots.remove,
+                      callback=callback,
+                      silent=self._silent)
+        return request
+
     def _safe_files_counter(self, path: Union[Path, str]) -> int:
         """
             This counts the number of files in the given path, in a safe manner:
@@ -670,6 +1211,31 @@ class MultiCam:
                 fnmatch.filter(os.listdir(path), f'*.{self._saving_ext}'))
         return saved_frames_n
 
+    def _start_motion_gate(self) -> None:
+        if self._motion_gate is not None:
+            return
+
+        names = self._motion_config['cameras']
+        cameras = None if not names else [i for i, cam in enumerate(self._sources_list) if cam.name in names]
+
+        # The pre-roll is kept in memory, as full frames
+        for i, cam in enumerate(self._sources_list):
+            self._l_preroll_frames[i] = deque(maxlen=int(np.ceil(self._pre_roll * cam.framerate)))
+        if not self._silent and self._pre_roll > 0:
+            size = sum(d.maxlen * cam.width * cam.height for d, cam in zip(self._l_preroll_frames, self._sources_list))
+            print(f'[INFO] Pre-roll of {self._pre_roll:.1f}s ({size / 1e9:.2f} GB of memory)')
+
+        self._motion_gate = MotionGate(self, cameras=cameras, silent=self._silent, **{k: v for k, v in self._motion_config.items() if k != 'cameras'})
+        self._motion_gate.start()
+
+    def _stop_motion_gate(self) -> None:
+        if self._motion_gate is None:
+            return
+        self._motion_gate.stop()
+        self._motion_gate = None
+        for i in range(self._nb_cams):
+            self._l_preroll_frames[i] = deque(maxlen=0)
+
     def on(self) -> None:
         """
             Start acquisition on all cameras
@@ -681,16 +1247,24 @@ class MultiCam:
             if self._session_name == '':
                 self.session_name = ''
 
+            # Framerates or binning may have changed since last time
+            self._assign_volumes()
+            self._allocate_bandwidth()
+
             if self._triggered:
                 self.trigger.start(self._framerate)
                 Event().wait(0.1)
 
+            # Frames from different cameras can only be matched by number if they share a trigger
+            self._pipeline.by_number = self._triggered
+
             self._acquiring = True
 
-            # Start 3 threads per camera:
+            # Start 3 (or 4) threads per camera:
             #   - One that grabs frames continuously from the camera
             #   - One that writes frames continuously to disk
             #   - One that (less frequently) updates local buffers for displaying
+            #   - One that computes image statistics (if enabled)
 
             self._threads = []
             for i, cam in enumerate(self._sources_list):
@@ -703,6 +1277,15 @@ class MultiCam:
                 w = Thread(target=self._writer_thread, args=(i,), daemon=True)
                 w.start()
                 self._threads.append(w)
+                if self._stats_enabled:
+                    s = Thread(target=self._stats_thread, args=(i,), daemon=True)
+                    s.start()
+                    self._threads.append(s)
+
+            self._storage_manager.start()
+
+            if self._motion_enabled:
+                self._start_motion_gate()
 
             if not self._silent:
                 print(f"[INFO] Grabbing started with {self._nb_cams} camera{'s' if self._nb_cams > 1 else ''}...")
@@ -714,6 +1297,9 @@ class MultiCam:
 
         if self._acquiring:
 
+            self._storage_manager.stop()
+            self._stop_motion_gate()
+
             # If we were recording, gracefully stop it
             self.pause()
 
@@ -722,8 +1308,9 @@ class MultiCam:
             if self._triggered:
                 self.trigger.stop()
 
-        # Clean up the acquisition folder if nothing was written in it
-        fileio.rm_if_empty(self._base_folder / self._session_name)
+        # Clean up the acquisition folder(s) if nothing was written in it
+        for folder in self._base_folders:
+            fileio.rm_if_empty(folder / self._session_name)
 
         # Reset everything for next acquisition
         self._session_name = ''
@@ -732,6 +1319,9 @@ class MultiCam:
         self._cnt_grabbed = RawArray('I', int(self._nb_cams))
         self._cnt_displayed = RawArray('I', int(self._nb_cams))
         self._cnt_saved = RawArray('I', int(self._nb_cams))
+        self._cnt_bytes = RawArray('Q', int(self._nb_cams))
+        self._write_rate = RawArray('d', int(self._nb_cams))
+        self._latest_numbers = RawArray('q', [-1] * int(self._nb_cams))
 
         if not self._silent:
             print(f'[INFO] Grabbing stopped')
@@ -757,13 +1347,18 @@ class MultiCam:
 
         # Cleanup old folder if needed
         if old_name != '' and old_name is not None:
-            fileio.rm_if_empty(self._base_folder / old_name)
+            for folder in self._base_folders:
+                fileio.rm_if_empty(folder / old_name)
 
         if new_name == '' or new_name is None:
             new_name = datetime.now().strftime('%y%m%d-%H%M')
 
+        # The name must be available on all the volumes
         new_folder = fileio.exists_check(self._base_folder / new_name)
-        new_folder.mkdir(parents=True, exist_ok=False)
+        while any((folder / new_folder.name).exists() for folder in self._base_folders):
+            new_folder = fileio.exists_check(self._base_folder / f'{new_folder.name}_2')
+        for folder in self._base_folders:
+            (folder / new_folder.name).mkdir(parents=True, exist_ok=False)
 
         self._session_name = new_folder.name
 
@@ -775,6 +1370,14 @@ class MultiCam:
     def full_path(self) -> Path:
         return self._base_folder / self.session_name
 
+    @property
+    def telemetry(self) -> TelemetryPoller:
+        return self._telemetry
+
+    @property
+    def storage(self) -> StorageManager:
+        return self._storage_manager
+
     @property
     def nb_cameras(self) -> int:
         return self._nb_cams
@@ -812,6 +1415,56 @@ class MultiCam:
 
     colors = colours    # An alias for our US American friends :p
 
+    @property
+    def bandwidth(self) -> List[dict]:
+        """
+            For each camera, the USB bandwidth it needs, its throughput limit (bytes/s), the framerate that limit allows,
+            and whether it is enough. Updated every time acquisition starts, or with check_bandwidth()
+        """
+        return self._bandwidth_report
+
+    def check_bandwidth(self) -> List[dict]:
+        """
+            Shares the USB bandwidth again (i.e. after changing framerate or binning) and returns the report
+        """
+        return self._allocate_bandwidth()
+
+    @property
+    def motion_trigger(self) -> bool:
+        """
+            Whether recording starts and stops automatically when something moves (see mokap.core.motion.MotionGate)
+        """
+        return self._motion_enabled
+
+    @motion_trigger.setter
+    def motion_trigger(self, value: bool):
+        self._motion_enabled = bool(value)
+        if self._acquiring:
+            if self._motion_enabled:
+                self._start_motion_gate()
+            else:
+                self._stop_motion_gate()
+
+    @property
+    def motion_gate(self) -> Union[None, MotionGate]:
+        return self._motion_gate
+
+    @property
+    def pipeline(self) -> FramePipeline:
+        """
+            The processing stages that receive the live frames, e.g. mc.pipeline.add(MyProcessor(), policy='latest')
+        """
+        return self._pipeline
+
+    @property
+    def frame_bus_names(self) -> List[str]:
+        """
+            Names of the shared memory buses the frames are published to (see mokap.core.framebus.FrameSubscriber)
+        """
+        if not self._bus_enabled:
+            return []
+        return [bus_name(self._bus_prefix, cam.name) for cam in self._sources_list]
+
     @property
     def saving_ext(self):
         return self._saving_ext.lower().lstrip('.').strip("'").strip('"')
@@ -831,9 +1484,90 @@ class MultiCam:
         # The buffer is non-atomic so the counts might be slightly off - they should not be used for anything critical
         return np.frombuffer(self._cnt_saved, dtype=np.uint32)
 
+    @property
+    def saved_bytes(self) -> np.array:
+        """
+            Number of bytes written to disk by each camera since the acquisition started
+            (in video mode, this is updated about once per second)
+
+            Returns
+            -------
+            np.array with shape (n_cams)
+        """
+        return np.frombuffer(self._cnt_bytes, dtype=np.uint64)
+
+    @property
+    def write_throughput(self) -> np.array:
+        """
+            Current write throughput of each camera, in MB/s (averaged over about one second)
+
+            Returns
+            -------
+            np.array with shape (n_cams)
+        """
+        return np.frombuffer(self._write_rate, dtype=np.float64) / 1e6
+
+    def set_preview_size(self, i: int, size: Union[None, tuple[int, int]] = None) -> tuple[int, int]:
+        """
+            Sets the size of the display buffer of a camera. Frames are downsampled to this size in the
+            display updater thread, so the GUI only receives what it will actually display.
+
+            Parameters
+            ----------
+            i : int
+                Camera index
+            size : tuple of int, or None
+                (width, height) of the preview. Cannot be larger than the camera's frame. None for full resolution
+
+            Returns
+            -------
+            tuple of int
+            The actual (width, height) of the preview
+        """
+        cam = self._sources_list[i]
+        if size is not None:
+            w = int(min(max(1, size[0]), cam.width))
+            h = int(min(max(1, size[1]), cam.height))
+            if (w, h) == (cam.width, cam.height):
+                size = None
+            else:
+                size = (w, h)
+
+        shape = cam.shape if size is None else (size[1], size[0], *cam.shape[2:])
+        if size != self._l_preview_sizes[i] or self._l_display_buffers[i].shape != shape:
+            self._l_preview_sizes[i] = size
+            self._l_display_buffers[i] = np.zeros(shape, dtype=np.uint8)
+
+        return (cam.width, cam.height) if size is None else size
+
+    def get_current_fullframe(self, i: int = None) -> Union[np.array, list[np.array]]:
+        """
+            Returns the latest full resolution frame(s) that went through the display updater, for one or all cameras
+            (e.g. for snapshots, or to zoom in). Returns None for cameras that haven't produced any frame yet.
+            NB: These arrays are references to the grabbed frames, they should not be modified.
+        """
+        if i is None:
+            return list(self._l_full_frames)
+        else:
+            return self._l_full_frames[i]
+
+    def get_frame_stats(self, i: int = None) -> Union[dict, None, list]:
+        """
+            Returns the latest image statistics (frame number, timestamp, mean, saturation, sharpness, histogram)
+            for one or all cameras. None for cameras that haven't produced any yet, or if the stats are disabled.
+        """
+        if i is None:
+            return [self.get_frame_stats(c) for c in range(self._nb_cams)]
+
+        record = self._l_latest_stats[i]
+        if record is None:
+            return None
+        return {name: record[name] for name in record.dtype.names}
+
     def get_current_framebuffer(self, i: int = None) -> Union[np.array, list[np.array]]:
         """
             Returns the current display frame buffer(s) for one or all cameras.
+            These are at the preview size if one was set with set_preview_size(), full resolution otherwise.
             NB: These arrays are not atomically readable - they are just for visualisation.
 
             Returns
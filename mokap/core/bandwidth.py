@@ -0,0 +1,118 @@
+import re
+from typing import List, Union, Dict
+import numpy as np
+
+##
+
+# USB3 Vision links top out a bit above this in practice
+DEFAULT_LINK_BUDGET = 342000000
+
+
+def bytes_per_pixel(pixel_format: str) -> float:
+    """
+        Size of a pixel on the link for a pylon pixel format name ('Mono8', 'Mono12p', 'RGB8Packed', 'BayerRG10'...)
+    """
+    fmt = pixel_format.lower()
+    # The last number, because of names like 'YCbCr422_8' (and not the chroma subsampling, as in 'YUV422Packed')
+    numbers = re.findall(r'\d+', re.sub(r'^(ycbcr|yuv)(411|422|444)', r'\1', fmt))
+    bits = int(numbers[-1]) if numbers else 8
+    if fmt.endswith('p') and not fmt.endswith('packed'):
+        bytes_per_channel = bits / 8
+    elif fmt.endswith('packed') and bits % 8 != 0:
+        # Legacy pylon 'Packed' formats put two 10 or 12-bit pixels in 3 bytes ('RGB8Packed' is just 8 bits per channel)
+        bytes_per_channel = 1.5
+    else:
+        bytes_per_channel = int(np.ceil(bits / 8))
+
+    if fmt.startswith(('rgba', 'bgra')):
+        channels = 4
+    elif fmt.startswith(('rgb', 'bgr')):
+        channels = 3
+    elif fmt.startswith(('ycbcr422', 'yuv422')):
+        channels = 2
+    else:
+        channels = 1    # Mono and Bayer
+    return channels * bytes_per_channel
+
+
+def required_bandwidth(width: int, height: int, bpp: float, framerate: float) -> float:
+    """
+        Data rate of a camera (in bytes/s), with width and height after binning
+    """
+    return float(width) * float(height) * float(bpp) * float(framerate)
+
+
+def allocate_bandwidth(demands: List[float], budget: float, link_max: Union[float, None] = None) -> np.ndarray:
+    """
+        Splits the budget of a controller between the cameras on it
+
+        If everything fits, every camera gets its demand, and the spare budget is shared in proportion to the demands
+        (more headroom for the cameras that need the most). Otherwise, the budget is shared max-min fairly: cameras
+        that need less than an equal share get what they need, and the others split what remains equally.
+
+        Parameters
+        ----------
+        demands : list of float
+            Data rate each camera needs (bytes/s)
+        budget : float
+            What the controller can carry (bytes/s)
+        link_max : float or None
+            The most a single link can be given
+
+        Returns
+        -------
+        np.ndarray
+            The throughput limit of each camera (bytes/s)
+    """
+    demands = np.asarray(demands, dtype=np.float64)
+    cap = np.inf if link_max is None else float(link_max)
+    total = demands.sum()
+
+    if len(demands) == 0:
+        return demands
+
+    if total <= budget:
+        if total > 0:
+            limits = demands + (budget - total) * demands / total
+        else:
+            limits = np.full(len(demands), budget / len(demands))
+        return np.minimum(limits, cap)
+
+    # Water-filling: serve the smallest demands first
+    limits = np.zeros_like(demands)
+    remaining = float(budget)
+    order = np.argsort(demands)
+    for k, i in enumerate(order):
+        share = remaining / (len(order) - k)
+        limits[i] = min(demands[i], share, cap)
+        remaining -= limits[i]
+    return limits
+
+
+def parse_topology(controllers: Union[Dict, None], cameras_names: List[str]) -> List[dict]:
+    """
+        Reads the 'usb_controllers' section of the config: {name: {budget: bytes/s, cameras: [names]}}
+
+        Returns
+        -------
+        list of dict
+            One {'name', 'budget', 'cameras' (indices)} per controller that has known cameras on it
+    """
+    groups = []
+    assigned = set()
+    for name, params in (controllers or {}).items():
+        params = params or {}
+        members = [cameras_names.index(c) for c in params.get('cameras', []) if c in cameras_names]
+        unknown = [c for c in params.get('cameras', []) if c not in cameras_names]
+        if unknown:
+            print(f"[WARN] Controller {name}: unknown camera{'s' if len(unknown) > 1 else ''} {', '.join(map(str, unknown))}")
+        taken = [cameras_names[i] for i in members if i in assigned]
+        if taken:
+            print(f"[WARN] Controller {name}: {', '.join(taken)} already on another controller. Ignoring.")
+        members = [i for i in members if i not in assigned]
+        if members:
+            assigned.update(members)
+            groups.append({'name': str(name),
+                           'budget': float(params.get('budget', DEFAULT_LINK_BUDGET)),
+                           'cameras': members})
+    return groups
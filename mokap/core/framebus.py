@@ -0,0 +1,318 @@
+import sys
+import time
+from multiprocessing import shared_memory
+from typing import Union
+import numpy as np
+
+##
+
+# Layout of a bus (one shared memory segment per camera):
+#
+#   [ header (64 bytes) | slot 0 header (64 bytes) | slot 0 data | slot 1 header | slot 1 data | ... ]
+#
+# Frames are written to the slots in a ring. Each slot header has a sequence number that is odd while the slot is
+# being written, and even when it is stable (seqlock): readers check that it did not change while they read.
+
+MAGIC = b'MKFB'
+VERSION = 1
+HEADER_SIZE = 64
+SLOT_HEADER_SIZE = 64
+
+HEADER_DTYPE = np.dtype([('magic', 'S4'),
+                         ('version', '<u4'),
+                         ('nb_slots', '<u4'),
+                         ('state', '<u4'),          # 1 while the publisher is alive
+                         ('slot_size', '<u8'),      # Bytes of frame data a slot can hold
+                         ('count', '<u8'),          # Number of frames published so far
+                         ('_pad', 'V32')])
+
+SLOT_DTYPE = np.dtype([('seq', '<u8'),
+                       ('index', '<u8'),            # Index of the frame in the publication order
+                       ('frame_nb', '<u8'),         # The camera's frame number
+                       ('timestamp', '<f8'),        # When the frame was grabbed (seconds since the epoch)
+                       ('shape', '<u4', (3,)),
+                       ('ndim', '<u4'),
+                       ('dtype', 'S8'),
+                       ('_pad', 'V8')])
+
+
+def bus_name(prefix: str, camera_name: str) -> str:
+    """ Name of the shared memory segment of a camera """
+    return f'{prefix}_{camera_name}'
+
+
+def _aligned(size: int, alignment: int = 64) -> int:
+    return (size + alignment - 1) // alignment * alignment
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """
+        Opens an existing segment without registering it to the resource tracker: otherwise the segment
+        would be destroyed when the subscriber exits (or, worse, unregistered from the publisher's tracker)
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+
+    from multiprocessing import resource_tracker
+    register = resource_tracker.register
+    resource_tracker.register = lambda n, rtype: None if rtype == 'shared_memory' else register(n, rtype)
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class FramePublisher:
+    """
+        Writes frames to a named shared memory ring, for other processes to read (see FrameSubscriber).
+        There must be only one publisher per bus, and it never waits for the subscribers.
+    """
+
+    def __init__(self, name: str, max_shape, dtype=np.uint8, nb_slots: int = 8):
+        """
+            Parameters
+            ----------
+            name : str
+                Name of the shared memory segment
+            max_shape : tuple
+                Shape of the largest frame that will be published
+            dtype : numpy dtype
+            nb_slots : int
+                Size of the ring (how many frames behind a subscriber can be before it misses some)
+        """
+        self._name = name
+        self._nb_slots = max(2, int(nb_slots))
+        self._slot_size = _aligned(int(np.prod(max_shape)) * np.dtype(dtype).itemsize)
+        self._slot_stride = SLOT_HEADER_SIZE + self._slot_size
+        size = HEADER_SIZE + self._nb_slots * self._slot_stride
+
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Leftover from a previous run that did not exit cleanly
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        buf = self._shm.buf
+        self._header = np.ndarray((), dtype=HEADER_DTYPE, buffer=buf, offset=0)
+        self._slots = [np.ndarray((), dtype=SLOT_DTYPE, buffer=buf, offset=HEADER_SIZE + i * self._slot_stride)
+                       for i in range(self._nb_slots)]
+        self._data = [np.ndarray((self._slot_size,), dtype=np.uint8, buffer=buf,
+                                 offset=HEADER_SIZE + i * self._slot_stride + SLOT_HEADER_SIZE)
+                      for i in range(self._nb_slots)]
+
+        self._header['magic'] = MAGIC
+        self._header['version'] = VERSION
+        self._header['nb_slots'] = self._nb_slots
+        self._header['slot_size'] = self._slot_size
+        self._header['count'] = 0
+        self._header['state'] = 1
+
+        self._count = 0
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def publish(self, frame: np.ndarray, frame_nb: int, timestamp: float = None) -> None:
+        if frame.nbytes > self._slot_size:
+            raise ValueError(f'Frame too large for bus {self._name} ({frame.nbytes} > {self._slot_size} bytes)')
+
+        i = self._count % self._nb_slots
+        slot = self._slots[i]
+        seq = int(slot['seq'])
+
+        slot['seq'] = seq + 1   # Odd: being written
+
+        dst = self._data[i][:frame.nbytes].view(frame.dtype).reshape(frame.shape)
+        np.copyto(dst, frame)
+
+        slot['index'] = self._count
+        slot['frame_nb'] = frame_nb
+        slot['timestamp'] = time.time() if timestamp is None else timestamp
+        slot['shape'] = frame.shape + (0,) * (3 - frame.ndim)
+        slot['ndim'] = frame.ndim
+        slot['dtype'] = frame.dtype.str.encode()
+
+        slot['seq'] = seq + 2   # Even: stable
+
+        self._count += 1
+        self._header['count'] = self._count
+
+    def close(self, unlink: bool = True) -> None:
+        if self._shm is None:
+            return
+        self._header['state'] = 0
+        # The numpy views must be released before the segment can be closed
+        self._header, self._slots, self._data = None, [], []
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+        self._shm = None
+
+
+class BusFrame:
+    """
+        A frame read from a bus. The array is a read-only view into the shared memory (no copy), so it is only
+        guaranteed to hold this frame until the publisher wraps around the ring: check valid() after using it,
+        or use copy()
+    """
+
+    __slots__ = ('array', 'index', 'frame_nb', 'timestamp', '_slot', '_seq')
+
+    def __init__(self, array, index, frame_nb, timestamp, slot, seq):
+        self.array = array
+        self.index = index
+        self.frame_nb = frame_nb
+        self.timestamp = timestamp
+        self._slot = slot
+        self._seq = seq
+
+    def valid(self) -> bool:
+        """ Whether the array still holds this frame """
+        return int(self._slot['seq']) == self._seq
+
+    def copy(self) -> Union[np.ndarray, None]:
+        """ A copy of the frame (None if it was overwritten in the meantime) """
+        arr = self.array.copy()
+        return arr if self.valid() else None
+
+
+class FrameSubscriber:
+    """
+        Reads frames from a bus written by a FramePublisher (possibly in another process)
+    """
+
+    def __init__(self, name: str, timeout: float = 0.0):
+        """
+            Parameters
+            ----------
+            name : str
+                Name of the shared memory segment
+            timeout : float
+                How long to wait for the bus to be created (in seconds)
+        """
+        self._name = name
+
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self._shm = _attach(name)
+                break
+            except FileNotFoundError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.05)
+
+        buf = self._shm.buf
+        self._header = np.ndarray((), dtype=HEADER_DTYPE, buffer=buf, offset=0)
+        if self._header['magic'].item() != MAGIC:
+            self.close()
+            raise ValueError(f'{name} is not a frame bus')
+
+        self._nb_slots = int(self._header['nb_slots'])
+        self._slot_size = int(self._header['slot_size'])
+        slot_stride = SLOT_HEADER_SIZE + self._slot_size
+        self._slots = [np.ndarray((), dtype=SLOT_DTYPE, buffer=buf, offset=HEADER_SIZE + i * slot_stride)
+                       for i in range(self._nb_slots)]
+        self._data = [np.ndarray((self._slot_size,), dtype=np.uint8, buffer=buf,
+                                 offset=HEADER_SIZE + i * slot_stride + SLOT_HEADER_SIZE)
+                      for i in range(self._nb_slots)]
+
+        # Start with the frames published from now on
+        self._next = int(self._header['count'])
+        self._overruns = 0
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def alive(self) -> bool:
+        """ Whether the publisher is still publishing """
+        return self._header is not None and int(self._header['state']) == 1
+
+    @property
+    def published(self) -> int:
+        """ Total number of frames published """
+        return int(self._header['count'])
+
+    @property
+    def overruns(self) -> int:
+        """ Number of frames this subscriber missed because it was too slow """
+        return self._overruns
+
+    def _read(self, index: int) -> Union[BusFrame, None]:
+        slot = self._slots[index % self._nb_slots]
+
+        seq = int(slot['seq'])
+        if seq & 1 or int(slot['index']) != index:
+            return None
+
+        ndim = int(slot['ndim'])
+        shape = tuple(int(v) for v in slot['shape'][:ndim])
+        dtype = np.dtype(slot['dtype'].item().decode())
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        frame_nb = int(slot['frame_nb'])
+        timestamp = float(slot['timestamp'])
+
+        array = self._data[index % self._nb_slots][:nbytes].view(dtype).reshape(shape)
+        array.flags.writeable = False
+
+        if int(slot['seq']) != seq:
+            return None
+        return BusFrame(array, index, frame_nb, timestamp, slot, seq)
+
+    def latest(self) -> Union[BusFrame, None]:
+        """
+            The most recent frame (None if nothing was published yet)
+        """
+        count = self.published
+        if count == 0:
+            return None
+        frame = self._read(count - 1)
+        if frame is not None:
+            self._next = count
+        return frame
+
+    def next(self, timeout: float = None, poll: float = 0.0001) -> Union[BusFrame, None]:
+        """
+            The frame after the last one read (waiting up to timeout seconds for it, forever if None).
+            If the publisher got more than a ring ahead, the missed frames are counted in overruns
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            count = self.published
+
+            if count > self._next:
+                # The oldest slot may be being overwritten right now, so it can't be read safely
+                oldest = count - self._nb_slots + 1
+                if self._next < oldest:
+                    self._overruns += oldest - self._next
+                    self._next = oldest
+
+                frame = self._read(self._next)
+                if frame is not None:
+                    self._next += 1
+                    return frame
+                continue    # Overwritten while reading, try again
+
+            if not self.alive:
+                return None
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(poll)
+
+    def close(self) -> None:
+        if self._shm is None:
+            return
+        self._header, self._slots, self._data = None, [], []
+        self._shm.close()
+        self._shm = None
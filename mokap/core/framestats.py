@@ -0,0 +1,57 @@
+from typing import Tuple
+import cv2
+import numpy as np
+
+##
+
+
+def compute_frame_stats(frame: np.ndarray,
+                        stride: int = 4,
+                        bins: int = 16,
+                        saturation_level: int = 255) -> Tuple[float, float, float, np.ndarray]:
+    """
+        Image quality statistics of a frame, computed on a strided subsample of it (every stride-th pixel in
+        both directions), which is plenty for these and a lot cheaper than using the full frame
+
+        Parameters
+        ----------
+        frame : np.ndarray
+            (h, w) or (h, w, 3) uint8 frame
+        stride : int
+            Subsampling step
+        bins : int
+            Number of histogram bins (must divide 256)
+        saturation_level : int
+            Pixels at or above this value are counted as saturated
+
+        Returns
+        -------
+        mean : float
+            Mean pixel value (0 - 255)
+        saturation : float
+            Fraction of saturated pixels
+        sharpness : float
+            Variance of the Laplacian (focus score, higher is sharper. Only comparable between frames taken
+            with the same stride)
+        histogram : np.ndarray
+            Fraction of pixels in each bin
+    """
+    sub = frame[::stride, ::stride]
+    if sub.ndim == 3:
+        sub = cv2.cvtColor(np.ascontiguousarray(sub), cv2.COLOR_RGB2GRAY)
+    else:
+        sub = np.ascontiguousarray(sub)
+
+    nb_pixels = sub.size
+
+    counts = np.bincount(sub.ravel(), minlength=256)
+    histogram = counts.reshape(bins, -1).sum(axis=1) / nb_pixels
+
+    mean = float(np.dot(counts, np.arange(256)) / nb_pixels)
+    saturation = float(counts[saturation_level:].sum() / nb_pixels)
+
+    laplacian = cv2.Laplacian(sub, cv2.CV_16S)
+    _, std = cv2.meanStdDev(laplacian)
+    sharpness = float(std[0, 0] ** 2)
+
+    return mean, saturation, sharpness, histogram
@@ -1,7 +1,10 @@
 import time
 import math
+from threading import Event
+from collections import deque
 import numpy as np
 import mokap.utils as utils
+from mokap.core.bandwidth import bytes_per_pixel, required_bandwidth
 import os
 from dotenv import load_dotenv
 import pypylon.pylon as py
@@ -323,16 +326,75 @@ class SerialTrigger:
 
 ##
 
+def suggest_buffer_count(framerate: float, stall: float, margin: float = 1.5, minimum: int = 8) -> int:
+    """
+        Number of stream grabber buffers needed to ride out a stall of the given duration (in seconds) at a framerate
+    """
+    return max(minimum, int(math.ceil(framerate * stall * margin)) + 2)
+
+
+class FrameEventHandler(py.ImageEventHandler):
+    """
+        Receives the frames from pylon's own grab loop thread (see BaslerCamera.start_grabbing), and queues them for
+        a Python thread to pick up. The callback holds the GIL, so it does as little as possible: copy and enqueue.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._queue = deque()
+        self._event = Event()
+        self.failed = 0
+
+    def OnImageGrabbed(self, camera, grab_result):
+        if grab_result.GrabSucceeded():
+            # GetArray() copies the frame, so the pylon buffer goes back to the pool right after this
+            self._queue.append((grab_result.ImageNumber, grab_result.GetArray(), time.time()))
+            self._event.set()
+        else:
+            self.failed += 1
+
+    def get(self, timeout: float = 0.5) -> List[tuple]:
+        """
+            All the frames (image number, frame, timestamp) received since the last call,
+            waiting up to timeout seconds if there are none yet
+        """
+        if not self._queue:
+            self._event.wait(timeout)
+            self._event.clear()
+        frames = []
+        while self._queue:
+            frames.append(self._queue.popleft())
+        return frames
+
+
 class BaslerCamera:
     instancied_cams = []
 
+    # The stream grabber counters we care about (not all of them exist on all transport layers)
+    STREAM_STATISTICS = ['Total_Buffer_Count', 'Failed_Buffer_Count', 'Buffer_Underrun_Count',
+                         'Missed_Frame_Count', 'Resynchronization_Count', 'Out_Of_Memory_Error_Count',
+                         'Resend_Request_Count', 'Resend_Packet_Count', 'Total_Packet_Count']
+
+    # The ones that mean frames were lost or damaged
+    STREAM_ERRORS = ['failed_buffer_count', 'buffer_underrun_count', 'missed_frame_count']
+
     def __init__(self,
                  name='unnamed',
                  framerate=60,
                  exposure=5000,
                  triggered=True,
                  binning=1,
-                 binning_mode='sum'):
+                 binning_mode='sum',
+                 max_buffers=20,
+                 throughput_limit=342000000):
+        """
+            Parameters
+            ----------
+            max_buffers : int
+                Number of buffers of the stream grabber (how many frames can wait for the grabber thread)
+            throughput_limit : int or None
+                USB link throughput limit in bytes/s (None for no limit)
+        """
 
         self._ptr = None
         self._dptr = None
@@ -353,11 +415,14 @@ class BaslerCamera:
         self._triggered = triggered
         self._binning_value = binning
         self._binning_mode = binning_mode
+        self._max_buffers = int(max_buffers)
+        self._throughput_limit = throughput_limit
 
         self._idx = -1
 
         self._connected = False
         self._is_grabbing = False
+        self._handler = None
 
     def __repr__(self):
         if self._connected:
@@ -418,9 +483,9 @@ class BaslerCamera:
         self.ptr.AcquisitionMode.Value = 'Continuous'
         self.ptr.ExposureMode = 'Timed'
 
-        self.ptr.DeviceLinkThroughputLimitMode.SetValue('On')
-        # 342 Mbps is a bit less than the maximum, but things are more stable like this
-        self.ptr.DeviceLinkThroughputLimit.SetValue(342000000)
+        # The default 342 MB/s is a bit less than the maximum, but things are more stable like this
+        self.throughput_limit = self._throughput_limit
+        self.max_buffers = self._max_buffers
 
         if self._probe_frame_shape is None:
             probe_frame = self.ptr.GrabOne(100)
@@ -433,7 +498,6 @@ class BaslerCamera:
             self.ptr.GainAuto = 'Off'
             self.ptr.TriggerDelay.Value = 0.0
             self.ptr.LineDebouncerTime.Value = 5.0
-            self.ptr.MaxNumBuffer = 20
 
             self.ptr.TriggerSelector = "FrameStart"
 
@@ -486,10 +550,19 @@ class BaslerCamera:
             self.ptr.UserSetLoad.Execute()
             
 
-    def start_grabbing(self) -> NoReturn:
+    def start_grabbing(self, handler: Union[None, FrameEventHandler] = None) -> NoReturn:
+        """
+            Starts grabbing. Without a handler, frames are retrieved with ptr.RetrieveResult(). With a handler,
+            pylon runs the grab loop in its own thread and passes the frames to the handler
+        """
         if self._connected:
             if not self._is_grabbing:
-                self.ptr.StartGrabbing()
+                if handler is None:
+                    self.ptr.StartGrabbing()
+                else:
+                    self.ptr.RegisterImageEventHandler(handler, py.RegistrationMode_ReplaceAll, py.Cleanup_None)
+                    self.ptr.StartGrabbing(py.GrabStrategy_OneByOne, py.GrabLoop_ProvidedByInstantCamera)
+                    self._handler = handler
                 self._is_grabbing = True
         else:
             print(f"{self.name.title()} camera is not connected")
@@ -498,6 +571,9 @@ class BaslerCamera:
         if self._connected:
             if self._is_grabbing:
                 self.ptr.StopGrabbing()
+                if self._handler is not None:
+                    self.ptr.DeregisterImageEventHandler(self._handler)
+                    self._handler = None
                 self._is_grabbing = False
         else:
             print(f"{self.name.title()} camera is not connected")
@@ -744,6 +820,92 @@ class BaslerCamera:
         else:
             return 'Ok'
 
+    @property
+    def link_throughput(self) -> Union[int, None]:
+        """ Current throughput of the USB link, in bytes/s """
+        if not self._is_virtual:
+            try:
+                return int(self.ptr.DeviceLinkCurrentThroughput.Value)
+            except py.GenericException:
+                return None
+        else:
+            return None
+
+    @property
+    def link_throughput_limit(self) -> Union[int, None]:
+        """ Throughput limit of the USB link, in bytes/s (None if there is no limit) """
+        try:
+            if self.ptr.DeviceLinkThroughputLimitMode.Value == 'On':
+                return int(self.ptr.DeviceLinkThroughputLimit.Value)
+            return None
+        except py.GenericException:
+            return None
+
+    @property
+    def max_buffers(self) -> int:
+        return self._max_buffers
+
+    @max_buffers.setter
+    def max_buffers(self, value: int):
+        """ This only takes effect the next time grabbing starts """
+        self._max_buffers = max(1, int(value))
+        if self._ptr is not None:
+            self.ptr.MaxNumBuffer = self._max_buffers
+
+    @property
+    def throughput_limit(self) -> Union[int, None]:
+        return self._throughput_limit
+
+    @throughput_limit.setter
+    def throughput_limit(self, value: Union[int, None]):
+        self._throughput_limit = None if value is None else int(value)
+        if self._ptr is not None:
+            try:
+                if self._throughput_limit is None:
+                    self.ptr.DeviceLinkThroughputLimitMode.SetValue('Off')
+                else:
+                    node = self.ptr.DeviceLinkThroughputLimit
+                    self._throughput_limit = int(min(max(self._throughput_limit, node.Min), node.Max))
+                    self.ptr.DeviceLinkThroughputLimitMode.SetValue('On')
+                    node.SetValue(self._throughput_limit)
+            except py.GenericException as e:
+                print(f'[WARN] Could not set the throughput limit of {self.name}: {e}')
+
+    @property
+    def max_throughput_limit(self) -> Union[int, None]:
+        """ Highest throughput limit the link accepts, in bytes/s """
+        try:
+            return int(self.ptr.DeviceLinkThroughputLimit.Max)
+        except py.GenericException:
+            return None
+
+    @property
+    def bytes_per_pixel(self) -> float:
+        try:
+            return bytes_per_pixel(self.ptr.PixelFormat.Value)
+        except py.GenericException:
+            return 1.0
+
+    @property
+    def bandwidth(self) -> float:
+        """ Data rate needed at the current resolution (after binning), pixel format and framerate, in bytes/s """
+        return required_bandwidth(self.width, self.height, self.bytes_per_pixel, self.framerate)
+
+    @property
+    def stream_statistics(self) -> dict:
+        """ Counters of the stream grabber (buffers, failures, underruns, etc) """
+        stats = {}
+        if self._connected:
+            nodemap = self.ptr.GetStreamGrabberNodeMap()
+            for name in BaslerCamera.STREAM_STATISTICS:
+                try:
+                    node = nodemap.GetNode(f'Statistic_{name}')
+                    if node is not None:
+                        stats[name.lower()] = int(node.GetValue())
+                except py.GenericException:
+                    pass
+        return stats
+
 
 ##
 
@@ -0,0 +1,222 @@
+import time
+from threading import Thread, Event, Lock
+from typing import List, Union
+import cv2
+import numpy as np
+from mokap.core.processing import Processor, ProcessingStage
+
+##
+
+
+class MotionDetector(Processor):
+    """
+        Background subtraction (MOG2) on decimated frames. The result is the fraction of the frame that moves,
+        and the bounding box of the moving pixels
+    """
+
+    name = 'motion'
+
+    def __init__(self, decimation: int = 4, history: int = 500, var_threshold: float = 16, learning_rate: float = -1):
+        """
+            Parameters
+            ----------
+            decimation : int
+                Only every decimation-th pixel is used, in both directions
+            history : int
+                Number of frames the background model is made of
+            var_threshold : float
+                How far (squared Mahalanobis distance) from the background a pixel must be to count as moving
+            learning_rate : float
+                Background learning rate (negative means automatic, from the history)
+        """
+        self._decimation = max(1, int(decimation))
+        self._history = int(history)
+        self._var_threshold = float(var_threshold)
+        self._learning_rate = float(learning_rate)
+        self._subtractors = {}
+        self._kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+
+    def process(self, frame, frame_nb, cam_idx) -> dict:
+        d = self._decimation
+        small = frame[::d, ::d]
+        if small.ndim == 3:
+            small = cv2.cvtColor(np.ascontiguousarray(small), cv2.COLOR_RGB2GRAY)
+        else:
+            small = np.ascontiguousarray(small)
+
+        subtractor = self._subtractors.get(cam_idx)
+        if subtractor is None:
+            subtractor = cv2.createBackgroundSubtractorMOG2(history=self._history,
+                                                            varThreshold=self._var_threshold,
+                                                            detectShadows=False)
+            self._subtractors[cam_idx] = subtractor
+
+        mask = subtractor.apply(small, learningRate=self._learning_rate)
+        # Isolated pixels are (most likely) sensor noise
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self._kernel)
+
+        moving = cv2.countNonZero(mask)
+        fraction = moving / mask.size
+
+        result = {'motion': fraction, 'text': f'Motion: {fraction * 100:.2f}%'}
+        if moving:
+            x, y, w, h = cv2.boundingRect(mask)
+            result['boxes'] = [(x * d, y * d, w * d, h * d)]
+        return result
+
+
+class MotionGate:
+    """
+        Starts and stops recording sessions on a MultiCam when something moves in front of the cameras.
+
+        A session starts when motion (on any of the watched cameras) lasts for at least lag seconds, and stops when
+        nothing moved for post_roll seconds. The frames grabbed during the pre-roll are added to the session by MultiCam.
+        A session stopped by someone else (i.e. the user) only re-arms the gate after a quiet period.
+    """
+
+    def __init__(self,
+                 multicam,
+                 cameras: Union[List[int], None] = None,
+                 threshold: float = 0.2,
+                 lag: float = 0.2,
+                 post_roll: float = 5.0,
+                 warmup: float = 5.0,
+                 decimation: int = 4,
+                 silent: bool = True):
+        """
+            Parameters
+            ----------
+            multicam : MultiCam
+            cameras : list of int or None
+                Which cameras to watch (default: all)
+            threshold : float
+                Percentage of the frame that must move to count as motion
+            lag : float
+                How long (in seconds) motion must last to start recording
+            post_roll : float
+                How long (in seconds) to keep recording after the motion stopped
+            warmup : float
+                How long (in seconds) the background model learns before it can trigger anything
+            decimation : int
+                Subsampling of the frames (see MotionDetector)
+        """
+        self._mc = multicam
+        self._cameras = cameras
+        self._threshold = float(threshold) / 100
+        self._lag = float(lag)
+        self._post_roll = float(post_roll)
+        self._warmup = float(warmup)
+        self._decimation = decimation
+        self._silent = silent
+
+        self._lock = Lock()
+        self._levels = {}
+        self._motion_since: Union[None, float] = None
+        self._last_motion = 0.0
+
+        self._stage: Union[None, ProcessingStage] = None
+        self._thread: Union[None, Thread] = None
+        self._running = Event()
+        self._wakeup = Event()
+
+        self._started_at = 0.0
+        self._recording = False     # Whether the current session was started by this gate
+        self._armed = True
+
+    @property
+    def moving(self) -> bool:
+        return self._motion_since is not None
+
+    @property
+    def levels(self) -> dict:
+        """ Latest fraction of moving pixels, per camera """
+        return dict(self._levels)
+
+    @property
+    def recording(self) -> bool:
+        """ Whether the current session was started by motion """
+        return self._recording
+
+    @property
+    def stage(self) -> Union[None, ProcessingStage]:
+        return self._stage
+
+    def start(self) -> None:
+        if self._running.is_set():
+            return
+        self._levels = {}
+        self._motion_since = None
+        self._recording = False
+        self._armed = True
+        self._started_at = time.monotonic()
+
+        # Only the most recent frame matters, so the detector never lags behind
+        self._stage = self._mc.pipeline.add(MotionDetector(decimation=self._decimation),
+                                            cameras=self._cameras, policy='latest')
+        self._stage.subscribe(self._on_result)
+
+        self._running.set()
+        self._thread = Thread(target=self._gate_thread, daemon=True)
+        self._thread.start()
+
+        if not self._silent:
+            print(f'[INFO] Motion trigger armed (threshold {self._threshold * 100:.2f}%, post-roll {self._post_roll:.1f}s)')
+
+    def stop(self) -> None:
+        """
+            Stops watching (a session in progress is left to the caller)
+        """
+        if not self._running.is_set():
+            return
+        self._running.clear()
+        self._wakeup.set()
+        self._thread.join(timeout=2.0)
+        self._thread = None
+        self._mc.pipeline.remove(self._stage)
+        self._stage = None
+
+    def _on_result(self, cam_idx: int, frame_nb: int, result: dict) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._levels[cam_idx] = result['motion']
+            if any(level >= self._threshold for level in self._levels.values()):
+                self._last_motion = now
+                if self._motion_since is None:
+                    self._motion_since = now
+            else:
+                self._motion_since = None
+        self._wakeup.set()
+
+    def _gate_thread(self) -> None:
+        while self._running.is_set():
+            self._wakeup.wait(0.05)
+            self._wakeup.clear()
+
+            now = time.monotonic()
+            if now - self._started_at < self._warmup:
+                continue
+
+            with self._lock:
+                motion_since = self._motion_since
+                quiet_for = now - self._last_motion
+
+            if not self._mc.recording:
+                if self._recording:
+                    # Someone else stopped our session: wait for things to calm down before triggering again
+                    self._recording = False
+                    self._armed = False
+                if not self._armed:
+                    self._armed = motion_since is None and quiet_for >= self._post_roll
+                    continue
+
+                if motion_since is not None and now - motion_since >= self._lag:
+                    if not self._silent:
+                        print('[INFO] Motion detected')
+                    self._mc.record(trigger='motion')
+                    self._recording = self._mc.recording
+
+            elif self._recording and quiet_for >= self._post_roll:
+                if not self._silent:
+                    print('[INFO] No motion anymore')
+                self._mc.pause()
+                self._recording = False
@@ -0,0 +1,530 @@
+import json
+import time
+from threading import Thread, Event, Lock
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Union, Callable, Any, Dict
+import numpy as np
+
+##
+
+DROP_POLICIES = ('latest', 'every', 'queue')
+
+
+class Processor:
+    """
+        Base class for the frame processors. Subclasses implement process(), which receives one frame and returns
+        anything. Multi-camera processors (multi_camera = True) receive one frame per camera instead, all with the same
+        frame number if the cameras are hardware-triggered.
+
+        Results that are dicts with 'boxes' [(x, y, w, h), ...], 'points' [(x, y), ...] and/or 'text' entries (in full
+        resolution pixel coordinates) are drawn on the live video windows.
+    """
+
+    name: str = None
+    multi_camera: bool = False
+
+    def setup(self) -> None:
+        """
+            Called once before the first frame, in the thread or process that will run process()
+        """
+        pass
+
+    def process(self, frame, frame_nb: int, cam_idx) -> Any:
+        """
+            Parameters
+            ----------
+            frame : np.ndarray, or list of np.ndarray for multi-camera processors
+            frame_nb : int
+                The camera's frame number
+            cam_idx : int, or list of int for multi-camera processors
+        """
+        raise NotImplementedError
+
+    def to_json(self, result: Any) -> Any:
+        """
+            Converts a result to something json can write (for the sidecar files)
+        """
+        return _jsonable(result)
+
+
+def _jsonable(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {str(k): _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    return value
+
+
+# Processors that run in a process pool are set up once per worker process
+_worker_processor: Union[Processor, None] = None
+
+
+def _init_worker(processor: Processor):
+    global _worker_processor
+    _worker_processor = processor
+    _worker_processor.setup()
+
+
+def _run_in_worker(frame, frame_nb, cam_idx):
+    start = time.perf_counter()
+    result = _worker_processor.process(frame, frame_nb, cam_idx)
+    return result, time.perf_counter() - start
+
+
+class ProcessingStage:
+    """
+        Runs one processor on the frames of some cameras, on a pool of threads (or processes).
+
+        Frames are offered by the grabber threads and wait in a small inbox per camera until a worker is free.
+        What happens when the processor can't keep up depends on the policy:
+            - 'latest': only the most recent frame of each camera is kept (the others are dropped)
+            - 'every': only every N-th frame is taken, then queued (up to maxsize)
+            - 'queue': all frames are queued, up to maxsize (new frames are dropped when it's full)
+    """
+
+    def __init__(self,
+                 processor: Processor,
+                 cameras: List[int],
+                 policy: str = 'latest',
+                 every: int = 1,
+                 maxsize: int = 8,
+                 workers: int = 1,
+                 use_processes: bool = False,
+                 sidecar: bool = False,
+                 sidecar_path: Callable = None,
+                 silent: bool = True):
+
+        if policy not in DROP_POLICIES:
+            raise ValueError(f'Unknown drop policy {policy} (must be one of {", ".join(DROP_POLICIES)})')
+
+        self._processor = processor
+        self._name = processor.name or type(processor).__name__.lower()
+        self._cameras = list(cameras)
+        self._multi = processor.multi_camera
+        self._policy = policy
+        self._every = max(1, int(every))
+        self._maxsize = max(1, int(maxsize))
+        self._workers = max(1, int(workers))
+        self._use_processes = use_processes
+        self._silent = silent
+
+        # Multi-camera stages have a single inbox, that receives complete sets of frames
+        keys = [None] if self._multi else self._cameras
+        maxlen = 1 if policy == 'latest' else None
+        self._inboxes: Dict[Union[int, None], deque] = {k: deque(maxlen=maxlen) for k in keys}
+        self._offered = {k: 0 for k in self._cameras}
+
+        # Partial sets of frames (multi-camera stages only)
+        self._by_number = True
+        self._partial_sets = OrderedDict()
+        self._latest_frames = {}
+        self._sets_lock = Lock()
+
+        self._results: Dict[Union[int, None], tuple] = {}
+        self._callbacks: List[Callable] = []
+
+        self._sidecar = sidecar
+        self._sidecar_path = sidecar_path
+        self._sidecar_files = {}
+        self._sidecar_lock = Lock()
+
+        # Stats
+        self._lock = Lock()
+        self._received = 0
+        self._dropped = 0
+        self._processed = 0
+        self._errors = 0
+        self._in_flight = 0
+        self._latencies = deque(maxlen=1000)    # (queued, processing, total) in seconds
+        self._started_at = time.monotonic()
+
+        self._wakeup = Event()
+        self._running = False
+        self._executor = None
+        self._thread = None
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def processor(self) -> Processor:
+        return self._processor
+
+    @property
+    def cameras(self) -> List[int]:
+        return self._cameras
+
+    @property
+    def multi_camera(self) -> bool:
+        return self._multi
+
+    @property
+    def by_number(self) -> bool:
+        return self._by_number
+
+    @by_number.setter
+    def by_number(self, value: bool):
+        """ Whether multi-camera sets are made of frames with the same frame number (i.e. hardware trigger) """
+        with self._sets_lock:
+            self._by_number = bool(value)
+            self._partial_sets.clear()
+            self._latest_frames.clear()
+
+    def start(self) -> None:
+        if self._running:
+            return
+        if self._use_processes:
+            self._executor = ProcessPoolExecutor(max_workers=self._workers,
+                                                 initializer=_init_worker, initargs=(self._processor,))
+        else:
+            self._processor.setup()
+            self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix=f'stage_{self._name}')
+        self._running = True
+        self._started_at = time.monotonic()
+        self._thread = Thread(target=self._dispatcher_thread, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._running = False
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        with self._sidecar_lock:
+            for f in self._sidecar_files.values():
+                f.close()
+            self._sidecar_files.clear()
+
+    def subscribe(self, callback: Callable) -> None:
+        """
+            Calls callback(cam_idx, frame_nb, result) (from a worker thread) for each result.
+            cam_idx is None for multi-camera processors
+        """
+        self._callbacks.append(callback)
+
+    #  ============= Input side (grabber threads) =============
+    def offer(self, cam_idx: int, frame_nb: int, timestamp: float, frame: np.ndarray, session: int = -1) -> None:
+        """
+            Called by the grabber thread of a camera with each new frame, must stay cheap
+        """
+        self._received += 1     # Not atomic, but this is just for the stats
+
+        if self._policy == 'every':
+            self._offered[cam_idx] += 1
+            if (self._offered[cam_idx] - 1) % self._every != 0:
+                return
+
+        item = (frame_nb, timestamp, time.perf_counter(), session, frame)
+
+        if self._multi:
+            item = self._assemble(cam_idx, item)
+            if item is None:
+                return
+            cam_idx = None
+
+        inbox = self._inboxes[cam_idx]
+        if self._policy == 'latest':
+            if inbox:
+                self._dropped += 1     # The deque only keeps the newest
+            inbox.append(item)
+        elif len(inbox) < self._maxsize:
+            inbox.append(item)
+        else:
+            self._dropped += 1
+            return
+        self._wakeup.set()
+
+    def _assemble(self, cam_idx: int, item: tuple) -> Union[tuple, None]:
+        """
+            Collects the frames of the different cameras, and returns a set when it is complete
+        """
+        frame_nb, timestamp, queued, session, frame = item
+        with self._sets_lock:
+            if self._by_number:
+                frames = self._partial_sets.setdefault(frame_nb, {})
+                frames[cam_idx] = frame
+                if len(frames) < len(self._cameras):
+                    # Give up on sets that can't be completed anymore (some camera dropped that frame)
+                    while len(self._partial_sets) > 2 * self._maxsize + 2:
+                        self._partial_sets.popitem(last=False)
+                        self._dropped += 1
+                    return None
+                del self._partial_sets[frame_nb]
+                # Older partial sets will never complete either
+                for nb in [nb for nb in self._partial_sets if nb < frame_nb]:
+                    del self._partial_sets[nb]
+                    self._dropped += 1
+            else:
+                # No common frame number: a set is made each time all cameras have a new frame
+                self._latest_frames[cam_idx] = frame
+                if len(self._latest_frames) < len(self._cameras):
+                    return None
+                frames = self._latest_frames
+                self._latest_frames = {}
+
+        return frame_nb, timestamp, queued, session, [frames[c] for c in self._cameras]
+
+    #  ============= Dispatching and results =============
+    def _dispatcher_thread(self) -> None:
+        keys = list(self._inboxes.keys())
+        turn = 0
+        while self._running:
+            self._wakeup.wait(0.1)
+            self._wakeup.clear()
+
+            # Feed the workers, one camera at a time so none of them is starved
+            idle_rounds = 0
+            while self._running and self._in_flight < self._workers and idle_rounds < len(keys):
+                key = keys[turn % len(keys)]
+                turn += 1
+                inbox = self._inboxes[key]
+                try:
+                    item = inbox.popleft()
+                except IndexError:
+                    idle_rounds += 1
+                    continue
+                idle_rounds = 0
+                self._submit(key, item)
+
+    def _submit(self, key, item) -> None:
+        frame_nb, timestamp, queued, session, frame = item
+        cam_idx = self._cameras if key is None else key
+
+        with self._lock:
+            self._in_flight += 1
+        dispatched = time.perf_counter()
+
+        if self._use_processes:
+            future = self._executor.submit(_run_in_worker, frame, frame_nb, cam_idx)
+        else:
+            future = self._executor.submit(self._run, frame, frame_nb, cam_idx)
+        future.add_done_callback(lambda f: self._on_done(f, key, frame_nb, timestamp, queued, dispatched, session))
+
+    def _run(self, frame, frame_nb, cam_idx):
+        start = time.perf_counter()
+        result = self._processor.process(frame, frame_nb, cam_idx)
+        return result, time.perf_counter() - start
+
+    def _on_done(self, future, key, frame_nb, timestamp, queued, dispatched, session) -> None:
+        try:
+            result, duration = future.result()
+        except Exception as e:
+            with self._lock:
+                self._in_flight -= 1
+                self._errors += 1
+                first_error = self._errors == 1
+            if first_error and not self._silent:
+                print(f'[ERROR] Processor {self._name} failed: {e!r}')
+            self._wakeup.set()
+            return
+
+        now = time.perf_counter()
+        with self._lock:
+            self._in_flight -= 1
+            self._processed += 1
+            self._latencies.append((dispatched - queued, duration, time.time() - timestamp))
+        self._wakeup.set()
+
+        self._results[key] = (frame_nb, result)
+
+        for callback in self._callbacks:
+            try:
+                callback(key, frame_nb, result)
+            except Exception as e:
+                if not self._silent:
+                    print(f'[ERROR] Callback of processor {self._name} failed: {e!r}')
+
+        if self._sidecar and self._sidecar_path is not None:
+            self._write_sidecar(key, session, frame_nb, timestamp, result)
+
+    def _write_sidecar(self, key, session, frame_nb, timestamp, result) -> None:
+        with self._sidecar_lock:
+            # A new session (or no session at all): close the previous file of this camera
+            for k in [k for k in self._sidecar_files if k[0] == key and k[1] != session]:
+                self._sidecar_files.pop(k).close()
+
+            if session < 0 or result is None:
+                return
+
+            f = self._sidecar_files.get((key, session))
+            if f is None:
+                path = self._sidecar_path(key, f'{self._name}.jsonl', session)
+                if path is None:
+                    return
+                f = open(path, 'a', encoding='utf-8')
+                self._sidecar_files[(key, session)] = f
+
+            line = {'frame': int(frame_nb), 'timestamp': timestamp, 'result': self._processor.to_json(result)}
+            f.write(json.dumps(line) + '\n')
+
+    def latest_result(self, cam_idx: int = None) -> Union[tuple, None]:
+        """
+            Most recent (frame number, result) for a camera (or for the set of cameras, if multi-camera)
+        """
+        return self._results.get(None if self._multi else cam_idx)
+
+    @property
+    def stats(self) -> dict:
+        """
+            Counters, throughput, and latencies in ms (median and 95th percentile): time spent waiting for a worker,
+            processing time, and total time since the frame was grabbed
+        """
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000 if self._latencies else np.zeros((0, 3))
+            elapsed = max(1e-6, time.monotonic() - self._started_at)
+            stats = {'received': self._received,
+                     'dropped': self._dropped,
+                     'processed': self._processed,
+                     'errors': self._errors,
+                     'throughput': self._processed / elapsed}
+        for i, name in enumerate(['queued', 'processing', 'total']):
+            if len(latencies):
+                stats[f'{name}_ms'] = float(np.median(latencies[:, i]))
+                stats[f'{name}_p95_ms'] = float(np.percentile(latencies[:, i], 95))
+            else:
+                stats[f'{name}_ms'] = stats[f'{name}_p95_ms'] = float('nan')
+        return stats
+
+
+class FramePipeline:
+    """
+        The processing stages that receive the grabbed frames (see MultiCam.pipeline)
+    """
+
+    def __init__(self, nb_cameras: int, sidecar_path: Callable = None, silent: bool = True):
+        """
+            Parameters
+            ----------
+            nb_cameras : int
+            sidecar_path : callable
+                Function (cam_idx, suffix, session) -> Path where the results of a stage are written,
+                cam_idx being None for multi-camera stages
+        """
+        self._nb_cameras = nb_cameras
+        self._sidecar_path = sidecar_path
+        self._silent = silent
+
+        self._stages: List[ProcessingStage] = []
+        # For each camera, the stages that want its frames (replaced as a whole, so the grabbers can read it anytime)
+        self._routes: List[tuple] = [() for _ in range(nb_cameras)]
+        self._by_number = False
+
+    @property
+    def active(self) -> bool:
+        return len(self._stages) > 0
+
+    @property
+    def stages(self) -> List[ProcessingStage]:
+        return list(self._stages)
+
+    @property
+    def by_number(self) -> bool:
+        return self._by_number
+
+    @by_number.setter
+    def by_number(self, value: bool):
+        self._by_number = bool(value)
+        for stage in self._stages:
+            stage.by_number = value
+
+    def _update_routes(self) -> None:
+        self._routes = [tuple(s for s in self._stages if c in s.cameras) for c in range(self._nb_cameras)]
+
+    def add(self,
+            processor: Processor,
+            cameras: Union[List[int], None] = None,
+            policy: str = 'latest',
+            every: int = 1,
+            maxsize: int = 8,
+            workers: int = 1,
+            use_processes: bool = False,
+            sidecar: bool = False) -> ProcessingStage:
+        """
+            Adds a processor to the pipeline and starts it
+
+            Parameters
+            ----------
+            processor : Processor
+            cameras : list of int or None
+                Which cameras the processor gets frames from (default: all)
+            policy : str
+                What to do when the processor can't keep up: 'latest', 'every' or 'queue' (see ProcessingStage)
+            every : int
+                Only process every N-th frame (with the 'every' policy)
+            maxsize : int
+                Size of the queues (with the 'every' and 'queue' policies)
+            workers : int
+                Number of frames processed in parallel
+            use_processes : bool
+                Use a pool of processes instead of threads (for processors that hold the GIL)
+            sidecar : bool
+                Write the results to a .jsonl file alongside the recordings
+
+            Returns
+            -------
+            ProcessingStage
+        """
+        cameras = list(range(self._nb_cameras)) if cameras is None else [int(c) for c in cameras]
+        stage = ProcessingStage(processor, cameras,
+                                policy=policy, every=every, maxsize=maxsize,
+                                workers=workers, use_processes=use_processes,
+                                sidecar=sidecar, sidecar_path=self._sidecar_path,
+                                silent=self._silent)
+        if any(s.name == stage.name for s in self._stages):
+            raise ValueError(f'There is already a processor named {stage.name}')
+
+        stage.by_number = self._by_number
+        stage.start()
+        self._stages.append(stage)
+        self._update_routes()
+
+        if not self._silent:
+            print(f"[INFO] Processor {stage.name} added ({policy} policy, {workers} {'process' if use_processes else 'thread'}{'es' if use_processes and workers > 1 else 's' if workers > 1 else ''})")
+        return stage
+
+    def get(self, name: str) -> Union[ProcessingStage, None]:
+        return next((s for s in self._stages if s.name == name), None)
+
+    def remove(self, stage: Union[ProcessingStage, str]) -> None:
+        if isinstance(stage, str):
+            stage = self.get(stage)
+        if stage is None or stage not in self._stages:
+            return
+        self._stages.remove(stage)
+        self._update_routes()
+        stage.stop()
+
+    def feed(self, cam_idx: int, frame_nb: int, timestamp: float, frame: np.ndarray, session: int = -1) -> None:
+        """
+            Called by the grabber threads with every frame
+        """
+        for stage in self._routes[cam_idx]:
+            stage.offer(cam_idx, frame_nb, timestamp, frame, session)
+
+    def results(self, cam_idx: int) -> List[tuple]:
+        """
+            Latest (stage name, frame number, result) of all the stages that process a camera
+        """
+        results = []
+        for stage in self._routes[cam_idx]:
+            latest = stage.latest_result(cam_idx)
+            if latest is not None:
+                results.append((stage.name, *latest))
+        return results
+
+    def stats(self) -> Dict[str, dict]:
+        return {s.name: s.stats for s in self._stages}
+
+    def close(self) -> None:
+        for stage in list(self._stages):
+            self.remove(stage)
@@ -0,0 +1,494 @@
+from threading import Thread, Condition
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Union
+import cv2
+import numpy as np
+from mokap.utils import fileio
+
+##
+
+IMAGE_EXTENSIONS = ('.bmp', '.jpg', '.jpeg', '.png', '.tif', '.tiff')
+
+
+class StreamReader:
+    """
+        Random access to the frames of one recorded stream (one camera, one session).
+        Frames are returned as (h, w) or (h, w, 3) uint8 arrays, in RGB order for colour streams
+    """
+
+    def __init__(self, path: Union[Path, str], shape=None):
+        self._path = Path(path)
+        self._shape = tuple(shape) if shape is not None else None
+        self._nb_frames: int = 0
+        self._frame_numbers: Union[np.ndarray, None] = None
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def nb_frames(self) -> int:
+        return self._nb_frames
+
+    @property
+    def shape(self) -> Union[tuple, None]:
+        return self._shape
+
+    @property
+    def frame_numbers(self) -> Union[np.ndarray, None]:
+        """ The cameras' frame number of each frame (sorted), if the format stores them """
+        return self._frame_numbers
+
+    def read(self, i: int) -> Union[np.ndarray, None]:
+        if not 0 <= i < self._nb_frames:
+            return None
+        return self._read(i)
+
+    def _read(self, i: int) -> Union[np.ndarray, None]:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class VideoStreamReader(StreamReader):
+    """ mp4 (or any other video file OpenCV can decode) """
+
+    # Below this distance, it is cheaper to decode and drop frames than to ask the decoder to seek
+    MAX_SKIP = 8
+
+    def __init__(self, path, shape=None):
+        super().__init__(path, shape)
+
+        self._cap = cv2.VideoCapture(self._path.as_posix())
+        if not self._cap.isOpened():
+            raise IOError(f"Can't open {self._path}")
+
+        self._nb_frames = int(self._cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if self._shape is None:
+            self._shape = (int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH)))
+        self._next = 0
+
+    def _read(self, i):
+        if 0 <= self._next < i <= self._next + self.MAX_SKIP:
+            for _ in range(i - self._next):
+                self._cap.grab()
+        elif i != self._next:
+            # Seeking is expensive (the decoder has to go back to the previous keyframe)
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, i)
+
+        ok, frame = self._cap.read()
+        if not ok:
+            self._next = -1     # Unknown position, the next read will seek
+            return None
+        self._next = i + 1
+
+        if len(self._shape) == 2:
+            return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    def close(self):
+        self._cap.release()
+
+
+class ImageSequenceReader(StreamReader):
+    """
+        A folder of images named after their frame number. In image mode, all the sessions of an acquisition
+        are written to the same folder, so a session is a slice of the (sorted) files
+    """
+
+    def __init__(self, path, shape=None, first: int = 0, count: Union[int, None] = None):
+        super().__init__(path, shape)
+
+        files = sorted([f for f in self._path.glob('*') if f.suffix.lower() in IMAGE_EXTENSIONS],
+                       key=lambda f: fileio.natural_sort_key(f.name))
+        self._files = files[first:] if count is None else files[first:first + count]
+        self._nb_frames = len(self._files)
+
+        try:
+            self._frame_numbers = np.array([int(f.stem) for f in self._files], dtype=np.uint64)
+        except ValueError:
+            self._frame_numbers = None
+
+        if self._shape is None and self._files:
+            self._shape = self._read(0).shape
+
+    def _read(self, i):
+        frame = cv2.imread(self._files[i].as_posix(), cv2.IMREAD_UNCHANGED)
+        if frame is not None and frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        return frame
+
+
+class RawStreamReader(StreamReader):
+    """
+        Uncompressed frames written back to back, each preceded by its frame number (see fileio.raw_record_dtype).
+        The file is memory-mapped, so reading a frame is just a copy
+    """
+
+    def __init__(self, path, shape):
+        super().__init__(path, shape)
+
+        dtype = fileio.raw_record_dtype(self._shape)
+        # The last record may be incomplete if the file is still being written
+        self._nb_frames = self._path.stat().st_size // dtype.itemsize
+
+        if self._nb_frames > 0:
+            self._mmap = np.memmap(self._path, dtype=dtype, mode='r', shape=(self._nb_frames,))
+            self._frame_numbers = np.array(self._mmap['number'])
+        else:
+            self._mmap = None
+            self._frame_numbers = np.zeros(0, dtype=np.uint64)
+
+    def _read(self, i):
+        return np.array(self._mmap['frame'][i])
+
+    def close(self):
+        self._mmap = None
+
+
+def open_stream(path: Union[Path, str], shape=None, first: int = 0, count: Union[int, None] = None) -> StreamReader:
+    """
+        Opens the right reader for a stream (images folder, .raw file, or video file)
+    """
+    path = Path(path)
+    if path.is_dir():
+        return ImageSequenceReader(path, shape, first=first, count=count)
+    elif path.suffix.lower() == '.raw':
+        if shape is None:
+            raise ValueError(f'The frame shape is needed to read {path}')
+        return RawStreamReader(path, shape)
+    else:
+        return VideoStreamReader(path, shape)
+
+
+class BufferedStream:
+    """
+        Wraps a StreamReader with a decoding thread that reads ahead of the current position (the prefetch window)
+        into a LRU cache of frames. get() never decodes anything itself, so it can be called from the GUI thread
+    """
+
+    def __init__(self, reader: StreamReader, prefetch: int = 16, cache_size: int = 64):
+        self._reader = reader
+        self._prefetch = max(1, int(prefetch))
+        # The cache must at least hold the prefetch window, or frames would be evicted before being shown
+        self._cache_size = max(int(cache_size), self._prefetch + 2)
+
+        self._cache = OrderedDict()
+        self._cond = Condition()
+        self._cursor = 0
+        self._backwards = False
+        self._running = True
+
+        self._thread = Thread(target=self._decoder_thread, daemon=True)
+        self._thread.start()
+
+    @property
+    def reader(self) -> StreamReader:
+        return self._reader
+
+    @property
+    def nb_frames(self) -> int:
+        return self._reader.nb_frames
+
+    def seek(self, i: int) -> None:
+        """
+            Moves the prefetch window to frame i
+        """
+        with self._cond:
+            if i != self._cursor:
+                self._backwards = i < self._cursor
+            self._cursor = i
+            # Frames that could not be read are cached as None so they are not tried again and again while they are
+            # in the window, but they get another chance once the window has moved away from them
+            window = set(self._window(self._cursor, self._backwards))
+            for failed in [k for k, frame in self._cache.items() if frame is None and k not in window]:
+                del self._cache[failed]
+            self._cond.notify_all()
+
+    def ready(self, i: int) -> bool:
+        with self._cond:
+            return i in self._cache
+
+    def get(self, i: int, timeout: float = 0.0) -> Union[np.ndarray, None]:
+        """
+            Returns frame i if it is in the cache (waiting up to timeout seconds for it), None otherwise
+        """
+        with self._cond:
+            if timeout > 0 and i not in self._cache:
+                self._cond.wait_for(lambda: i in self._cache or not self._running, timeout=timeout)
+            if i in self._cache:
+                self._cache.move_to_end(i)
+                return self._cache[i]
+            return None
+
+    def _window(self, cursor: int, backwards: bool) -> List[int]:
+        """
+            Frames to have in cache, in the order they should be decoded: the one at the cursor first,
+            then the ones after it (or before it, when going backwards - but in increasing order, so that
+            video streams only seek once)
+        """
+        if backwards:
+            window = [cursor] + list(range(cursor - self._prefetch + 1, cursor))
+        else:
+            window = list(range(cursor, cursor + self._prefetch))
+        return [i for i in window if 0 <= i < self._reader.nb_frames]
+
+    def _decoder_thread(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                todo = None
+                for i in self._window(self._cursor, self._backwards):
+                    if i in self._cache:
+                        self._cache.move_to_end(i)  # Keep the window from being evicted
+                    elif todo is None:
+                        todo = i
+                if todo is None:
+                    # Everything is ready, wait for the cursor to move
+                    self._cond.wait()
+                    continue
+
+            # Decode outside of the lock so the GUI is never blocked by this
+            frame = self._reader.read(todo)
+
+            with self._cond:
+                self._cache[todo] = frame
+                while len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+                self._cond.notify_all()
+
+    def close(self) -> None:
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join(timeout=2.0)
+        self._reader.close()
+        self._cache.clear()
+
+
+def session_sources(path: Union[Path, str], session: int = 0) -> List[Union[dict, None]]:
+    """
+        Where the stream of each camera of a recording session is, and what open_stream() needs to read it:
+        one {'name', 'path', 'shape', 'first', 'count'} per camera (None if the stream can't be found)
+    """
+    path = Path(path)
+    if path.is_file():
+        path = path.parent
+
+    metadata = fileio.read_metadata(path)
+    nb_sessions = len(metadata['sessions'])
+    if not -nb_sessions <= session < nb_sessions:
+        raise IndexError(f'Session {session} does not exist (this acquisition has {nb_sessions} sessions)')
+    session = session % nb_sessions
+
+    streams = fileio.session_streams(path)[session]
+
+    sources = []
+    for cam in metadata['sessions'][session]['cameras']:
+        stream_path = streams.get(cam['name'])
+        if stream_path is None:
+            sources.append(None)
+            continue
+        sources.append({'name': cam['name'],
+                        'path': stream_path,
+                        'shape': cam.get('shape', [cam['height'], cam['width']]),
+                        'first': _previous_frames(metadata, session, cam) if stream_path.is_dir() else 0,
+                        'count': cam.get('frames')})
+    return sources
+
+
+def _previous_frames(metadata: dict, session: int, cam: dict) -> int:
+    """
+        Number of frames the earlier sessions wrote in the same images folder
+    """
+    volume = cam.get('volume', 0)
+    previous = 0
+    for s in metadata['sessions'][:session]:
+        for c in s['cameras']:
+            if c['name'] == cam['name'] and c.get('volume', 0) == volume:
+                previous += c.get('frames', 0)
+    return previous
+
+
+class SessionReplay:
+    """
+        Plays back one recording session of an acquisition, with all the cameras locked on the same frame.
+
+        If the cameras were hardware-triggered and the format stores the frame numbers (images, raw), frames
+        are matched by frame number, so dropped frames show up as gaps. Otherwise, they are matched by index.
+    """
+
+    def __init__(self,
+                 path: Union[Path, str],
+                 session: int = 0,
+                 prefetch: int = 16,
+                 cache_size: int = 64,
+                 silent: bool = True):
+
+        self._path = Path(path)
+        if self._path.is_file():
+            self._path = self._path.parent
+        self._silent = silent
+
+        self._metadata = fileio.read_metadata(self._path)
+        nb_sessions = len(self._metadata['sessions'])
+        if not -nb_sessions <= session < nb_sessions:
+            raise IndexError(f'Session {session} does not exist (this acquisition has {nb_sessions} sessions)')
+        self._session = session % nb_sessions
+        self._session_metadata = self._metadata['sessions'][self._session]
+
+        self._streams: List[Union[BufferedStream, None]] = []
+        for cam, source in zip(self._session_metadata['cameras'], session_sources(self._path, self._session)):
+            if source is None:
+                if not self._silent:
+                    print(f"[WARN] Can't find the stream of camera {cam['name']}")
+                self._streams.append(None)
+                continue
+
+            reader = open_stream(source['path'], shape=source['shape'], first=source['first'], count=source['count'])
+            self._streams.append(BufferedStream(reader, prefetch=prefetch, cache_size=cache_size))
+
+            if not self._silent:
+                print(f"[INFO] Camera {cam['name']}: {reader.nb_frames} frames in {source['path']}")
+
+        readers = [s.reader for s in self._streams if s is not None]
+        self._by_number = (bool(self._session_metadata.get('hardware_triggered', False))
+                           and len(readers) > 0
+                           and all(r.frame_numbers is not None for r in readers))
+
+        if self._by_number:
+            # The timeline is every frame number seen by at least one camera
+            self._timeline = np.unique(np.concatenate([r.frame_numbers for r in readers]))
+        else:
+            self._timeline = np.arange(max([r.nb_frames for r in readers], default=0), dtype=np.uint64)
+
+        self._position = 0
+        self.seek(0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def session(self) -> int:
+        return self._session
+
+    @property
+    def nb_sessions(self) -> int:
+        return len(self._metadata['sessions'])
+
+    @property
+    def metadata(self) -> dict:
+        """ Metadata of the session being replayed """
+        return self._session_metadata
+
+    @property
+    def nb_cameras(self) -> int:
+        return len(self._streams)
+
+    @property
+    def cameras_names(self) -> List[str]:
+        return [c['name'] for c in self._session_metadata['cameras']]
+
+    @property
+    def shapes(self) -> List[Union[tuple, None]]:
+        return [s.reader.shape if s is not None else None for s in self._streams]
+
+    @property
+    def framerate(self) -> Union[float, None]:
+        cam = self._session_metadata['cameras'][0]
+        return cam.get('framerate_theoretical', cam.get('framerate_actual'))
+
+    @property
+    def locked_by_number(self) -> bool:
+        return self._by_number
+
+    @property
+    def nb_frames(self) -> int:
+        """ Length of the timeline """
+        return len(self._timeline)
+
+    @property
+    def position(self) -> int:
+        return self._position
+
+    def frame_number(self, t: int = None) -> int:
+        """ The cameras' frame number at a position of the timeline (or its index if frames are matched by index) """
+        t = self._position if t is None else t
+        return int(self._timeline[t])
+
+    def stream_nb_frames(self, cam_idx: int) -> int:
+        """ Number of frames in a camera's stream (0 if it can't be found) """
+        stream = self._streams[cam_idx]
+        return stream.nb_frames if stream is not None else 0
+
+    def stream_index(self, cam_idx: int, t: int = None) -> int:
+        """
+            Index of the frame to show for a camera at a position of the timeline (-1 if there is none)
+        """
+        t = self._position if t is None else t
+        stream = self._streams[cam_idx]
+        if stream is None:
+            return -1
+        if not self._by_number:
+            return t if t < stream.nb_frames else -1
+        numbers = stream.reader.frame_numbers
+        i = int(np.searchsorted(numbers, self._timeline[t]))
+        return i if i < len(numbers) and numbers[i] == self._timeline[t] else -1
+
+    def seek(self, t: int) -> int:
+        """
+            Moves all the cameras to a position of the timeline, and returns the (clamped) position
+        """
+        self._position = int(np.clip(t, 0, max(0, self.nb_frames - 1)))
+        if self.nb_frames == 0:
+            return self._position
+
+        for cam_idx, stream in enumerate(self._streams):
+            if stream is None:
+                continue
+            i = self.stream_index(cam_idx)
+            if i < 0 and self._by_number:
+                # This camera dropped this frame, keep prefetching from where it picks up again
+                i = int(np.searchsorted(stream.reader.frame_numbers, self._timeline[self._position]))
+            stream.seek(min(max(i, 0), max(0, stream.nb_frames - 1)))
+        return self._position
+
+    def step(self, n: int = 1) -> int:
+        return self.seek(self._position + n)
+
+    def ready(self, t: int = None) -> bool:
+        """
+            Whether the frames of all the cameras are decoded for this position
+        """
+        for cam_idx, stream in enumerate(self._streams):
+            i = self.stream_index(cam_idx, t)
+            if i >= 0 and not stream.ready(i):
+                return False
+        return True
+
+    def frames(self, t: int = None, timeout: float = 0.0) -> List[Union[np.ndarray, None]]:
+        """
+            The frames of all the cameras at a position of the timeline (None where there is no frame, or
+            if it is not decoded yet)
+        """
+        frames = []
+        for cam_idx, stream in enumerate(self._streams):
+            i = self.stream_index(cam_idx, t)
+            frames.append(stream.get(i, timeout=timeout) if i >= 0 else None)
+        return frames
+
+    def close(self) -> None:
+        for stream in self._streams:
+            if stream is not None:
+                stream.close()
+        self._streams = [None] * len(self._streams)
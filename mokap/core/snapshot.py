@@ -0,0 +1,180 @@
+from threading import Thread, Event, Lock
+from pathlib import Path
+from typing import List, Union, Callable, Tuple
+import numpy as np
+from PIL import Image
+
+##
+
+SNAPSHOT_FORMATS = ('bmp', 'png', 'jpg', 'jpeg', 'tif', 'tiff', 'npy')
+
+
+def save_frame(filepath: Union[Path, str], frame: np.ndarray, fmt: str = 'bmp', quality: int = 95) -> Path:
+    """
+        Writes one full resolution frame to disk (the extension is added to the filepath)
+    """
+    fmt = fmt.lower().lstrip('.')
+    filepath = Path(filepath).with_suffix(f'.{fmt}')
+
+    if fmt == 'npy':
+        np.save(filepath, frame)
+        return filepath
+
+    img = Image.fromarray(frame, mode='RGB' if frame.ndim == 3 else 'L')
+    match fmt:
+        case 'bmp':
+            img.save(filepath, format='BMP')
+        case 'png':
+            img.save(filepath, format='PNG', compress_level=1)
+        case 'jpg' | 'jpeg':
+            img.save(filepath, format='JPEG', quality=quality)
+        case 'tif' | 'tiff':
+            img.save(filepath, format='TIFF', compression=None)
+        case _:
+            raise ValueError(f'Unknown snapshot format {fmt} (must be one of {", ".join(SNAPSHOT_FORMATS)})')
+    return filepath
+
+
+class SnapshotRequest:
+    """
+        Collects full resolution frames from the grabber threads: either the next nb_frames of every camera,
+        or the frames with given frame numbers (i.e. the same trigger pulses on all cameras, if hardware-triggered).
+        Frames are offered by the grabber threads, so this must stay cheap.
+    """
+
+    def __init__(self,
+                 nb_cameras: int,
+                 first_numbers: List[int],
+                 nb_frames: int = 1):
+        """
+            Parameters
+            ----------
+            nb_cameras : int
+            first_numbers : list of int
+                First frame number to capture, for each camera
+            nb_frames : int
+                How many consecutive frames to capture from each camera
+        """
+        self._nb_frames = max(1, int(nb_frames))
+        self._first = [int(n) for n in first_numbers]
+
+        self._frames: List[List[Tuple[int, np.ndarray]]] = [[] for _ in range(nb_cameras)]
+        self._remaining = nb_cameras
+        self._lock = Lock()
+        self._complete = Event()    # All frames were captured
+        self._done = Event()        # Capture is over (complete or timed out) and files are written
+
+        self.files: List[Path] = []
+        self.error: Union[None, str] = None
+
+    @property
+    def nb_frames(self) -> int:
+        return self._nb_frames
+
+    @property
+    def complete(self) -> bool:
+        return self._complete.is_set()
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    @property
+    def frames(self) -> List[List[Tuple[int, np.ndarray]]]:
+        """ For each camera, the list of captured (frame number, frame) """
+        return self._frames
+
+    def offer(self, cam_idx: int, frame_nb: int, frame: np.ndarray) -> None:
+        """
+            Called by the grabber thread of a camera with each new frame
+        """
+        captured = self._frames[cam_idx]
+        if len(captured) >= self._nb_frames or not self._first[cam_idx] <= frame_nb < self._first[cam_idx] + self._nb_frames:
+            return
+
+        # GetArray() already returns a copy, so the frame can be kept as is
+        captured.append((frame_nb, frame))
+
+        if len(captured) == self._nb_frames:
+            with self._lock:
+                self._remaining -= 1
+                if self._remaining == 0:
+                    self._complete.set()
+
+    def wait_capture(self, timeout: Union[float, None] = None) -> bool:
+        return self._complete.wait(timeout)
+
+    def wait(self, timeout: Union[float, None] = None) -> bool:
+        """
+            Waits until the frames are captured and written (returns False on timeout)
+        """
+        return self._done.wait(timeout)
+
+    def _finish(self) -> None:
+        self._done.set()
+
+
+class SnapshotSaver:
+    """
+        Waits for a SnapshotRequest to be fulfilled, then writes its frames in a background thread
+    """
+
+    def __init__(self,
+                 request: SnapshotRequest,
+                 folder: Union[Path, str, None],
+                 names: List[str],
+                 prefix: str = 'snapshot',
+                 fmt: str = 'bmp',
+                 timeout: float = 5.0,
+                 on_capture_end: Callable = None,
+                 callback: Callable = None,
+                 silent: bool = True):
+
+        fmt = fmt.lower().lstrip('.')
+        if fmt not in SNAPSHOT_FORMATS:
+            raise ValueError(f'Unknown snapshot format {fmt} (must be one of {", ".join(SNAPSHOT_FORMATS)})')
+
+        self._request = request
+        self._folder = Path(folder) if folder is not None else None
+        self._names = names
+        self._prefix = prefix
+        self._fmt = fmt
+        self._timeout = timeout
+        self._on_capture_end = on_capture_end
+        self._callback = callback
+        self._silent = silent
+
+        self._thread = Thread(target=self._saver_thread, daemon=True)
+        self._thread.start()
+
+    def _saver_thread(self):
+        request = self._request
+
+        if not request.wait_capture(self._timeout):
+            missing = [n for n, f in zip(self._names, request.frames) if len(f) < request.nb_frames]
+            request.error = f'Timed out waiting for frames from {", ".join(missing)}'
+            if not self._silent:
+                print(f'[WARN] Snapshot: {request.error}')
+
+        # Stop receiving frames before writing anything
+        if self._on_capture_end is not None:
+            self._on_capture_end(request)
+
+        if self._folder is not None:
+            self._folder.mkdir(parents=True, exist_ok=True)
+            for name, captured in zip(self._names, request.frames):
+                for frame_nb, frame in captured:
+                    try:
+                        request.files.append(save_frame(self._folder / f'{self._prefix}_{name}_{frame_nb}', frame, self._fmt))
+                    except OSError as e:
+                        request.error = str(e)
+                        if not self._silent:
+                            print(f'[ERROR] Snapshot: {e}')
+
+            if not self._silent:
+                print(f'[INFO] Snapshot: {len(request.files)} frames written to {self._folder}')
+
+        request._finish()
+
+        if self._callback is not None:
+            self._callback(request)
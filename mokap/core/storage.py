@@ -0,0 +1,402 @@
+import os
+import re
+import json
+import shutil
+import platform
+from pathlib import Path
+from threading import Thread, Event
+from time import perf_counter
+from typing import List, Union, NoReturn
+import numpy as np
+from mokap.utils import ensure_list
+
+##
+
+def parse_volumes(base_path: Union[str, Path, List[Union[str, Path]]]) -> List[Path]:
+    """
+        Turns the base_path entry of the config file (a single path or a list of paths) into a list
+        of 'MokapRecordings' folders, one per volume
+    """
+    if base_path is None:
+        base_path = './'
+
+    volumes = []
+    for p in ensure_list(base_path):
+        folder = Path(p) / 'MokapRecordings'
+        if folder.parent.name == folder.name:
+            folder = folder.parent
+        if re.match(r'[A-Z]:', folder.parts[0]) and 'Darwin' in platform.system():
+            folder = Path(folder.as_posix()[2:].lstrip('/'))
+        if folder not in volumes:
+            volumes.append(folder)
+    return volumes
+
+
+def parse_policy(policy: str) -> str:
+    policy = str(policy).lower().replace('_', '-').replace(' ', '-')
+    if policy in ['rr', 'round-robin', 'roundrobin', 'robin']:
+        return 'round-robin'
+    elif policy in ['bw', 'bandwidth', 'weighted', 'bandwidth-weighted']:
+        return 'bandwidth'
+    elif policy in ['pin', 'pinned', 'pinning', 'manual']:
+        return 'pinned'
+    else:
+        print(f"[WARN] Unknown storage policy '{policy}', defaulting to round-robin.")
+        return 'round-robin'
+
+
+def measure_write_speed(folder: Union[str, Path], size_mb: int = 64, block_mb: int = 4) -> float:
+    """
+        Measures the sequential write speed of the volume a folder lives on, by writing (and deleting) a
+        temporary file. The file is synced to disk so the OS cache does not inflate the result.
+
+        Parameters
+        ----------
+        folder : Path or str
+            A writable folder on the volume to test
+        size_mb : int
+            Total size of the test file, in MB
+        block_mb : int
+            Size of each write, in MB
+
+        Returns
+        -------
+        float
+        Write speed in bytes/s (0.0 if the volume could not be written to)
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    testfile = folder / '.mokap_speedtest'
+
+    block = np.random.randint(0, 255, block_mb * 1024 * 1024, dtype=np.uint8).tobytes()
+    nb_blocks = max(1, size_mb // block_mb)
+
+    try:
+        start = perf_counter()
+        with open(testfile, 'wb') as f:
+            for _ in range(nb_blocks):
+                f.write(block)
+            f.flush()
+            os.fsync(f.fileno())
+        elapsed = perf_counter() - start
+    except OSError as e:
+        print(f'[WARN] Could not measure write speed of {folder}: {e}')
+        return 0.0
+    finally:
+        testfile.unlink(missing_ok=True)
+
+    return (nb_blocks * len(block)) / max(elapsed, 1e-6)
+
+
+def assign_volumes(nb_cameras: int,
+                   nb_volumes: int,
+                   policy: str = 'round-robin',
+                   pins: List[Union[int, None]] = None,
+                   volumes_bandwidth: List[float] = None,
+                   cameras_bandwidth: List[float] = None) -> List[int]:
+    """
+        Decides which volume each camera writes to
+
+        Parameters
+        ----------
+        nb_cameras : int
+        nb_volumes : int
+        policy : str
+            'round-robin': cameras are spread evenly across volumes
+            'bandwidth': cameras are greedily placed so that each volume's load is proportional to its measured speed
+            'pinned': cameras go to the volume given in pins (the others are placed round-robin)
+        pins : list of int or None
+            Per-camera volume index (None for no pin). Pins are honoured with every policy
+        volumes_bandwidth : list of float
+            Write speed of each volume (only used by the 'bandwidth' policy)
+        cameras_bandwidth : list of float
+            Data rate of each camera (only used by the 'bandwidth' policy)
+
+        Returns
+        -------
+        list of int
+        The volume index of each camera
+    """
+
+    if pins is None:
+        pins = [None] * nb_cameras
+
+    assignment = [None] * nb_cameras
+    load = np.zeros(nb_volumes, dtype=np.float64)
+
+    for i, p in enumerate(pins):
+        if p is not None:
+            if 0 <= int(p) < nb_volumes:
+                assignment[i] = int(p)
+            else:
+                print(f'[WARN] Camera {i} is pinned to volume {p}, but there are only {nb_volumes} volumes. Ignoring.')
+
+    unassigned = [i for i in range(nb_cameras) if assignment[i] is None]
+
+    if policy == 'bandwidth' and volumes_bandwidth is not None and cameras_bandwidth is not None:
+        speeds = np.maximum(np.asarray(volumes_bandwidth, dtype=np.float64), 1.0)
+        demands = np.asarray(cameras_bandwidth, dtype=np.float64)
+
+        for i in range(nb_cameras):
+            if assignment[i] is not None:
+                load[assignment[i]] += demands[i]
+
+        # Largest demands first, each one goes where the relative load stays the lowest
+        for i in sorted(unassigned, key=lambda c: -demands[c]):
+            v = int(np.argmin((load + demands[i]) / speeds))
+            assignment[i] = v
+            load[v] += demands[i]
+    else:
+        for i in range(nb_cameras):
+            if assignment[i] is not None:
+                load[assignment[i]] += 1
+        for i in unassigned:
+            v = int(np.argmin(load))     # argmin returns the first one in case of ties, so this is round-robin
+            assignment[i] = v
+            load[v] += 1
+
+    return assignment
+
+
+def parse_quota_policy(policy: str) -> str:
+    policy = str(policy).lower().replace('_', '-').replace(' ', '-')
+    if policy in ['stop', 'pause']:
+        return 'stop'
+    elif policy in ['rotate', 'rotation', 'next-volume']:
+        return 'rotate'
+    elif policy in ['delete', 'delete-oldest', 'oldest', 'retention']:
+        return 'delete-oldest'
+    else:
+        print(f"[WARN] Unknown disk quota policy '{policy}', defaulting to stop.")
+        return 'stop'
+
+
+class StorageManager:
+    """
+        Keeps an eye on the free space of the volumes a MultiCam instance writes to, projects the time left until
+        they are full, and applies a policy when the limit is reached:
+            - 'stop': the recording is paused
+            - 'rotate': the cameras writing to the full volume are moved to another volume (a new recording session starts)
+            - 'delete-oldest': the oldest completed acquisitions in MokapRecordings are deleted
+        Everything runs in its own thread, at a slow pace
+    """
+
+    def __init__(self,
+                 multicam,
+                 policy: str = 'stop',
+                 min_free_gb: float = 10.0,
+                 warn_minutes: float = 60.0,
+                 interval: float = 5.0,
+                 silent: bool = True):
+
+        self._mc = multicam
+        self._policy: str = parse_quota_policy(policy)
+        self._min_free: float = float(min_free_gb) * 1e9
+        self._warn_s: float = float(warn_minutes) * 60.0
+        self._interval: float = max(0.5, float(interval))
+        self._silent: bool = silent
+
+        self._thread: Union[Thread, None] = None
+        self._stop_event = Event()
+        self._busy: bool = False
+        self._warned = set()
+
+        # Cached status, per volume (the GUI only reads these)
+        nb_volumes = len(self._mc._base_folders)
+        self._free = np.full(nb_volumes, np.nan)
+        self._rate = np.zeros(nb_volumes)           # Smoothed drop of the free space
+        self._writers_rate = np.zeros(nb_volumes)   # What our own writers are writing
+        self._last_free = np.full(nb_volumes, np.nan)
+        self._last_time = 0.0
+
+    @property
+    def policy(self) -> str:
+        return self._policy
+
+    @property
+    def busy(self) -> bool:
+        """ True while the manager is applying a policy (i.e. the recording state may flicker) """
+        return self._busy
+
+    @property
+    def status(self) -> List[dict]:
+        """
+            Latest free space, write rate and time left for each volume. Does not touch the disk.
+        """
+        status = []
+        for v, folder in enumerate(self._mc._base_folders):
+            status.append({'volume': folder.as_posix(),
+                           'free': float(self._free[v]),
+                           'rate': self._projected_rate(v),
+                           'time_left': self._time_left(v)})
+        return status
+
+    @property
+    def time_left(self) -> float:
+        """ Shortest time left before one of the volumes in use hits the limit, in seconds """
+        used = set(self._mc._cameras_volumes)
+        if not used:
+            return np.inf
+        return min(self._time_left(v) for v in used)
+
+    def _time_left(self, v: int) -> float:
+        if np.isnan(self._free[v]):
+            return np.inf
+        available = self._free[v] - self._min_free
+        if available <= 0:
+            return 0.0
+        rate = self._projected_rate(v)
+        if rate <= 0:
+            return np.inf
+        return available / rate
+
+    def _projected_rate(self, v: int) -> float:
+        # The writers know exactly how fast they write, but other programs may also be filling the disk
+        # so keep whichever is the most pessimistic
+        return float(max(self._rate[v], self._writers_rate[v]))
+
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop_event.clear()
+            self._warned.clear()
+            self._last_free[:] = np.nan
+            self._rate[:] = 0.0
+            self._writers_rate[:] = 0.0
+            self._thread = Thread(target=self._monitor_thread, daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout=self._interval * 2)
+        self._thread = None
+
+    def _measure(self) -> None:
+        now = perf_counter()
+        for v, folder in enumerate(self._mc._base_folders):
+            try:
+                self._free[v] = shutil.disk_usage(folder).free
+            except OSError:
+                self._free[v] = np.nan
+                continue
+
+            if not np.isnan(self._last_free[v]) and now > self._last_time:
+                rate = max(0.0, (self._last_free[v] - self._free[v]) / (now - self._last_time))
+                # Smooth it a bit, writers are bursty
+                self._rate[v] = 0.7 * self._rate[v] + 0.3 * rate
+            self._last_free[v] = self._free[v]
+        self._last_time = now
+
+        writers_rate = np.zeros_like(self._rate)
+        for cam_rate, v in zip(self._mc.write_throughput * 1e6, self._mc._cameras_volumes):
+            writers_rate[v] += cam_rate
+        self._writers_rate = writers_rate
+
+    def _monitor_thread(self) -> NoReturn:
+
+        while not self._stop_event.wait(self._interval):
+            self._measure()
+
+            if not self._mc.recording:
+                continue
+
+            for v in sorted(set(self._mc._cameras_volumes)):
+                time_left = self._time_left(v)
+                folder = self._mc._base_folders[v]
+
+                if time_left <= 0:
+                    print(f'[WARN] {folder} has less than {self._min_free / 1e9:.1f} GB left. Applying policy: {self._policy}')
+                    self._apply_policy(v)
+                    break
+
+                elif time_left < self._warn_s and v not in self._warned:
+                    print(f'[WARN] At the current rate ({self._projected_rate(v) / 1e6:.1f} MB/s), {folder} will be full in {time_left / 60:.0f} min!')
+                    self._warned.add(v)
+
+                elif time_left > self._warn_s * 1.5 and v in self._warned:
+                    self._warned.discard(v)
+
+    def _apply_policy(self, v: int) -> None:
+        self._busy = True
+        try:
+            if self._policy == 'rotate':
+                if not self._rotate(v):
+                    print('[WARN] No other volume has enough space left, stopping the recording.')
+                    self._mc.pause()
+
+            elif self._policy == 'delete-oldest':
+                if not self._delete_oldest(v):
+                    print('[WARN] There is nothing left to delete, stopping the recording.')
+                    self._mc.pause()
+            else:
+                self._mc.pause()
+        finally:
+            self._busy = False
+
+    def _rotate(self, v: int) -> bool:
+        """
+            Moves the cameras writing to volume v to the volume with the most space left
+        """
+        candidates = [(self._free[o], o) for o in range(len(self._mc._base_folders))
+                      if o != v and not np.isnan(self._free[o]) and self._free[o] > self._min_free * 1.5]
+        if not candidates:
+            return False
+        target = max(candidates)[1]
+
+        self._mc.pause()
+        self._mc._cameras_volumes = [target if cv == v else cv for cv in self._mc._cameras_volumes]
+        self._mc.record()
+        self._warned.discard(v)
+
+        if not self._silent:
+            print(f'[INFO] Rotated from {self._mc._base_folders[v]} to {self._mc._base_folders[target]}')
+        return True
+
+    def _acquisitions(self, v: int) -> List[tuple]:
+        """
+            Completed mokap acquisitions on volume v, oldest first. Only the folders with a metadata file are
+            considered, anything else in MokapRecordings is left alone
+
+            Returns
+            -------
+            list of (start time, acquisition name)
+        """
+        current = self._mc.session_name
+        folders = self._mc._base_folders
+
+        acquisitions = []
+        for d in folders[v].glob('*'):
+            if not d.is_dir() or d.name == current:
+                continue
+            if any((f / d.name / 'recording').exists() for f in folders):
+                continue
+            try:
+                with open(d / 'metadata.json', 'r', encoding='utf-8') as f:
+                    metadata = json.load(f)
+                start = min(session['start'] for session in metadata['sessions'])
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+            acquisitions.append((start, d.name))
+
+        return sorted(acquisitions)
+
+    def _delete_oldest(self, v: int) -> bool:
+        """
+            Deletes the oldest completed acquisitions on volume v (and their folders on the other volumes) until
+            there is enough space again
+        """
+        folders = self._mc._base_folders
+
+        deleted = False
+        for _, name in self._acquisitions(v):
+            if shutil.disk_usage(folders[v]).free > self._min_free * 1.5:
+                break
+            for f in folders:
+                d = f / name
+                if (d / 'metadata.json').exists():
+                    shutil.rmtree(d, ignore_errors=True)
+                    print(f'[INFO] Deleted old acquisition {d}')
+            deleted = True
+
+        self._measure()
+        return deleted and self._free[v] > self._min_free
@@ -0,0 +1,111 @@
+import time
+from threading import Thread, Event
+from typing import List, Union, NoReturn, Any
+from mokap.core.hardware import BaslerCamera
+
+##
+
+
+class TelemetryPoller:
+    """
+        Polls slow-changing camera values (temperature, link throughput, stream statistics...) in a background thread,
+        and caches them with a timestamp. Reading from the cache never touches the camera, so the GUI can do it
+        as often as it wants.
+    """
+
+    FIELDS = ('temperature', 'temperature_state', 'link_throughput', 'link_throughput_limit', 'stream_statistics')
+
+    def __init__(self,
+                 cameras: List[BaslerCamera],
+                 interval: Union[float, List[float]] = 2.0,
+                 fields=FIELDS,
+                 silent: bool = True):
+        """
+            Parameters
+            ----------
+            cameras : list of BaslerCamera
+            interval : float or list of float
+                Polling interval in seconds (one for all cameras, or one per camera)
+            fields : sequence of str
+                Names of the BaslerCamera properties to poll
+        """
+
+        self._cameras = cameras
+        self._fields = tuple(fields)
+        self._silent = silent
+
+        if isinstance(interval, (list, tuple)):
+            self._intervals = [max(0.1, float(i)) for i in interval]
+        else:
+            self._intervals = [max(0.1, float(interval))] * len(cameras)
+
+        # One dict per camera: {field: (value, timestamp)}
+        self._cache: List[dict] = [{f: (None, 0.0) for f in self._fields} for _ in cameras]
+        self._next_poll = [0.0] * len(cameras)
+
+        self._thread: Union[Thread, None] = None
+        self._stop_event = Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if not self.running:
+            self._stop_event.clear()
+            self._thread = Thread(target=self._poller_thread, daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self.running:
+            self._thread.join(timeout=max(self._intervals) + 1.0)
+        self._thread = None
+
+    def poll(self, cam_idx: int) -> None:
+        """
+            Reads all the fields of one camera now (this does block)
+        """
+        cam = self._cameras[cam_idx]
+        if not cam.connected:
+            return
+        cache = self._cache[cam_idx]
+        for field in self._fields:
+            try:
+                value = getattr(cam, field)
+            except Exception:       # Camera busy, node not available, unplugged, etc.
+                value = None
+            # Assigning a tuple is atomic, so readers always get a consistent (value, timestamp) pair
+            cache[field] = (value, time.time())
+
+    def _poller_thread(self) -> NoReturn:
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            for i in range(len(self._cameras)):
+                if now >= self._next_poll[i]:
+                    self.poll(i)
+                    self._next_poll[i] = now + self._intervals[i]
+
+            wait = max(0.05, min(self._next_poll) - time.monotonic()) if self._next_poll else 1.0
+            self._stop_event.wait(wait)
+
+    def get(self, cam_idx: int, field: str, default: Any = None) -> Any:
+        """
+            Latest cached value of a field for a camera (default if it has never been read)
+        """
+        value, _ = self._cache[cam_idx].get(field, (None, 0.0))
+        return default if value is None else value
+
+    def timestamp(self, cam_idx: int, field: str) -> float:
+        """
+            When the cached value was read (0.0 if never)
+        """
+        return self._cache[cam_idx].get(field, (None, 0.0))[1]
+
+    def snapshot(self, cam_idx: int = None) -> Union[dict, List[dict]]:
+        """
+            All the cached values (without timestamps) for one or all cameras
+        """
+        if cam_idx is None:
+            return [self.snapshot(i) for i in range(len(self._cameras))]
+        return {f: v for f, (v, t) in self._cache[cam_idx].items()}
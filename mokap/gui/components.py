@@ -1,17 +1,18 @@
 import os
 import subprocess
 import sys
+import time
 import platform
 import psutil
 import screeninfo
 import cv2
 from functools import partial
 from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 import numpy as np
-from PIL import Image
-from PySide6.QtCore import Qt, QTimer, QEvent, QDir, QObject, Signal, Slot, QThread, QPoint, QSize
+from PySide6.QtCore import Qt, QTimer, QEvent, QDir, QObject, Signal, Slot, QThread, QPoint, QSize, QRect
 from PySide6.QtGui import QIcon, QImage, QPixmap, QCursor, QBrush, QPen, QColor, QFont
 from PySide6.QtWidgets import (QApplication, QMainWindow, QStatusBar, QSlider, QGraphicsView, QGraphicsScene,
                                QGraphicsRectItem, QComboBox, QLineEdit, QProgressBar, QCheckBox, QScrollArea,
@@ -27,11 +28,19 @@ from mokap.utils import hex_to_rgb, hex_to_hls, pretty_size, generate_charuco
 
 from mokap.calibration import MonocularCalibrationTool, MultiviewCalibrationTool
 from mokap.utils import fileio
+from mokap.core.replay import SessionReplay
+from mokap.gui.glvideo import GLVideoFeed
 
 ##
 
 DEBUG = True
 
+# Default board params - TODO: Needs to be loaded from config file
+DEFAULT_BOARD_PARAMS = {'rows': 6,
+                        'cols': 5,
+                        'square_length': 1.5,
+                        'markers_size': 4}
+
 ##
 
 class GUILogger:
@@ -165,42 +174,6 @@ class BoardParamsDialog(QDialog):
 
 ##
 
-class MainWorker(QObject):
-    """
-        This worker lives in its own thread and does stuff on the full resolution image
-    """
-    # TESTING - send bounding boxes of a fake detection
-    signal_result_ready = Signal(list)
-    signal_finished_processing = Signal()
-
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        # self._running = True
-        self._paused = False
-
-    def set_paused(self, val):
-        self._paused = val
-
-    @Slot(np.ndarray)
-    def process_frame(self, frame):
-        # if not self._running or self._paused:
-        if self._paused:
-            return
-
-        # 1- TESTING - Fake motiuon detection
-        bboxes = self._do_motion_detection(frame)
-
-        # 2- Emit the results (metadata) back to the main thread, and emit 'done' signal
-        self.signal_result_ready.emit(bboxes)
-        self.signal_finished_processing.emit()
-
-    def _do_motion_detection(self, frame):
-        # TESTING - Fake bounding box around (100,100) of size (50,40)
-        return [(100, 100, 50, 40)]
-
-    # def stop(self):
-    #     self._running = False
-
 class MonocularCalibWorker(QObject):
     """
         This worker lives in its own thread and does monocular detection/calibration
@@ -234,12 +207,21 @@ class MonocularCalibWorker(QObject):
 
         self._current_stage = 0
 
+        # calibrateCamera on a full stack takes a while, so it runs in its own thread to keep the detection going
+        # (two, so that a computation replacing an outdated one doesn't have to wait for it to finish)
+        self._intrinsics_executor = ThreadPoolExecutor(max_workers=2)
+        self._intrinsics_future = None
+
     def init_mct(self, board_params):
         self.monocular_tool = MonocularCalibrationTool(
             board_params=board_params,
             imsize_hw=self.cam_shape[:2],           # pass frame size so it can track coverage
             focal_mm=60,                            # TODO - UI field for these
-            sensor_size='1/2.9"'                    #
+            sensor_size='1/2.9"',                   #
+            # Look for the markers at half resolution on large frames, that's most of the detection time
+            pyramid_level=1 if max(self.cam_shape[:2]) >= 1280 else 0,
+            track_roi=True,
+            camera=self.cam_name
         )
         self.monocular_tool.set_visualisation_scale(2)
 
@@ -265,27 +247,14 @@ class MonocularCalibWorker(QObject):
                 coverage_threshold = 80
                 stack_length_threshold = 20
 
-                if self.monocular_tool.coverage >= coverage_threshold and self.monocular_tool.nb_samples > stack_length_threshold:
-                    self.signal_computation_started.emit()
-
-                r = self.monocular_tool.auto_compute_intrinsics(
-                    coverage_threshold=coverage_threshold,
-                    stack_length_threshold=stack_length_threshold,
-                    simple_focal=True,
-                    simple_distortion=True,
-                    complex_distortion=False
-                )
-                if r:
-                    # If the intrinsics have been updated, return the new errors...
-                    self.signal_return_reprojection_error.emit(self.monocular_tool.last_best_errors)
-
-                    # ...and the intrinsics themselves
-                    cam_mat, dist_coeffs = self.monocular_tool.intrinsics
-                    if cam_mat is not None and dist_coeffs is not None:
-                        self.signal_return_intrinsics.emit(cam_mat.copy(),
-                                                           dist_coeffs.copy(),
-                                                           True)                    # bool to update the message in the UI
-            self.signal_computation_finished.emit()
+                if (self._intrinsics_future is None
+                        and self.monocular_tool.coverage >= coverage_threshold
+                        and self.monocular_tool.nb_samples > stack_length_threshold):
+                    self._start_intrinsics(simple_focal=True, simple_distortion=True, complex_distortion=False,
+                                           max_samples=30)
+
+        # Apply the intrinsics computation if it finished (whatever the stage is now)
+        self._collect_intrinsics()
 
         # 4- Compute extrinsics (only works if we already have intrinsics)
         self.monocular_tool.compute_extrinsics()
@@ -310,6 +279,49 @@ class MonocularCalibWorker(QObject):
         self.signal_send_annotated_frame.emit(annotated)
         self.signal_send_finished.emit()
 
+    def _start_intrinsics(self, simple_focal=True, simple_distortion=True, complex_distortion=False, max_samples=None):
+        job = self.monocular_tool.prepare_intrinsics(fix_aspect_ratio=simple_focal,
+                                                     simple_distortion=simple_distortion,
+                                                     complex_distortion=complex_distortion,
+                                                     max_samples=max_samples)
+        if job is None:
+            return
+        self._intrinsics_future = self._intrinsics_executor.submit(self.monocular_tool.calibrate_intrinsics, job)
+        self.signal_computation_started.emit()
+
+    def _collect_intrinsics(self):
+        if self._intrinsics_future is None or not self._intrinsics_future.done():
+            return
+
+        try:
+            result = self._intrinsics_future.result()
+        except Exception as e:
+            print(f"[ERROR] [MonocularCalibWorker] Intrinsics computation failed: {e}")
+            result = None
+        self._intrinsics_future = None
+        self.signal_computation_finished.emit()
+
+        if self.monocular_tool.apply_intrinsics(result):
+            # If the intrinsics have been updated, return the new errors...
+            self.signal_return_reprojection_error.emit(self.monocular_tool.last_best_errors)
+
+            # ...and the intrinsics themselves
+            cam_mat, dist_coeffs = self.monocular_tool.intrinsics
+            if cam_mat is not None and dist_coeffs is not None:
+                self.signal_return_intrinsics.emit(cam_mat.copy(),
+                                                   dist_coeffs.copy(),
+                                                   True)                    # bool to update the message in the UI
+
+    def _drop_intrinsics(self):
+        """ The running computation is outdated: its result will be discarded, so don't wait for it """
+        if self._intrinsics_future is not None:
+            self._intrinsics_future.cancel()
+            self._intrinsics_future = None
+            self.signal_computation_finished.emit()
+
+    def stop(self):
+        self._intrinsics_executor.shutdown(wait=False, cancel_futures=True)
+
     @Slot(bool)
     def set_auto_sample(self, value):
         self.auto_sample = value
@@ -330,11 +342,13 @@ class MonocularCalibWorker(QObject):
     def clear_intrinsics(self):
         self.monocular_tool.clear_intrinsics()
         self.monocular_tool.clear_stacks()
+        self._drop_intrinsics()
 
     @Slot(str)
     def load_calib(self, file_path):
         d = fileio.read_intrinsics(file_path, self.cam_name)
         r = self.monocular_tool.set_intrinsics(d['camera_matrix'], d['dist_coeffs'], d.get('errors', None))
+        self._drop_intrinsics()
         if r:
             self.monocular_tool.clear_stacks()
 
@@ -356,13 +370,19 @@ class MultiCalibWorker(QObject):
 
     signal_return_computed_poses = Signal(np.ndarray, np.ndarray)  # Send current camera poses back to main thread
     signal_return_computed_points = Signal(np.ndarray)           # Send points 3d back to main thread
+    signal_return_refined = Signal(np.ndarray, np.ndarray, np.ndarray, np.ndarray)  # Refined poses and intrinsics
 
-    def __init__(self, multiview_calib, parent=None):
+    def __init__(self, multiview_calib, refine_max_time=5.0, parent=None):
         super().__init__(parent)
         self.multiview_calib = multiview_calib
 
         self._paused = False
 
+        # The bundle adjustment takes a few seconds, so it runs in its own thread to keep this one receiving detections
+        self._refine_max_time = refine_max_time
+        self._refine_executor = ThreadPoolExecutor(max_workers=1)
+        self._refine_future = None
+
     def set_paused(self, val):
         self._paused = val
 
@@ -396,11 +416,32 @@ class MultiCalibWorker(QObject):
         # Estimate extrinsics
         self.multiview_calib.compute_estimation()
 
+        # Collect the refinement if it finished, and start a new one if there are new detections
+        if self._refine_future is not None and self._refine_future.done():
+            try:
+                refined = self._refine_future.result()
+            except Exception as e:
+                print(f"[ERROR] [MultiCalibWorker] Refinement failed: {e}")
+                refined = False
+            self._refine_future = None
+
+            if refined:
+                rvecs, tvecs = self.multiview_calib.extrinsics
+                camera_matrices, dist_coeffs = self.multiview_calib.intrinsics()
+                self.signal_return_refined.emit(rvecs, tvecs, camera_matrices, dist_coeffs)
+
+        if self._refine_future is None and self.multiview_calib.needs_refinement:
+            self._refine_future = self._refine_executor.submit(self.multiview_calib.compute_refined,
+                                                               max_time=self._refine_max_time)
+
         rvecs, tvecs = self.multiview_calib.extrinsics
         if rvecs is not None and tvecs is not None:
             # Send them back to the main thread
             self.signal_return_computed_poses.emit(rvecs, tvecs)
 
+    def stop(self):
+        self._refine_executor.shutdown(wait=False, cancel_futures=True)
+
     @Slot(int)
     def set_origin_camera(self, value: int):
         self.multiview_calib.origin_camera = value
@@ -434,12 +475,9 @@ class VideoWindowBase(QWidget):
 
         self._main_window = main_window_ref
         self.idx = idx
-        self._camera = self._main_window.mc.cameras[self.idx]
-        self._cam_name = self._camera.name
+        self._init_source()
 
-        self._source_shape = self._main_window.sources_shapes[self.idx]
-        self._bg_colour = self._main_window.bg_colours_list[self.idx]
-        self._fg_colour = self._main_window.fg_colours_list[self.idx]
+        self._use_opengl = self._main_window.use_opengl     # Per window, in case OpenGL fails and we fall back to QPixmaps
 
         # Where the frame data will be stored
         self._frame_buffer = np.zeros((*self._source_shape[:2], 3), dtype=np.uint8)
@@ -458,9 +496,9 @@ class VideoWindowBase(QWidget):
         self.worker_thread = None
 
         # Some other stuff
-        self._wanted_fps = self._camera.framerate
+        self._wanted_fps = self._camera.framerate if self._camera is not None else 0
 
-        self.setWindowTitle(f'{self._camera.name.title()} camera')
+        self.setWindowTitle(f'{self._cam_name.title()} camera')
 
         self.positions = np.array([['nw', 'n', 'ne'],
                                    ['w', 'c', 'e'],
@@ -471,6 +509,16 @@ class VideoWindowBase(QWidget):
         self.timer_update.timeout.connect(self._update_vars)
         self.timer_update.start(100)
 
+    def _init_source(self):
+        """
+            Sets the camera this window shows (here, the live camera idx), its name, frame shape and colours
+        """
+        self._camera = self._main_window.mc.cameras[self.idx]
+        self._cam_name = self._camera.name
+        self._source_shape = self._main_window.sources_shapes[self.idx]
+        self._bg_colour = self._main_window.bg_colours_list[self.idx]
+        self._fg_colour = self._main_window.fg_colours_list[self.idx]
+
     #  ============= UI constructors =============
     def _init_common_ui(self):
         """
@@ -485,10 +533,12 @@ class VideoWindowBase(QWidget):
         self.video_container_layout = QHBoxLayout(self.video_container)
         self.video_container_layout.setContentsMargins(0, 0, 0, 0)
 
-        self.VIDEO_FEED = QLabel()
-        self.VIDEO_FEED.setStyleSheet('background-color: black;')
-        self.VIDEO_FEED.setMinimumSize(1, 1)  # Important! Otherwise it crashes when reducing the size of the window
-        self.VIDEO_FEED.setAlignment(Qt.AlignCenter)
+        if self._use_opengl:
+            # Frames are streamed to a texture and scaled by the GPU (or by Mesa)
+            self.VIDEO_FEED = GLVideoFeed()
+            self.VIDEO_FEED.gl_failed.connect(self._fallback_to_pixmap)
+        else:
+            self.VIDEO_FEED = self._label_feed()
         self.video_container_layout.addWidget(self.VIDEO_FEED, 1)
         main_layout.addWidget(self.video_container, 1)
 
@@ -502,7 +552,7 @@ class VideoWindowBase(QWidget):
         bottom_panel_h_layout = QHBoxLayout(bottom_panel_h)
 
         # Camera name bar
-        camera_name_bar = QLabel(f'{self._camera.name.title()} camera')
+        camera_name_bar = QLabel(f'{self._cam_name.title()} camera')
         camera_name_bar.setFixedHeight(25)
         camera_name_bar.setAlignment(Qt.AlignCenter)
         camera_name_bar.setStyleSheet(f"color: {self.colour_2}; background-color: {self.colour}; font: bold;")
@@ -528,12 +578,14 @@ class VideoWindowBase(QWidget):
         self.brightness_value = QLabel()
         self.temperature_value = QLabel()
 
-        self.triggered_value.setText("Yes" if self._camera.triggered else "No")
         self.resolution_value.setText(f"{self.source_shape[1]}×{self.source_shape[0]} px")
         self.capturefps_value.setText(f"Off")
-        self.exposure_value.setText(f"{self._camera.exposure} µs")
         self.brightness_value.setText(f"-")
-        self.temperature_value.setText(f"{self._camera.temperature}°C" if self._camera.temperature is not None else '-')
+        if self._camera is not None:
+            self.triggered_value.setText("Yes" if self._camera.triggered else "No")
+            self.exposure_value.setText(f"{self._camera.exposure} µs")
+            temperature = self._main_window.mc.telemetry.get(self.idx, 'temperature')
+            self.temperature_value.setText(f"{temperature}°C" if temperature is not None else '-')
 
         labels_and_values = [
             ('Triggered', self.triggered_value),
@@ -584,11 +636,34 @@ class VideoWindowBase(QWidget):
         """
         pass
 
+    @staticmethod
+    def _label_feed():
+        feed = QLabel()
+        feed.setStyleSheet('background-color: black;')
+        feed.setMinimumSize(1, 1)  # Important! Otherwise it crashes when reducing the size of the window
+        feed.setAlignment(Qt.AlignCenter)
+        return feed
+
+    def _fallback_to_pixmap(self, error):
+        """
+            Replaces the OpenGL video feed with a QLabel, when OpenGL can't be used on this platform
+        """
+        print(f'[WARN] [{self.__class__.__name__}] OpenGL video feed unavailable ({error}), using QPixmaps instead.')
+        gl_feed = self.VIDEO_FEED
+        self._use_opengl = False
+        self.VIDEO_FEED = self._label_feed()
+        self.VIDEO_FEED.installEventFilter(self)
+        self.video_container_layout.replaceWidget(gl_feed, self.VIDEO_FEED)
+        gl_feed.deleteLater()
+        self._blit_image()
+
     #  ============= Qt method overrides =============
     def closeEvent(self, event):
         if self._force_destroy:
             # stop the worker and allow Qt event to actually destroy the window
             self._stop_worker()
+            if self._use_opengl:
+                self.VIDEO_FEED.cleanup()
             super().closeEvent(event)
         else:
             # pause worker and only hide window
@@ -599,10 +674,12 @@ class VideoWindowBase(QWidget):
 
     #  ============= Qt method overrides =============
     def pause_worker(self):
-        self.worker.set_paused(True)
+        if self.worker is not None:
+            self.worker.set_paused(True)
 
     def resume_worker(self):
-        self.worker.set_paused(False)
+        if self.worker is not None:
+            self.worker.set_paused(False)
 
     def _stop_worker(self):
         if self.worker is not None and self.worker_thread is not None:
@@ -730,6 +807,9 @@ class VideoWindowBase(QWidget):
             arr = self._main_window.mc.get_current_framebuffer(self.idx)
             if arr is not None:
                 if len(self.source_shape) == 2:
+                    # The buffer may be at a preview size, which can change
+                    if self._frame_buffer.shape[:2] != arr.shape[:2]:
+                        self._frame_buffer = np.zeros((*arr.shape[:2], 3), dtype=np.uint8)
                     # Using cv for this is faster than any way using numpy (?)
                     self._frame_buffer = cv2.cvtColor(arr, cv2.COLOR_GRAY2RGB, dst=self._frame_buffer)
                 else:
@@ -737,13 +817,29 @@ class VideoWindowBase(QWidget):
         else:
             self._frame_buffer.fill(0)
 
+    def _display_size(self):
+        """ Size (width, height) the frames should have to fit the video feed (without upscaling) """
+        scale = min(self.VIDEO_FEED.width() / self._source_shape[1], self.VIDEO_FEED.height() / self._source_shape[0], 1.0)
+        return max(1, int(self._source_shape[1] * scale)), max(1, int(self._source_shape[0] * scale))
+
     def _resize_to_display(self):
         """ Fills and resizes the display buffer to the current window size """
         scale = min(self.VIDEO_FEED.width() / self._frame_buffer.shape[1], self.VIDEO_FEED.height() / self._frame_buffer.shape[0])
         self._display_buffer = cv2.resize(self._frame_buffer, (0, 0), dst=self._display_buffer, fx=scale, fy=scale)
 
+    def _image_geometry(self):
+        """ Position and size (x, y, w, h) of the displayed image, in video feed coordinates """
+        if self._use_opengl:
+            r = self.VIDEO_FEED.image_rect
+            return r.x(), r.y(), r.width(), r.height()
+        h, w = self._display_buffer.shape[:2]
+        return (self.VIDEO_FEED.width() - w) / 2, (self.VIDEO_FEED.height() - h) / 2, w, h
+
     def _blit_image(self):
         """ Applies the content of display buffers to the GUI """
+        if self._use_opengl:
+            self.VIDEO_FEED.set_frame(self._display_buffer)
+            return
         h, w = self._display_buffer.shape[:2]
         q_img = QImage(self._display_buffer.data, w, h, 3 * w, QImage.Format.Format_RGB888)
         pixmap = QPixmap.fromImage(q_img)
@@ -770,20 +866,30 @@ class VideoWindowBase(QWidget):
                 else:
                     self.capturefps_value.setText("-")
 
-                brightness = np.round(self._frame_buffer.mean() / 255 * 100, decimals=2)
-                self.brightness_value.setText(f"{brightness:.2f}%")
+                # Computed from the full frames by MultiCam, nothing to do here
+                stats = self._main_window.mc.get_frame_stats(self.idx)
+                if stats is not None:
+                    self.brightness_value.setText(f"{stats['mean'] / 255 * 100:.2f}%")
+                    if stats['saturation'] > 0.01:
+                        self.brightness_value.setStyleSheet(f"color: {self._main_window.col_orange}; font: regular;")
+                    else:
+                        self.brightness_value.setStyleSheet("font: regular;")
+                else:
+                    self.brightness_value.setText("-")
             else:
                 self.capturefps_value.setText("Off")
                 self.brightness_value.setText("-")
 
-            # Update the temperature label colour
-            if self._camera.temperature is not None:
-                self.temperature_value.setText(f'{self._camera.temperature:.1f}°C')
-            if self._camera.temperature_state == 'Ok':
+            # Update the temperature label colour (these are cached values, the camera is polled in the background)
+            temperature = self._main_window.mc.telemetry.get(self.idx, 'temperature')
+            temperature_state = self._main_window.mc.telemetry.get(self.idx, 'temperature_state')
+            if temperature is not None:
+                self.temperature_value.setText(f'{temperature:.1f}°C')
+            if temperature_state == 'Ok':
                 self.temperature_value.setStyleSheet(f"color: {self._main_window.col_green}; font: bold;")
-            elif self._camera.temperature_state == 'Critical':
+            elif temperature_state == 'Critical':
                 self.temperature_value.setStyleSheet(f"color: {self._main_window.col_orange}; font: bold;")
-            elif self._camera.temperature_state == 'Error':
+            elif temperature_state == 'Error':
                 self.temperature_value.setStyleSheet(f"color: {self._main_window.col_red}; font: bold;")
             else:
                 self.temperature_value.setStyleSheet(f"color: {self._main_window.col_yellow}; font: bold;")
@@ -799,7 +905,6 @@ class VideoWindowBase(QWidget):
 
 
 class VideoWindowRec(VideoWindowBase):
-    newFrameSignal = Signal(np.ndarray)
 
     def __init__(self, main_window_ref, idx):
         super().__init__(main_window_ref, idx)
@@ -830,21 +935,8 @@ class VideoWindowRec(VideoWindowBase):
 
         ##
 
-        # Setup worker
-        self.worker_thread = QThread(self)
-        self.worker = MainWorker()
-        self.worker.moveToThread(self.worker_thread)
-
-        # Setup signals
-        self.newFrameSignal.connect(self.worker.process_frame, type=Qt.QueuedConnection)
-        self.worker.signal_result_ready.connect(self.on_worker_result)
-        self.worker.signal_finished_processing.connect(self.on_worker_finished)
-        self.worker_thread.start()
-
-        # Store worker results and its current state
-        self._bboxes = []
-        self._worker_busy = False
-        self._latest_frame = None
+        # No worker here: processing runs on the full resolution frames in MultiCam's pipeline,
+        # and the results of its stages are drawn on top of the preview
 
         # This updater function should only run at 60 fps
         self.timer_video = QTimer(self)
@@ -865,6 +957,9 @@ class VideoWindowRec(VideoWindowBase):
         # Add mouse click detection to video feed (for the magnifier)
         self.VIDEO_FEED.installEventFilter(self)
 
+        if self._use_opengl:
+            self.VIDEO_FEED.set_overlay(self._paint_overlay)
+
         # RIGHT GROUP
         right_group_layout = QHBoxLayout(self.RIGHT_GROUP)
         right_group_layout.setContentsMargins(5, 5, 5, 5)
@@ -999,17 +1094,18 @@ class VideoWindowRec(VideoWindowBase):
         if event.type() in (QEvent.MouseButtonPress, QEvent.MouseMove):
 
             # Get mouse position relative to displayed image
-            mouse_x = int(event.pos().x() - (self.VIDEO_FEED.width() - self._display_buffer.shape[1]) / 2)
-            mouse_y = int(event.pos().y() - (self.VIDEO_FEED.height() - self._display_buffer.shape[0]) / 2)
+            img_x, img_y, img_w, img_h = self._image_geometry()
+            mouse_x = int(event.pos().x() - img_x)
+            mouse_y = int(event.pos().y() - img_y)
 
             if event.button() == Qt.LeftButton:
                 self.left_mouse_btn = True
             if event.button() == Qt.RightButton:
                 self.right_mouse_btn = True
 
-            if self.left_mouse_btn:
-                self.magn_target_cx = mouse_x / self._display_buffer.shape[0]
-                self.magn_target_cy = mouse_y / self._display_buffer.shape[1]
+            if self.left_mouse_btn and img_w > 0 and img_h > 0:
+                self.magn_target_cx = mouse_x / img_h
+                self.magn_target_cy = mouse_y / img_w
 
             if self.right_mouse_btn:
                 self.magn_window_x = mouse_y
@@ -1023,7 +1119,13 @@ class VideoWindowRec(VideoWindowBase):
 
         return super().eventFilter(obj, event)
 
-    #  ============= Update frame, and worker communication =============
+    #  ============= Update frame, and processing results =============
+    def _overlays(self) -> list:
+        """
+            Latest results of the processing stages that can be drawn (see mokap.core.processing.Processor)
+        """
+        return [r for _, _, r in self._main_window.mc.pipeline.results(self.idx) if isinstance(r, dict)]
+
     def _annotate(self):
 
         # Get new coordinates
@@ -1039,29 +1141,21 @@ class VideoWindowRec(VideoWindowBase):
         cv2.line(self._display_buffer, (x_west, y_west), (x_east, y_east), self._main_window.col_white_rgb, 1)
         cv2.line(self._display_buffer, (x_north, y_north), (x_south, y_south), self._main_window.col_white_rgb, 1)
 
-        if self._magnifier_enabled:
-
-            target_cx_fb = self.magn_target_cx * self._frame_buffer.shape[0]
-            target_cy_fb = self.magn_target_cy * self._frame_buffer.shape[1]
-
-            # Position of the slice (in frame_buffer coordinates)
-            slice_x1 = max(0, int(target_cx_fb - self.magn_window_w // 2))
-            slice_y1 = max(0, int(target_cy_fb - self.magn_window_h // 2))
-            slice_x2 = slice_x1 + self.magn_window_w
-            slice_y2 = slice_y1 + self.magn_window_h
+        # The magnifier uses the full resolution frame, not the preview
+        full_frame = self._main_window.mc.get_current_fullframe(self.idx)
 
-            if slice_x2 > self._source_shape[1]:
-                slice_x1 = self._source_shape[1] - self.magn_window_w
-                slice_x2 = self._source_shape[1]
+        if self._magnifier_enabled and full_frame is not None:
 
-            if slice_y2 > self._source_shape[0]:
-                slice_y1 = self._source_shape[0] - self.magn_window_h
-                slice_y2 = self._source_shape[0]
+            full_h, full_w = full_frame.shape[:2]
+            target_cx_fb, target_cy_fb, slice_x1, slice_y1, slice_x2, slice_y2 = self._magnifier_slice(full_h, full_w)
 
-            # Slice directly from the frame_buffer and make the small, zoomed window image
-            ratio_w = w / self._frame_buffer.shape[1]
-            ratio_h = h / self._frame_buffer.shape[0]
-            magn_img = cv2.resize(self._frame_buffer[slice_y1:slice_y2, slice_x1:slice_x2], (0, 0),
+            # Slice directly from the full frame and make the small, zoomed window image
+            ratio_w = w / full_w
+            ratio_h = h / full_h
+            magn_crop = full_frame[slice_y1:slice_y2, slice_x1:slice_x2]
+            if magn_crop.ndim == 2:
+                magn_crop = cv2.cvtColor(magn_crop, cv2.COLOR_GRAY2RGB)
+            magn_img = cv2.resize(magn_crop, (0, 0),
                                   fx=float(self.magn_slider.value() * ratio_w),
                                   fy=float(self.magn_slider.value() * ratio_h))
 
@@ -1086,6 +1180,20 @@ class VideoWindowRec(VideoWindowBase):
                                                  (magn_y1, magn_x1), (magn_y2, magn_x2),
                                                  self._main_window.col_yellow_rgb, 1)
 
+        # Results of the processing stages (in full resolution coordinates)
+        scale = w / self._source_shape[1]
+        for overlay in self._overlays():
+            for (bx, by, bw, bh) in overlay.get('boxes', []):
+                cv2.rectangle(self._display_buffer,
+                              (int(bx * scale), int(by * scale)), (int((bx + bw) * scale), int((by + bh) * scale)),
+                              self._main_window.col_green_rgb, 1)
+            for (px, py) in overlay.get('points', []):
+                cv2.circle(self._display_buffer, (int(px * scale), int(py * scale)), 3,
+                           self._main_window.col_green_rgb, -1)
+            if overlay.get('text'):
+                cv2.putText(self._display_buffer, str(overlay['text']), (10, h - 10),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, self._main_window.col_green_rgb, 1, cv2.LINE_AA)
+
         # Position the 'Recording' indicator
         font, txtsiz, txtth = cv2.FONT_HERSHEY_DUPLEX, 1.0, 2
         textsize = cv2.getTextSize(self._main_window._recording_text, font, txtsiz, txtth)[0]
@@ -1101,58 +1209,127 @@ class VideoWindowRec(VideoWindowBase):
                                                font, txtsiz, self._main_window.col_orange_rgb, txtth, cv2.LINE_AA)
 
 
-    def _update_images(self):
-        # 1- Grab camera frame
+    def _magnifier_slice(self, full_h, full_w):
+        """ Target point and area of the full resolution frame to magnify """
+
+        target_cx_fb = self.magn_target_cx * full_h
+        target_cy_fb = self.magn_target_cy * full_w
+
+        # Position of the slice (in full frame coordinates)
+        slice_x1 = max(0, int(target_cx_fb - self.magn_window_w // 2))
+        slice_y1 = max(0, int(target_cy_fb - self.magn_window_h // 2))
+        slice_x2 = slice_x1 + self.magn_window_w
+        slice_y2 = slice_y1 + self.magn_window_h
+
+        if slice_x2 > full_w:
+            slice_x1 = full_w - self.magn_window_w
+            slice_x2 = full_w
+
+        if slice_y2 > full_h:
+            slice_y1 = full_h - self.magn_window_h
+            slice_y2 = full_h
+
+        return target_cx_fb, target_cy_fb, slice_x1, slice_y1, slice_x2, slice_y2
+
+    def _paint_overlay(self, painter, rect):
+        """ Same annotations as _annotate(), but drawn with a QPainter on top of the OpenGL video feed """
+
+        x0, y0, w, h = rect.x(), rect.y(), rect.width(), rect.height()
+
+        # Draw crosshair
+        painter.setPen(QPen(QColor(self._main_window.col_white), 1))
+        painter.drawLine(x0, y0 + h // 2, x0 + w, y0 + h // 2)
+        painter.drawLine(x0 + w // 2, y0, x0 + w // 2, y0 + h)
+
+        full_frame = self._main_window.mc.get_current_fullframe(self.idx)
+
+        if self._magnifier_enabled and full_frame is not None:
+            full_h, full_w = full_frame.shape[:2]
+            target_cx_fb, target_cy_fb, slice_x1, slice_y1, slice_x2, slice_y2 = self._magnifier_slice(full_h, full_w)
+
+            ratio = h / full_h
+            zoom = self.magn_slider.value() * ratio
+
+            crop = np.ascontiguousarray(full_frame[slice_y1:slice_y2, slice_x1:slice_x2])
+            fmt = QImage.Format.Format_Grayscale8 if crop.ndim == 2 else QImage.Format.Format_RGB888
+            magn_img = QImage(crop.data, crop.shape[1], crop.shape[0], crop.strides[0], fmt)
+
+            painter.setPen(QPen(QColor(self._main_window.col_yellow), 1))
+            painter.setBrush(Qt.NoBrush)
+
+            # Frame around the magnified area
+            painter.drawRect(int(x0 + (target_cx_fb - self.magn_window_w / 2) * ratio),
+                             int(y0 + (target_cy_fb - self.magn_window_h / 2) * ratio),
+                             int(self.magn_window_w * ratio), int(self.magn_window_h * ratio))
+
+            # Zoom window
+            dest = QRect(x0 + max(0, self.magn_window_y), y0 + max(0, self.magn_window_x),
+                         int(crop.shape[1] * zoom), int(crop.shape[0] * zoom))
+            painter.drawImage(dest, magn_img)
+            painter.drawRect(dest)
+
+        # Results of the processing stages (in full resolution coordinates)
+        scale = w / self._source_shape[1]
+        painter.setPen(QPen(QColor(self._main_window.col_green), 1))
+        painter.setBrush(Qt.NoBrush)
+        for overlay in self._overlays():
+            for (bx, by, bw, bh) in overlay.get('boxes', []):
+                painter.drawRect(int(x0 + bx * scale), int(y0 + by * scale), int(bw * scale), int(bh * scale))
+            for (px, py) in overlay.get('points', []):
+                painter.drawEllipse(QPoint(int(x0 + px * scale), int(y0 + py * scale)), 3, 3)
+            if overlay.get('text'):
+                painter.drawText(x0 + 10, y0 + h - 10, str(overlay['text']))
+
+        font = QFont()
+        font.setPointSize(16)
+        font.setBold(True)
+        painter.setFont(font)
+
+        # 'Recording' indicator
+        if self._main_window._recording_text:
+            painter.setPen(QColor(self._main_window.col_red))
+            painter.drawText(QRect(x0, y0 + int(h * 0.75) - 30, w, 40), Qt.AlignCenter, self._main_window._recording_text)
+
+        # 'Warning' indicator
+        if self._warning:
+            painter.setPen(QColor(self._main_window.col_orange))
+            painter.drawText(QRect(x0, y0 + h // 4 - 30, w, 40), Qt.AlignCenter, self._warning_text)
+
+    def _update_images_gl(self):
+        """
+            OpenGL version of _update_images(): the grayscale preview is uploaded as is,
+            scaling and annotations are done at paint time
+        """
+        self._main_window.mc.set_preview_size(self.idx, self._display_size())
         self._refresh_framebuffer()
-        frame = self._frame_buffer.copy()
 
-        # 2- if worker is free, send frame
-        if not self._worker_busy:
-            self._send_frame_to_worker(frame)
+        if self._main_window.mc.acquiring:
+            arr = self._main_window.mc.get_current_framebuffer(self.idx)
         else:
-            self._latest_frame = frame  # We overwrite the latest_frame purposefully, no need to queue them
+            arr = self._frame_buffer
+        self.VIDEO_FEED.set_frame(arr)
 
-        # 3- resize to current window
-        self._resize_to_display()
+    def _update_images(self):
+        if self._use_opengl:
+            return self._update_images_gl()
 
-        disp_h, disp_w = self._display_buffer.shape[:2]
-        scale = min(disp_w / frame.shape[1], disp_h / frame.shape[0])
-        display_img = cv2.resize(frame, (0,0), fx=scale, fy=scale)
-
-        # 4- annotate resized image - TODO: this will be moved to _annotate()
-        h, w = display_img.shape[:2]
-        self._display_buffer[:h, :w] = display_img
-        if h < disp_h:
-            self._display_buffer[h:, :] = 0
-        if w < disp_w:
-            self._display_buffer[:, w:] = 0
-
-        # TESTING - fake bounding box
-        # for (x, y, bw, bh) in self._bboxes:
-        #     sx, sy = int(x*scale), int(y*scale)
-        #     sw, sh = int(bw*scale), int(bh*scale)
-        #     cv2.rectangle(self._display_buffer, (sx, sy), (sx+sw, sy+sh),
-        #                   (0,255,255), 2)
+        # 1- Ask MultiCam for frames at the size they will be displayed at, and grab the latest one
+        self._main_window.mc.set_preview_size(self.idx, self._display_size())
+        self._refresh_framebuffer()
 
+        # 2- The frame buffer is already at the right size, except if the window is larger than the camera frame
+        if min(self.VIDEO_FEED.width() / self._frame_buffer.shape[1], self.VIDEO_FEED.height() / self._frame_buffer.shape[0]) > 1.0:
+            self._resize_to_display()
+        else:
+            if self._display_buffer.shape != self._frame_buffer.shape:
+                self._display_buffer = np.zeros_like(self._frame_buffer)
+            np.copyto(self._display_buffer, self._frame_buffer)
+
+        # 3- annotate image
         self._annotate()
 
         self._blit_image()
 
-    def _send_frame_to_worker(self, frame):
-        self.newFrameSignal.emit(frame)
-        self._worker_busy = True
-
-    def on_worker_finished(self):
-        self._worker_busy = False
-        if self._latest_frame is not None:
-            frame = self._latest_frame
-            self._latest_frame = None
-            self._send_frame_to_worker(frame)
-
-    def on_worker_result(self, bboxes):
-        # called in the main thread when worker finishes processing and emits 'result_ready'
-        self._bboxes = bboxes
-
     #  ============= Custom functions =============
     def _toggle_n_display(self):
         if self._n_enabled:
@@ -1244,11 +1421,10 @@ class VideoWindowCalib(VideoWindowBase):
     def __init__(self, main_window_ref, idx):
         super().__init__(main_window_ref, idx)
 
-        # Default board params - TODO: Needs to be loaded from config file
-        self.board_params = {'rows': 6,
-                             'cols': 5,
-                             'square_length': 1.5,
-                             'markers_size': 4}
+        # The detection needs full resolution frames
+        self._main_window.mc.set_preview_size(self.idx, None)
+
+        self.board_params = DEFAULT_BOARD_PARAMS.copy()
 
         # Initialize reprojection error data for plotting
         self.reprojection_errors = deque(maxlen=100)
@@ -1427,24 +1603,24 @@ class VideoWindowCalib(VideoWindowBase):
         # Now scale + display the last annotated frame we got from the worker
         disp_h, disp_w = self._display_buffer.shape[:2]
 
-        if self._worker_computing:
-            blurred = cv2.GaussianBlur(frame.copy(), (25, 25), 0)
-            # Overlay "Computing..." text in the center of the blurred image
-            h, w = blurred.shape[:2]
+        annotated = self.annotated_frame
+        if self._worker_computing and annotated is not None and annotated.size > 0:
+            # The detection goes on while the intrinsics are computed, so only overlay "Computing..." at the top
+            annotated = annotated.copy()
+            h, w = annotated.shape[:2]
             text = "Computing..."
             font = cv2.FONT_HERSHEY_SIMPLEX
             font_scale = 1.5
             thickness = 3
             text_size, baseline = cv2.getTextSize(text, font, font_scale, thickness)
             text_x = (w - text_size[0]) // 2
-            text_y = (h + text_size[1]) // 2
-            cv2.putText(blurred, text, (text_x, text_y), font, font_scale, (255, 255, 255), thickness, cv2.LINE_AA)
-            self.annotated_frame = blurred.copy()
+            text_y = text_size[1] + 2 * baseline
+            cv2.putText(annotated, text, (text_x, text_y), font, font_scale, (255, 255, 255), thickness, cv2.LINE_AA)
 
-        if self.annotated_frame is not None and self.annotated_frame.size > 0:
-            scale = min(disp_w / self.annotated_frame.shape[1],
-                        disp_h / self.annotated_frame.shape[0])
-            out = cv2.resize(self.annotated_frame, (0, 0), fx=scale, fy=scale)
+        if annotated is not None and annotated.size > 0:
+            scale = min(disp_w / annotated.shape[1],
+                        disp_h / annotated.shape[0])
+            out = cv2.resize(annotated, (0, 0), fx=scale, fy=scale)
 
             h, w = out.shape[:2]
             self._display_buffer[:h, :w] = out
@@ -1463,6 +1639,11 @@ class VideoWindowCalib(VideoWindowBase):
         self.signal_new_frame.emit(frame, int(self._main_window.mc.indices[self.idx]))
         self._worker_busy = True
 
+    def _stop_worker(self):
+        super()._stop_worker()
+        if self.worker is not None:
+            self.worker.stop()
+
     def on_stage_change(self, stage):
         self.signal_set_stage.emit(stage)
 
@@ -1628,6 +1809,191 @@ class VideoWindowCalib(VideoWindowBase):
 
 ##
 
+class VideoWindowReplay(VideoWindowBase):
+    """
+        Shows one camera of a recorded session (idx is the camera's index in the session, it does not need to be
+        connected). The frames are pushed by the MainWindow, which keeps all the cameras on the same frame
+    """
+
+    def __init__(self, main_window_ref, idx):
+        super().__init__(main_window_ref, idx)
+
+        self._frame = None
+        self._new_frame = True
+        self._feed_size = (0, 0)
+
+        self.timer_video = QTimer(self)
+        self.timer_video.timeout.connect(self._update_images)
+        self.timer_video.start(16)
+
+        # Finish building the UI by calling the other constructors
+        self._init_common_ui()
+        self._init_specific_ui()
+        self.auto_size()
+
+    def _init_source(self):
+        """
+            The camera is the one of the session, at the resolution it was recorded at
+        """
+        mc = self._main_window.mc
+        replay = self._main_window.replay
+
+        self._camera = None
+        self._stream_idx = self.idx
+        self._cam_metadata = replay.metadata['cameras'][self.idx]
+        self._cam_name = self._cam_metadata['name']
+
+        shape = replay.shapes[self.idx] or self._cam_metadata.get('shape', [self._cam_metadata['height'],
+                                                                               self._cam_metadata['width']])
+        self._source_shape = np.array(shape[:2])
+
+        # Same colour as in the config if the camera is in it
+        sources = mc.config_dict.get('sources') or {}
+        colour = mc.colours.get(self._cam_name,
+                                (sources.get(self._cam_name) or {}).get('color', mc.COLOURS[self.idx % len(mc.COLOURS)]))
+        self._bg_colour = f'#{str(colour).lstrip("#")}'
+        self._fg_colour = self._main_window.col_white if hex_to_hls(self._bg_colour)[1] < 60 else self._main_window.col_black
+
+    #  ============= UI constructors =============
+    def _init_specific_ui(self):
+        """
+            This constructor creates the UI elements specific to Replay mode
+        """
+
+        if self._use_opengl:
+            self.VIDEO_FEED.set_overlay(self._paint_overlay)
+
+        # The information is the one of the recording, not of the live camera
+        replay = self._main_window.replay
+        if replay is not None:
+            self.triggered_value.setText("Yes" if replay.metadata.get('hardware_triggered') else "No")
+        self.resolution_value.setText(f"{self.source_shape[1]}×{self.source_shape[0]} px")
+        framerate = self._cam_metadata.get('framerate_actual')
+        self.capturefps_value.setText(f"{framerate:.2f} fps" if framerate else '-')
+        exposure = self._cam_metadata.get('exposure')
+        self.exposure_value.setText(f"{exposure} µs" if exposure is not None else '-')
+        self.temperature_value.setText('-')
+
+        self.RIGHT_GROUP.setTitle('Stream')
+        right_group_layout = QVBoxLayout(self.RIGHT_GROUP)
+        right_group_layout.setContentsMargins(5, 5, 5, 5)
+
+        self.stream_frame_value = QLabel('-')
+        self.stream_number_value = QLabel('-')
+        self.stream_file_value = QLabel('-')
+        self.stream_file_value.setWordWrap(True)
+        self.stream_file_value.setStyleSheet(f"color: {self._main_window.col_darkgray};")
+
+        self.stream_file_value.setText(self._cam_metadata.get('file', '-'))
+
+        for label, value in [('Frame', self.stream_frame_value), ('Frame number', self.stream_number_value)]:
+            line = QWidget()
+            line_layout = QHBoxLayout(line)
+            line_layout.setContentsMargins(1, 1, 1, 1)
+            line_layout.setSpacing(5)
+
+            label = QLabel(f"{label} :")
+            label.setAlignment(Qt.AlignRight)
+            label.setStyleSheet(f"color: {self._main_window.col_darkgray}; font: bold;")
+            label.setMinimumWidth(88)
+            line_layout.addWidget(label)
+            line_layout.addWidget(value, 1)
+
+            right_group_layout.addWidget(line)
+
+        right_group_layout.addWidget(self.stream_file_value)
+        right_group_layout.addStretch(1)
+
+    #  ============= Qt method overrides =============
+    def closeEvent(self, event):
+        if self._force_destroy:
+            self.timer_video.stop()
+        super().closeEvent(event)
+
+    #  ============= Display =============
+    def set_frame(self, frame):
+        """
+            Called by the MainWindow with this camera's frame (None if there is no frame at this position)
+        """
+        replay = self._main_window.replay
+
+        if replay is None:
+            self._warning_text = '[No session loaded]'
+        elif replay.shapes[self._stream_idx] is None:
+            self._warning_text = '[Stream not found]'
+        elif replay.stream_index(self._stream_idx) < 0:
+            self._warning_text = '[Missing frame]'
+        self._warning = frame is None
+
+        self._frame = frame
+        self._new_frame = True
+
+    def _update_images(self):
+        feed_size = (self.VIDEO_FEED.width(), self.VIDEO_FEED.height())
+        if not self._new_frame and feed_size == self._feed_size:
+            return  # Nothing changed, no need to redraw (this happens a lot when paused)
+        self._new_frame = False
+        self._feed_size = feed_size
+
+        if self._use_opengl:
+            # Frames are uploaded as they are, the GPU does the scaling
+            self.VIDEO_FEED.set_frame(self._frame if self._frame is not None else self._frame_buffer)
+            return
+
+        if self._frame is None:
+            self._frame_buffer.fill(0)
+        elif self._frame.ndim == 2:
+            if self._frame_buffer.shape[:2] != self._frame.shape[:2]:
+                self._frame_buffer = np.zeros((*self._frame.shape[:2], 3), dtype=np.uint8)
+            self._frame_buffer = cv2.cvtColor(self._frame, cv2.COLOR_GRAY2RGB, dst=self._frame_buffer)
+        else:
+            self._frame_buffer = self._frame
+
+        self._resize_to_display()
+        self._annotate()
+        self._blit_image()
+
+    def _annotate(self):
+        if self._warning:
+            h, w = self._display_buffer.shape[:2]
+            font, txtsiz, txtth = cv2.FONT_HERSHEY_DUPLEX, 1.0, 2
+            textsize = cv2.getTextSize(self._warning_text, font, txtsiz, txtth)[0]
+            self._display_buffer = cv2.putText(self._display_buffer, self._warning_text,
+                                               (int(w / 2 - textsize[0] / 2), int(h / 4 - textsize[1])),
+                                               font, txtsiz, self._main_window.col_orange_rgb, txtth, cv2.LINE_AA)
+
+    def _paint_overlay(self, painter, rect):
+        """ Same annotations as _annotate(), but drawn with a QPainter on top of the OpenGL video feed """
+        if self._warning:
+            font = QFont()
+            font.setPointSize(16)
+            font.setBold(True)
+            painter.setFont(font)
+            painter.setPen(QColor(self._main_window.col_orange))
+            painter.drawText(QRect(rect.x(), rect.y() + rect.height() // 4 - 30, rect.width(), 40),
+                             Qt.AlignCenter, self._warning_text)
+
+    def _update_vars(self):
+
+        if self.isVisible():
+            replay = self._main_window.replay
+
+            if replay is not None:
+                i = replay.stream_index(self._stream_idx)
+                if i >= 0:
+                    self.stream_frame_value.setText(f"{i + 1} / {replay.stream_nb_frames(self._stream_idx)}")
+                    self.stream_number_value.setText(f"{replay.frame_number()}")
+                else:
+                    self.stream_frame_value.setText("-")
+                    self.stream_number_value.setText(f"{replay.frame_number()} (missing)")
+
+            if self._frame is not None:
+                brightness = np.round(self._frame.mean() / 255 * 100, decimals=2)
+                self.brightness_value.setText(f"{brightness:.2f}%")
+            else:
+                self.brightness_value.setText("-")
+
+
 class ExtrinsicsWindow(QWidget):
 
     signal_update_origin_camera = Signal(int)
@@ -1653,7 +2019,7 @@ class ExtrinsicsWindow(QWidget):
         self._multi_extrinsics_matrices = np.zeros((self.nb_cams, 3, 4), dtype=np.float32)
 
         # Setup multiview calib tool
-        self.multi_calib_tool = MultiviewCalibrationTool(self.nb_cams, origin_camera=0, min_poses=3)
+        self.multi_calib_tool = MultiviewCalibrationTool(self.nb_cams, board_params=DEFAULT_BOARD_PARAMS, origin_camera=0, min_poses=3)
 
         # Global arrangement coords
         self._cameras_pos_rot = np.zeros((self.nb_cams, 3), dtype=np.float32)
@@ -1669,6 +2035,7 @@ class ExtrinsicsWindow(QWidget):
         #      Worker --> Main thread
         self.worker.signal_return_computed_poses.connect(self.update_poses)
         self.worker.signal_return_computed_points.connect(self.update_points)
+        self.worker.signal_return_refined.connect(self.update_refined)
 
         #       Main thread --> Worker
         self.signal_update_origin_camera.connect(self.worker.set_origin_camera)
@@ -2098,6 +2465,12 @@ class ExtrinsicsWindow(QWidget):
         # And forward new intrinsics to the multiview worker
         self.signal_update_intrinsics.emit(cam_idx, camera_matrix, dist_coeffs)
 
+    @Slot(np.ndarray, np.ndarray, np.ndarray, np.ndarray)
+    def update_refined(self, rvecs, tvecs, camera_matrices, dist_coeffs):
+        self._multi_intrinsics_matrices[:] = camera_matrices
+        self._multi_dist_coeffs[:] = dist_coeffs
+        self.update_poses(rvecs, tvecs)
+
     @Slot(np.ndarray)
     def update_points(self, points3d):
         self.add_points3d(points3d, color=(1, 0, 0, 1))
@@ -2152,6 +2525,9 @@ class MainWindow(QMainWindow):
         self.mc = mc
         self.nb_cams = self.mc.nb_cameras
 
+        # Use OpenGL textures for the video feeds instead of QPixmaps
+        self.use_opengl = bool(self.mc.config_dict.get('gui_opengl', False))
+
         # Set cameras info
         self.sources_shapes = np.vstack([np.array(cam.shape)[:2] for cam in self.mc.cameras])
         self.bg_colours_list = [f'#{self.mc.colours[cam.name].lstrip("#")}' for cam in self.mc.cameras]
@@ -2176,8 +2552,16 @@ class MainWindow(QMainWindow):
         # States
         self.editing_disabled = True
         self._is_calibrating = False
+        self._is_replaying = False
         self.calibration_stage = 0
 
+        # Replay mode
+        self.replay = None
+        self._replay_playing = False
+        self._replay_clock = time.monotonic()
+        self._replay_advance = 0.0      # Fraction of frame the playback is ahead of the displayed frame
+        self._replay_shown = -1         # Position of the frames currently displayed
+
         self._recording_text = ''
 
         # Refs for the secondary windows
@@ -2201,6 +2585,11 @@ class MainWindow(QMainWindow):
         self.timer_update.timeout.connect(self._update_main)
         self.timer_update.start(100)
 
+        # Replay playback (this does nothing outside of Replay mode)
+        self.timer_replay = QTimer(self)
+        self.timer_replay.timeout.connect(self._update_replay)
+        self.timer_replay.start(16)
+
         self._mem_baseline = psutil.virtual_memory().percent
 
     def init_gui(self):
@@ -2224,8 +2613,8 @@ class MainWindow(QMainWindow):
         toolbar_layout.addWidget(mode_label)
 
         self.mode_combo = QComboBox()
-        self.mode_combo.addItems(['Recording', 'Calibration'])
-        self.mode_combo.currentIndexChanged.connect(self._toggle_calibrate)
+        self.mode_combo.addItems(['Recording', 'Calibration', 'Replay'])
+        self.mode_combo.currentIndexChanged.connect(self._switch_mode)
         toolbar_layout.addWidget(self.mode_combo, 1)    # 1 unit
 
         toolbar_layout.addStretch(2)    # spacing of 2 units
@@ -2333,17 +2722,87 @@ class MainWindow(QMainWindow):
         f_buttons_layout.addWidget(self.button_recpause, 1)
 
         left_pane_layout.addWidget(f_buttons, 2)
+        self.acquisition_buttons = f_buttons
+
+        # Replay controls (only visible in Replay mode)
+        self.replay_pane = QWidget()
+        replay_pane_layout = QVBoxLayout(self.replay_pane)
+        replay_pane_layout.setContentsMargins(3, 0, 3, 0)
+
+        replay_line_1 = QWidget()
+        replay_line_1_layout = QHBoxLayout(replay_line_1)
+        replay_line_1_layout.setContentsMargins(0, 0, 0, 0)
+
+        self.button_replay_load = QPushButton("Load acquisition...")
+        self.button_replay_load.clicked.connect(self.load_replay)
+        replay_line_1_layout.addWidget(self.button_replay_load, 1)
+
+        self.replay_session_combo = QComboBox()
+        self.replay_session_combo.setDisabled(True)
+        self.replay_session_combo.currentIndexChanged.connect(self._replay_session_changed)
+        replay_line_1_layout.addWidget(self.replay_session_combo)
+
+        replay_pane_layout.addWidget(replay_line_1)
+
+        self.replay_path_label = QLabel('No acquisition loaded')
+        self.replay_path_label.setStyleSheet(f"color: {self.col_darkgray};")
+        self.replay_path_label.setWordWrap(True)
+        self.replay_path_label.setFont(folderpath_label_font)
+        replay_pane_layout.addWidget(self.replay_path_label)
+
+        self.replay_slider = QSlider(Qt.Orientation.Horizontal)
+        self.replay_slider.setRange(0, 0)
+        self.replay_slider.setDisabled(True)
+        self.replay_slider.valueChanged.connect(self._replay_seek)
+        replay_pane_layout.addWidget(self.replay_slider)
+
+        replay_line_2 = QWidget()
+        replay_line_2_layout = QHBoxLayout(replay_line_2)
+        replay_line_2_layout.setContentsMargins(0, 0, 0, 0)
+
+        self.button_replay_back = QPushButton("<")
+        self.button_replay_back.setToolTip("Previous frame")
+        self.button_replay_back.clicked.connect(lambda: self._replay_step(-1))
+        replay_line_2_layout.addWidget(self.button_replay_back)
+
+        self.button_replay_play = QPushButton("Play")
+        self.button_replay_play.setCheckable(True)
+        self.button_replay_play.clicked.connect(self._toggle_replay_playback)
+        replay_line_2_layout.addWidget(self.button_replay_play, 1)
+
+        self.button_replay_forward = QPushButton(">")
+        self.button_replay_forward.setToolTip("Next frame")
+        self.button_replay_forward.clicked.connect(lambda: self._replay_step(1))
+        replay_line_2_layout.addWidget(self.button_replay_forward)
+
+        self.replay_speed_combo = QComboBox()
+        self.replay_speed_combo.addItems(['0.1×', '0.25×', '0.5×', '1×', '2×', '4×'])
+        self.replay_speed_combo.setCurrentText('1×')
+        replay_line_2_layout.addWidget(self.replay_speed_combo)
+
+        self.replay_position_label = QLabel('- / -')
+        self.replay_position_label.setMinimumWidth(90)
+        self.replay_position_label.setAlignment(Qt.AlignRight | Qt.AlignVCenter)
+        replay_line_2_layout.addWidget(self.replay_position_label)
+
+        replay_pane_layout.addWidget(replay_line_2)
+
+        for w in [self.button_replay_back, self.button_replay_play, self.button_replay_forward]:
+            w.setDisabled(True)
+
+        left_pane_layout.addWidget(self.replay_pane, 2)
+        self.replay_pane.setVisible(False)
 
         # RIGHT HALF
         live_previews = QGroupBox('Live previews')
         live_previews_layout = QVBoxLayout(live_previews)
 
         windows_list_frame = QScrollArea()
-        windows_list_layout = QVBoxLayout()
+        self.windows_list_layout = QVBoxLayout()
         windows_list_widget = QWidget()
-        windows_list_layout.setContentsMargins(0, 0, 0, 0)
-        windows_list_layout.setSpacing(5)
-        windows_list_widget.setLayout(windows_list_layout)
+        self.windows_list_layout.setContentsMargins(0, 0, 0, 0)
+        self.windows_list_layout.setSpacing(5)
+        windows_list_widget.setLayout(self.windows_list_layout)
         windows_list_frame.setStyleSheet('border: none; background-color: #00000000;')
         windows_list_frame.setWidget(windows_list_widget)
         windows_list_frame.setWidgetResizable(True)
@@ -2351,15 +2810,7 @@ class MainWindow(QMainWindow):
 
         right_pane_layout.addWidget(live_previews)
 
-        self.secondary_windows_visibility_buttons = []
-
-        for i in range(self.nb_cams):
-            vis_checkbox = QCheckBox(f"Camera {i}")
-            vis_checkbox.setChecked(True)
-            vis_checkbox.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
-            vis_checkbox.setMinimumHeight(25)
-            windows_list_layout.addWidget(vis_checkbox)
-            self.secondary_windows_visibility_buttons.append(vis_checkbox)
+        self.secondary_windows_visibility_buttons = []     # Made with the windows (see _init_visibility_buttons())
 
         monitors_frame = QGroupBox('Active monitor')
         monitors_frame_layout = QVBoxLayout(monitors_frame)
@@ -2413,6 +2864,10 @@ class MainWindow(QMainWindow):
         self._mem_pressure_bar.setMaximum(100)
         statusbar.addWidget(self._mem_pressure_bar)
 
+        self.storage_label = QLabel()
+        self.storage_label.setStyleSheet(f"background-color: {'#00000000'}")
+        statusbar.addPermanentWidget(self.storage_label)
+
         self.frames_saved_label = QLabel()
         self.frames_saved_label.setText(f'Saved frames: {self.mc.saved} (0 bytes)')
         self.frames_saved_label.setStyleSheet(f"background-color: {'#00000000'}")
@@ -2426,6 +2881,9 @@ class MainWindow(QMainWindow):
         # Close the secondary windows and stop their threads
         self._stop_secondary_windows()
 
+        if self.replay is not None:
+            self.replay.close()
+
         # Stop camera acquisition
         self.mc.off()
 
@@ -2436,30 +2894,36 @@ class MainWindow(QMainWindow):
         QApplication.instance().quit()
         sys.exit()
 
-    def _toggle_calibrate(self):
+    def _switch_mode(self):
 
-        if self._is_calibrating and self.mode_combo.currentIndex() == 0:
-            self._is_calibrating = False
+        calibrating = self.mode_combo.currentIndex() == 1
+        replaying = self.mode_combo.currentIndex() == 2
 
-            self._stop_secondary_windows()
+        if calibrating == self._is_calibrating and replaying == self._is_replaying:
+            return
 
-            if self.mc.acquiring:
-                self.button_snapshot.setDisabled(False)
-                self.button_recpause.setDisabled(False)
+        self._stop_secondary_windows()
 
-            self._start_secondary_windows()
+        if replaying:
+            # Replay reads from the disk(s), so stop the cameras
+            self._toggle_acquisition(False)
+        else:
+            self._toggle_replay_playback(False)
 
-        elif not self._is_calibrating and self.mode_combo.currentIndex() == 1:
-            self._is_calibrating = True
+        self._is_calibrating = calibrating
+        self._is_replaying = replaying
 
-            self._stop_secondary_windows()
+        self.acquisition_buttons.setVisible(not replaying)
+        self.replay_pane.setVisible(replaying)
 
+        if self.mc.acquiring:
+            self.button_snapshot.setDisabled(False)
+            self.button_recpause.setDisabled(calibrating)
+        else:
             self.button_recpause.setDisabled(True)
 
-            self._start_secondary_windows()
-
-        else:
-            pass
+        self._start_secondary_windows()
+        self._replay_shown = -1     # Push the frames to the new windows
 
     def _toggle_text_editing(self, override=None):
 
@@ -2536,21 +3000,11 @@ class MainWindow(QMainWindow):
 
     def _take_snapshot(self):
         """
-            Takes an instantaneous snapshot from all cameras
+            Takes a snapshot from all cameras (the same frame for all cameras, if hardware-triggered).
+            Frames are captured and written in the background, so this does not block the GUI
         """
-
-        now = datetime.now().strftime('%y%m%d-%H%M%S')
-
         if self.mc.acquiring:
-
-            arrays = self.mc.get_current_framebuffer()
-
-            for i, arr in enumerate(arrays):
-                if len(arr.shape) == 3:
-                    img = Image.fromarray(arr, mode='RGB')
-                else:
-                    img = Image.fromarray(arr, mode='L')
-                img.save(self.mc.full_path.resolve() / f"snapshot_{now}_{self.mc.cameras[i].name}.bmp")
+            self.mc.snapshot(nb_frames=1, folder=self.mc.full_path.resolve(), fmt='bmp')
 
     def _toggle_recording(self, override=None):
 
@@ -2734,6 +3188,23 @@ class MainWindow(QMainWindow):
             windows += [self]
         return windows
 
+    def _init_visibility_buttons(self, nb):
+        """
+            One show/hide button per secondary window (the replayed session may not have the same cameras)
+        """
+        for vis_checkbox in self.secondary_windows_visibility_buttons:
+            self.windows_list_layout.removeWidget(vis_checkbox)
+            vis_checkbox.deleteLater()
+        self.secondary_windows_visibility_buttons = []
+
+        for i in range(nb):
+            vis_checkbox = QCheckBox(f"Camera {i}")
+            vis_checkbox.setChecked(True)
+            vis_checkbox.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Expanding)
+            vis_checkbox.setMinimumHeight(25)
+            self.windows_list_layout.addWidget(vis_checkbox)
+            self.secondary_windows_visibility_buttons.append(vis_checkbox)
+
     def _start_secondary_windows(self):
         if self._is_calibrating:
             # Create 3D visualization window
@@ -2741,11 +3212,20 @@ class MainWindow(QMainWindow):
             self.extrinsics_window.setWindowTitle("3D Calibration View")
             self.extrinsics_window.show()
 
-        for i, cam in enumerate(self.mc.cameras):
+        # Replay shows the cameras of the session, whether they are connected or not
+        if self._is_replaying:
+            indices = range(self.replay.nb_cameras) if self.replay is not None else []
+        else:
+            indices = [cam.idx for cam in self.mc.cameras]
+        self._init_visibility_buttons(len(indices))
+
+        for i, idx in enumerate(indices):
             if self._is_calibrating:
-                w = VideoWindowCalib(main_window_ref=self, idx=cam.idx)
+                w = VideoWindowCalib(main_window_ref=self, idx=idx)
+            elif self._is_replaying:
+                w = VideoWindowReplay(main_window_ref=self, idx=idx)
             else:
-                w = VideoWindowRec(main_window_ref=self, idx=cam.idx)
+                w = VideoWindowRec(main_window_ref=self, idx=idx)
 
             self.secondary_windows.append(w)
             self.secondary_windows_visibility_buttons[i].setText(f" {w.name.title()} camera")
@@ -2759,14 +3239,14 @@ class MainWindow(QMainWindow):
 
     def _stop_secondary_windows(self):
         for w in self.secondary_windows:
-            w.worker_thread.quit()
-            w.worker_thread.wait()
+            w._stop_worker()
             w._force_destroy = True
             w.close()
 
         if self.extrinsics_window is not None:
             self.extrinsics_window.worker_thread.quit()
             self.extrinsics_window.worker_thread.wait()
+            self.extrinsics_window.worker.stop()
 
             self.extrinsics_window.timer_update.stop()
 
@@ -2776,20 +3256,157 @@ class MainWindow(QMainWindow):
 
         self.secondary_windows.clear()
 
-    def _update_main(self):
+    def load_replay(self, path=None, session=0):
+        """
+            Loads a recorded acquisition (the folder containing the metadata.json, on any of its volumes)
+        """
+        if path is None:
+            dial = QFileDialog(self)
+            dial.setWindowTitle("Choose acquisition folder")
+            dial.setFileMode(QFileDialog.FileMode.Directory)
+            dial.setViewMode(QFileDialog.ViewMode.Detail)
+            dial.setDirectory(QDir(self.mc.full_path.parent.resolve()))
+            if not dial.exec() or not dial.selectedFiles():
+                return
+            path = dial.selectedFiles()[0]
 
-        # Get an estimation of the saved data size
-        if self.mc._estim_file_size is None:
-            self.frames_saved_label.setText(f'Saved frames: {self.mc.saved} (0 bytes)')
+        try:
+            replay = SessionReplay(path, session=session, silent=False)
+        except (FileNotFoundError, IndexError, IOError, KeyError, ValueError) as e:
+            print(f'[ERROR] Could not load {path}: {e}')
+            return
 
-        elif self.mc._estim_file_size == -1:
-            size = sum(sum(os.path.getsize(os.path.join(res[0], element)) for element in res[2]) for res in
-                       os.walk(self.mc.full_path))
-            self.frames_saved_label.setText(f'Saved frames: {self.mc.saved} ({pretty_size(size)})')
-        else:
-            saved = self.mc.saved
-            size = sum(self.mc._estim_file_size * saved)
-            self.frames_saved_label.setText(f'Saved frames: {saved} ({pretty_size(size)})')
+        self._toggle_replay_playback(False)
+        if self.replay is not None:
+            self.replay.close()
+        self.replay = replay
+
+        self.replay_path_label.setText(f'{replay.path.resolve()}')
+
+        self.replay_session_combo.blockSignals(True)
+        self.replay_session_combo.clear()
+        self.replay_session_combo.addItems([f'Session {i}' for i in range(replay.nb_sessions)])
+        self.replay_session_combo.setCurrentIndex(replay.session)
+        self.replay_session_combo.blockSignals(False)
+
+        self.replay_slider.blockSignals(True)
+        self.replay_slider.setRange(0, max(0, replay.nb_frames - 1))
+        self.replay_slider.setValue(0)
+        self.replay_slider.blockSignals(False)
+
+        for w in [self.replay_session_combo, self.replay_slider,
+                  self.button_replay_back, self.button_replay_play, self.button_replay_forward]:
+            w.setDisabled(False)
+
+        # The windows depend on the session's cameras and resolutions, so rebuild them
+        if self._is_replaying:
+            self._stop_secondary_windows()
+            self._start_secondary_windows()
+        self._replay_shown = -1
+
+    def _replay_session_changed(self, index):
+        if self.replay is not None and index >= 0 and index != self.replay.session:
+            self.load_replay(self.replay.path, session=index)
+
+    def _replay_seek(self, value):
+        if self.replay is not None:
+            self.replay.seek(value)
+
+    def _replay_step(self, n):
+        self._toggle_replay_playback(False)
+        if self.replay is not None:
+            # Going through the slider keeps it in sync, and it calls _replay_seek()
+            self.replay_slider.setValue(self.replay.position + n)
+
+    def _toggle_replay_playback(self, override=None):
+
+        if override is None:
+            override = not self._replay_playing
+
+        if self.replay is None:
+            override = False
+
+        if override and self.replay.position >= self.replay.nb_frames - 1:
+            self.replay_slider.setValue(0)   # Start over
+
+        self._replay_playing = bool(override)
+        self._replay_clock = time.monotonic()
+        self._replay_advance = 0.0
+
+        self.button_replay_play.setChecked(self._replay_playing)
+        self.button_replay_play.setText("Pause" if self._replay_playing else "Play")
+
+    def _update_replay(self):
+        """
+            Advances the playback and pushes the frames to the windows. All the cameras always show the same
+            position: if a stream is not decoded yet, the playback waits for it instead of skipping frames
+        """
+        if not self._is_replaying:
+            return
+
+        if self.replay is None:
+            if self._replay_shown != 0:
+                for w in self.secondary_windows:
+                    w.set_frame(None)
+                self._replay_shown = 0
+            return
+
+        now = time.monotonic()
+        elapsed = now - self._replay_clock
+        self._replay_clock = now
+
+        ready = self.replay.ready()
+
+        if self._replay_playing and ready and self._replay_shown == self.replay.position:
+            speed = float(self.replay_speed_combo.currentText().rstrip('×'))
+            self._replay_advance += elapsed * (self.replay.framerate or 30) * speed
+            n = int(self._replay_advance)
+            if n > 0:
+                self._replay_advance -= n
+                self.replay_slider.setValue(self.replay.position + n)
+                if self.replay.position >= self.replay.nb_frames - 1:
+                    self._toggle_replay_playback(False)
+                ready = self.replay.ready()
+
+        if ready and self._replay_shown != self.replay.position:
+            frames = self.replay.frames()
+            for w in self.secondary_windows:
+                w.set_frame(frames[w._stream_idx])
+            self._replay_shown = self.replay.position
+
+            self.replay_position_label.setText(f'{self.replay.position + 1} / {self.replay.nb_frames}')
+
+    def _update_main(self):
+
+        # Saved data size and throughput (counted by the writers, nothing is read from the disk here)
+        size = int(self.mc.saved_bytes.sum())
+        throughput = self.mc.write_throughput.sum()
+        self.frames_saved_label.setText(f'Saved frames: {self.mc.saved} ({pretty_size(size)}, {throughput:.1f} MB/s)')
+
+        # The storage manager (or the motion trigger) may have stopped or started the recording on its own
+        if self._recording_text and not self.mc.recording and not self.mc.storage.busy:
+            self._recording_text = ''
+            self.button_recpause.setText("Not recording (Space to toggle)")
+            self.button_recpause.setIcon(self.icon_rec_bw)
+        elif not self._recording_text and self.mc.recording:
+            self._recording_text = '[Recording]'
+            self.button_recpause.setText("Recording... (Space to toggle)")
+            self.button_recpause.setIcon(self.icon_rec_on)
+
+        # Time left before the disk(s) are full (these are cached values, the disk is not accessed here)
+        if self.mc.acquiring:
+            time_left = self.mc.storage.time_left
+            if time_left == 0:
+                self.storage_label.setText('Disk full!')
+                self.storage_label.setStyleSheet(f"background-color: {'#00000000'}; color: {self.col_red};")
+            elif np.isfinite(time_left):
+                self.storage_label.setText(f'Disk full in: {int(time_left // 3600)}h{int((time_left % 3600) // 60):02d}')
+                if time_left < 3600:
+                    self.storage_label.setStyleSheet(f"background-color: {'#00000000'}; color: {self.col_orange};")
+                else:
+                    self.storage_label.setStyleSheet(f"background-color: {'#00000000'}")
+            else:
+                self.storage_label.setText('')
 
         # Update memory pressure estimation
         self._mem_pressure += (psutil.virtual_memory().percent - self._mem_baseline) / self._mem_baseline * 100
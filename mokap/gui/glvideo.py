@@ -0,0 +1,277 @@
+import ctypes
+import numpy as np
+from PySide6.QtCore import Qt, QRect, QTimer, Signal
+from PySide6.QtGui import QPainter, QSurfaceFormat
+from PySide6.QtOpenGLWidgets import QOpenGLWidget
+from OpenGL import GL
+from OpenGL.GL import shaders
+
+##
+
+VERTEX_SHADER = """
+#version 120
+attribute vec2 a_position;
+attribute vec2 a_texcoord;
+varying vec2 v_texcoord;
+void main() {
+    v_texcoord = a_texcoord;
+    gl_Position = vec4(a_position, 0.0, 1.0);
+}
+"""
+
+FRAGMENT_SHADER = """
+#version 120
+uniform sampler2D u_texture;
+uniform int u_channels;
+uniform int u_saturation;
+varying vec2 v_texcoord;
+void main() {
+    vec4 texel = texture2D(u_texture, v_texcoord);
+    vec3 colour = (u_channels == 1) ? vec3(texel.r) : texel.rgb;
+    if (u_saturation == 1 && texel.r >= 0.999) {
+        colour = vec3(1.0, 0.0, 0.0);
+    }
+    gl_FragColor = vec4(colour, 1.0);
+}
+"""
+
+# Fullscreen quad (x, y, u, v) as a triangle strip. Texture rows go from top to bottom, hence the flipped v
+QUAD = np.array([[-1.0, -1.0, 0.0, 1.0],
+                 [ 1.0, -1.0, 1.0, 1.0],
+                 [-1.0,  1.0, 0.0, 0.0],
+                 [ 1.0,  1.0, 1.0, 0.0]], dtype=np.float32)
+
+
+class GLVideoFeed(QOpenGLWidget):
+    """
+        A video widget that streams frames into a persistent OpenGL texture. Grayscale frames are uploaded as
+        single-channel textures (1 byte per pixel), and the scaling and grey-to-RGB mapping are done by a shader.
+        Unlike a QLabel + QPixmap, no image conversion or allocation happens on the CPU for each frame.
+        Works with software OpenGL (Mesa llvmpipe) too.
+
+        Annotations can be drawn on top with a QPainter, using set_overlay()
+
+        If there is no OpenGL context, or the shaders can't be set up with the one the platform gives, gl_failed is emitted
+        (with the error message) and nothing is drawn, so the owner can fall back to something else
+    """
+
+    gl_failed = Signal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self._frame = None
+        self._new_frame = False
+
+        self._texture = None
+        self._texture_shape = None
+        self._program = None
+        self._vbo = None
+        self._loc_position = -1
+        self._loc_texcoord = -1
+        self._single_channel_fmt = (GL.GL_R8, GL.GL_RED)
+
+        self._failed = False
+        self._highlight_saturation = False
+        self._overlay_callback = None
+
+        self._image_rect = QRect()
+
+        self.setMinimumSize(1, 1)
+
+    @staticmethod
+    def set_default_format():
+        """
+            Must be called before the QApplication is created if the GL context can't be a 2.x compatibility one
+        """
+        fmt = QSurfaceFormat()
+        fmt.setVersion(2, 1)
+        fmt.setProfile(QSurfaceFormat.OpenGLContextProfile.CompatibilityProfile)
+        fmt.setSwapInterval(0)
+        QSurfaceFormat.setDefaultFormat(fmt)
+
+    @property
+    def image_rect(self) -> QRect:
+        """ Where the image is drawn within the widget (in widget coordinates) """
+        return self._image_rect
+
+    @property
+    def highlight_saturation(self) -> bool:
+        return self._highlight_saturation
+
+    @highlight_saturation.setter
+    def highlight_saturation(self, value: bool):
+        self._highlight_saturation = bool(value)
+        self.update()
+
+    def set_overlay(self, callback=None):
+        """
+            Sets a function that will be called with (QPainter, QRect) after each frame is drawn, to paint annotations.
+            The QRect is the area the image occupies in the widget.
+        """
+        self._overlay_callback = callback
+
+    def set_frame(self, frame: np.ndarray):
+        """
+            Schedules a frame to be displayed. The array (uint8, (h, w) or (h, w, 3)) is only read when the widget
+            is repainted, so it should not be modified in the meantime
+        """
+        self._frame = frame
+        self._new_frame = True
+        self.update()
+
+    def _fail(self, error: str):
+        if not self._failed:
+            self._failed = True
+            # Emit it later, the owner will probably want to replace this widget and it can't be done while painting
+            QTimer.singleShot(0, lambda: self.gl_failed.emit(error))
+
+    def _check_context(self):
+        # initializeGL() is never called if the context could not be created
+        if self.isVisible() and not self.isValid():
+            self._fail('could not create an OpenGL context')
+
+    #  ============= Qt method overrides =============
+    def showEvent(self, event):
+        super().showEvent(event)
+        QTimer.singleShot(0, self._check_context)
+
+    def initializeGL(self):
+        try:
+            self._init_gl()
+        except Exception as e:
+            self._program = None
+            self._fail(str(e).strip() or e.__class__.__name__)
+            return
+        # Free the GL objects with the context, whichever way the widget goes
+        self.context().aboutToBeDestroyed.connect(self.cleanup)
+
+    def _init_gl(self):
+        # Single-channel textures are only in core since GL 3.0, older contexts need GL_LUMINANCE (it also has the
+        # grey value in .r, so the shader does not change)
+        ctx = self.context()
+        if ctx.format().version() >= (3, 0) or ctx.hasExtension(b'GL_ARB_texture_rg'):
+            self._single_channel_fmt = (GL.GL_R8, GL.GL_RED)
+        else:
+            self._single_channel_fmt = (GL.GL_LUMINANCE8, GL.GL_LUMINANCE)
+
+        vs = shaders.compileShader(VERTEX_SHADER, GL.GL_VERTEX_SHADER)
+        fs = shaders.compileShader(FRAGMENT_SHADER, GL.GL_FRAGMENT_SHADER)
+        self._program = shaders.compileProgram(vs, fs, validate=False)
+
+        self._loc_position = GL.glGetAttribLocation(self._program, 'a_position')
+        self._loc_texcoord = GL.glGetAttribLocation(self._program, 'a_texcoord')
+
+        self._vbo = GL.glGenBuffers(1)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self._vbo)
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, QUAD.nbytes, QUAD, GL.GL_STATIC_DRAW)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+
+        self._texture = GL.glGenTextures(1)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self._texture)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+
+        self._texture_shape = None
+
+    def _upload(self):
+        frame = self._frame
+        if frame is None:
+            return
+
+        h, w = frame.shape[:2]
+        channels = 1 if frame.ndim == 2 else frame.shape[2]
+        if channels == 1:
+            internal_fmt, fmt = self._single_channel_fmt
+        else:
+            internal_fmt, fmt = GL.GL_RGB8, GL.GL_RGB
+
+        if not frame.flags['C_CONTIGUOUS']:
+            frame = np.ascontiguousarray(frame)
+
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self._texture)
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
+
+        # (Re)allocate the texture storage only when the frame size or format changes
+        if self._texture_shape != frame.shape:
+            GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, internal_fmt, w, h, 0, fmt, GL.GL_UNSIGNED_BYTE, frame)
+            self._texture_shape = frame.shape
+        else:
+            GL.glTexSubImage2D(GL.GL_TEXTURE_2D, 0, 0, 0, w, h, fmt, GL.GL_UNSIGNED_BYTE, frame)
+
+        self._new_frame = False
+
+    def _fit_rect(self) -> QRect:
+        """ Largest rectangle with the frame's aspect ratio that fits in the widget, centred """
+        if self._texture_shape is None:
+            return QRect()
+        h, w = self._texture_shape[:2]
+        scale = min(self.width() / w, self.height() / h)
+        dw, dh = int(w * scale), int(h * scale)
+        return QRect((self.width() - dw) // 2, (self.height() - dh) // 2, dw, dh)
+
+    def paintGL(self):
+        if self._program is None:
+            return
+
+        painter = QPainter(self)
+        painter.beginNativePainting()
+
+        GL.glClearColor(0.0, 0.0, 0.0, 1.0)
+        GL.glClear(GL.GL_COLOR_BUFFER_BIT)
+
+        if self._new_frame:
+            self._upload()
+
+        if self._texture_shape is not None:
+            self._image_rect = self._fit_rect()
+            ratio = self.devicePixelRatio()
+            r = self._image_rect
+            GL.glViewport(int(r.x() * ratio), int((self.height() - r.y() - r.height()) * ratio),
+                          int(r.width() * ratio), int(r.height() * ratio))
+
+            GL.glUseProgram(self._program)
+            GL.glActiveTexture(GL.GL_TEXTURE0)
+            GL.glBindTexture(GL.GL_TEXTURE_2D, self._texture)
+            GL.glUniform1i(GL.glGetUniformLocation(self._program, 'u_texture'), 0)
+            GL.glUniform1i(GL.glGetUniformLocation(self._program, 'u_channels'), 1 if len(self._texture_shape) == 2 else 3)
+            GL.glUniform1i(GL.glGetUniformLocation(self._program, 'u_saturation'), int(self._highlight_saturation))
+
+            stride = QUAD.strides[0]
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self._vbo)
+            GL.glEnableVertexAttribArray(self._loc_position)
+            GL.glVertexAttribPointer(self._loc_position, 2, GL.GL_FLOAT, GL.GL_FALSE, stride, ctypes.c_void_p(0))
+            GL.glEnableVertexAttribArray(self._loc_texcoord)
+            GL.glVertexAttribPointer(self._loc_texcoord, 2, GL.GL_FLOAT, GL.GL_FALSE, stride, ctypes.c_void_p(8))
+
+            GL.glDrawArrays(GL.GL_TRIANGLE_STRIP, 0, 4)
+
+            GL.glDisableVertexAttribArray(self._loc_position)
+            GL.glDisableVertexAttribArray(self._loc_texcoord)
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+            GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+            GL.glUseProgram(0)
+
+        painter.endNativePainting()
+
+        if self._overlay_callback is not None and not self._image_rect.isEmpty():
+            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+            self._overlay_callback(painter, self._image_rect)
+        painter.end()
+
+    def cleanup(self):
+        """ Frees the GL objects. Called when the GL context is destroyed, and can be called before that too """
+        if self._texture is None or self.context() is None:
+            return
+        self.makeCurrent()
+        GL.glDeleteTextures([self._texture])
+        GL.glDeleteBuffers(1, [self._vbo])
+        GL.glDeleteProgram(self._program)
+        self._texture = None
+        self._vbo = None
+        self._program = None
+        self._texture_shape = None
+        self.doneCurrent()
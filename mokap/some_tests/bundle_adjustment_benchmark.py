@@ -0,0 +1,159 @@
+import time
+import numpy as np
+import cv2
+from mokap.utils import geometry
+from scipy.optimize import least_squares
+from mokap.calibration.bundle_adjustment import (run_bundle_adjustment, BundleProblem, estimate_board_poses,
+                                                 flatten_observations)
+
+# Bundle adjustment on synthetic rigs: N cameras on a ring looking at the centre, a 9x6 board in M random poses.
+# Each camera only sees the board when it faces it and it is in the frame, and 20% of the remaining points are
+# randomly dropped (like occlusions and failed detections). The initial guess has wrong focals (3%), principal points
+# (10 px), no distortion, cameras off by 2 degrees and 2 cm, and board poses from single-camera PnP.
+#
+# Compares the Schur complement Levenberg-Marquardt, least_squares with the analytic sparse Jacobian, least_squares
+# with sparse finite differences, and least_squares with dense finite differences (i.e. without jac_sparsity, like
+# before). The slower ones only run on the smaller rigs. Errors are against the ground truth (worst camera).
+
+##
+
+RIGS = [(4, 100), (4, 300), (8, 300), (16, 300), (16, 600)]
+SCIPY_MAX = 300     # Number of samples
+DENSE_MAX = 100
+IMSIZE = (1440, 1080)
+NOISE = 0.3     # px
+DROPPED = 0.2
+
+##
+
+
+def make_rig(nb_cams, rng, radius=1.2):
+    camera_matrices, dist_coeffs, rvecs, tvecs = [], [], [], []
+    for a in np.linspace(0, 2 * np.pi, nb_cams, endpoint=False):
+        centre = np.array([radius * np.cos(a), radius * np.sin(a), rng.uniform(0.3, 0.8)])
+        z = -centre / np.linalg.norm(centre)
+        x = np.cross([0, 0, 1], z)
+        x /= np.linalg.norm(x)
+        R_cam_to_world = np.stack([x, np.cross(z, x), z], axis=1)
+        rvecs.append(cv2.Rodrigues(R_cam_to_world)[0].ravel())
+        tvecs.append(centre)
+        f = rng.uniform(1100, 1300)
+        camera_matrices.append(np.array([[f, 0, IMSIZE[0] / 2 + rng.normal(0, 15)],
+                                         [0, f, IMSIZE[1] / 2 + rng.normal(0, 15)],
+                                         [0, 0, 1]]))
+        dist_coeffs.append(np.array([rng.normal(0, 0.1), rng.normal(0, 0.1), 0, 0, 0]))
+
+    # The first camera is the origin
+    origin = geometry.extrinsics_matrix(rvecs[0], tvecs[0], hom=True)
+    for n in range(nb_cams):
+        rvecs[n], tvecs[n] = geometry.extmat_to_rtvecs(np.linalg.inv(origin) @ geometry.extrinsics_matrix(rvecs[n], tvecs[n], hom=True))
+    return np.array(camera_matrices), np.array(dist_coeffs), np.array(rvecs), np.array(tvecs), origin
+
+
+def make_samples(rig, nb_samples, board_points, rng):
+    camera_matrices, dist_coeffs, rvecs, tvecs, origin = rig
+    nb_cams = len(camera_matrices)
+    points_2d = [[None] * nb_samples for _ in range(nb_cams)]
+    points_ids = [[None] * nb_samples for _ in range(nb_cams)]
+    centre = board_points.mean(axis=0)
+
+    for m in range(nb_samples):
+        # Board pose in the ring frame, then in the origin camera's frame
+        rot = cv2.Rodrigues(rng.normal(0, 0.6, 3))[0]
+        pos = np.array([*rng.normal(0, 0.2, 2), rng.uniform(0.2, 0.9)])
+        board_to_ring = np.eye(4)
+        board_to_ring[:3, :3] = rot
+        board_to_ring[:3, 3] = pos - rot @ centre
+        board_to_world = np.linalg.inv(origin) @ board_to_ring
+
+        for n in range(nb_cams):
+            board_to_cam = np.linalg.inv(geometry.extrinsics_matrix(rvecs[n], tvecs[n], hom=True)) @ board_to_world
+            normal = board_to_cam[:3, 2]
+            cam_pts = board_points @ board_to_cam[:3, :3].T + board_to_cam[:3, 3]
+            if abs(normal @ (cam_pts.mean(axis=0) / np.linalg.norm(cam_pts.mean(axis=0)))) < 0.3:
+                continue
+            r, t = geometry.extmat_to_rtvecs(board_to_cam)
+            proj = cv2.projectPoints(board_points, r, t, camera_matrices[n], dist_coeffs[n])[0].reshape(-1, 2)
+            proj += rng.normal(0, NOISE, proj.shape)
+            # Without distortion too, or points way out of the field of view can fold back into the image
+            pinhole = cv2.projectPoints(board_points, r, t, camera_matrices[n], None)[0].reshape(-1, 2)
+            ok = (((proj > 0) & (proj < IMSIZE)).all(axis=1) & ((pinhole > 0) & (pinhole < IMSIZE)).all(axis=1)
+                  & (cam_pts[:, 2] > 0) & (rng.random(len(proj)) > DROPPED))
+            if ok.sum() >= 4:
+                points_2d[n][m] = proj[ok]
+                points_ids[n][m] = np.flatnonzero(ok)
+    return points_2d, points_ids
+
+
+def initial_guess(rig, rng):
+    camera_matrices, dist_coeffs, rvecs, tvecs, _ = rig
+    camera_matrices = camera_matrices.copy()
+    camera_matrices[:, [0, 1], [0, 1]] *= rng.uniform(0.97, 1.03, (len(camera_matrices), 1))
+    camera_matrices[:, :2, 2] += rng.normal(0, 10, (len(camera_matrices), 2))
+    rvecs, tvecs = rvecs.copy(), tvecs.copy()
+    for n in range(1, len(rvecs)):
+        R = cv2.Rodrigues(rng.normal(0, np.deg2rad(2) / np.sqrt(3), 3))[0] @ cv2.Rodrigues(rvecs[n])[0]
+        rvecs[n] = cv2.Rodrigues(R)[0].ravel()
+        tvecs[n] += rng.normal(0, 0.02 / np.sqrt(3), 3)
+    return camera_matrices, np.zeros_like(dist_coeffs), rvecs, tvecs
+
+
+def rig_errors(rig, camera_matrices, rvecs, tvecs):
+    true_K, _, true_r, true_t, _ = rig
+    focal = np.abs(camera_matrices[:, 0, 0] / true_K[:, 0, 0] - 1).max() * 100
+    position = np.linalg.norm(tvecs - true_t, axis=1).max() * 1000
+    angle = max(np.rad2deg(np.linalg.norm(cv2.Rodrigues(cv2.Rodrigues(r)[0].T @ cv2.Rodrigues(rt)[0])[0]))
+                for r, rt in zip(rvecs, true_r))
+    return focal, position, angle
+
+
+def dense_finite_differences(guess, points_2d, points_ids, board):
+    board_rvecs, board_tvecs = estimate_board_poses(*guess, points_2d, points_ids, board)
+    problem = BundleProblem(*guess, board_rvecs, board_tvecs, board, *flatten_observations(points_2d, points_ids),
+                            simple_distortion=True)
+    x0 = problem.pack()
+    result = least_squares(problem.residuals, x0, x_scale='jac', ftol=1e-8, method='trf', loss='soft_l1', f_scale=1.0)
+    K, _, r, t, _, _ = problem.unpack(result.x)
+    errors_before, errors_after = problem.errors(x0), problem.errors(result.x)
+    return K, r, t, {'nb_observations': problem.nb_observations, 'nb_params': problem.nb_params,
+                     'rms_before': np.sqrt(np.mean(errors_before ** 2)), 'rms_after': np.sqrt(np.mean(errors_after ** 2)),
+                     'nfev': result.nfev}
+
+
+if __name__ == '__main__':
+
+    rng = np.random.default_rng(0)
+    board = np.stack(np.meshgrid(np.arange(9), np.arange(6)), axis=-1).reshape(-1, 2) * 0.04
+    board = np.hstack([board, np.zeros((len(board), 1))])
+
+    print(f"{'N':>3} | {'M':>4} | {'obs':>6} | {'params':>6} | {'solver':>15} | {'time (s)':>8} | {'nfev':>4} | {'rms (px)':>12} | {'focal (%)':>9} | {'pos (mm)':>8} | {'rot (deg)':>9}")
+
+    for nb_cams, nb_samples in RIGS:
+        rig = make_rig(nb_cams, rng)
+        points_2d, points_ids = make_samples(rig, nb_samples, board, rng)
+        guess = initial_guess(rig, rng)
+
+        f0, p0, a0 = rig_errors(rig, guess[0], guess[2], guess[3])
+        print(f"{nb_cams:>3} | {nb_samples:>4} | {'':>6} | {'':>6} | {'initial guess':>15} | {'':>8} | {'':>4} | {'':>12} | {f0:>9.2f} | {p0:>8.1f} | {a0:>9.2f}")
+
+        solvers = ['schur']
+        if nb_samples <= SCIPY_MAX and nb_cams <= 8:
+            solvers += ['scipy analytic', 'scipy sparse fd']
+        if nb_samples <= DENSE_MAX:
+            solvers += ['scipy dense fd']
+
+        for solver in solvers:
+            start = time.perf_counter()
+            if solver == 'scipy dense fd':
+                K, r, t, info = dense_finite_differences(guess, points_2d, points_ids, board)
+            else:
+                kwargs = {'schur': {'solver': 'schur'},
+                          'scipy analytic': {'solver': 'scipy', 'jacobian': 'analytic'},
+                          'scipy sparse fd': {'solver': 'scipy', 'jacobian': '2-point'}}[solver]
+                K, dist, r, t, info = run_bundle_adjustment(*guess, points_2d, points_ids, board, simple_distortion=True,
+                                                            max_iterations=500, verbose=False, full_output=True, **kwargs)
+            elapsed = time.perf_counter() - start
+
+            focal, pos, angle = rig_errors(rig, K, r, t)
+            rms = f"{info['rms_before']:.1f} > {info['rms_after']:.3f}"
+            print(f"{nb_cams:>3} | {nb_samples:>4} | {info['nb_observations']:>6} | {info['nb_params']:>6} | {solver:>15} | {elapsed:>8.2f} | {info['nfev']:>4} | {rms:>12} | {focal:>9.3f} | {pos:>8.2f} | {angle:>9.3f}")
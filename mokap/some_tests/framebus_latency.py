@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import multiprocessing as mp
+import numpy as np
+from mokap.core.framebus import FramePublisher, FrameSubscriber
+
+# Latency of the shared memory frame bus, from the moment a frame is grabbed to the moment another process gets it.
+#
+#   python framebus_latency.py                  -> synthetic frames published at a fixed rate
+#   python framebus_latency.py config.yaml      -> real (or emulated) cameras, the config must enable frame_bus
+
+##
+
+SIZES = [(480, 640), (1080, 1440), (2048, 2448)]    # h, w
+FRAMERATE = 200
+NB_FRAMES = 1000
+NB_SLOTS = 8
+
+##
+
+
+def subscriber(name, nb_frames, results):
+    sub = FrameSubscriber(name, timeout=10.0)
+    latencies = []
+    while len(latencies) < nb_frames:
+        frame = sub.next(timeout=5.0, poll=0.00005)
+        if frame is None:
+            break
+        now = time.time()
+        frame.array[0, 0]       # Zero copy: just touch the data
+        latencies.append(now - frame.timestamp)
+    results.put((name, np.array(latencies) * 1000, sub.overruns))
+    sub.close()
+
+
+def report(name, latencies, overruns):
+    print(f'{name:>20} | {np.median(latencies):>8.3f} | {np.percentile(latencies, 99):>8.3f} | '
+          f'{latencies.max():>8.3f} | {overruns:>8}')
+
+
+def synthetic():
+    ctx = mp.get_context('spawn')
+    results = ctx.Queue()
+    rng = np.random.default_rng(0)
+
+    for shape in SIZES:
+        name = f'mokap_bench_{shape[1]}x{shape[0]}'
+        frames = [rng.integers(0, 256, shape, dtype=np.uint8) for _ in range(4)]
+        publisher = FramePublisher(name, shape, nb_slots=NB_SLOTS)
+
+        p = ctx.Process(target=subscriber, args=(name, NB_FRAMES, results))
+        p.start()
+        time.sleep(1.0)     # Let the subscriber attach
+
+        publish_times = np.zeros(NB_FRAMES)
+        next_t = time.perf_counter()
+        for i in range(NB_FRAMES):
+            next_t += 1 / FRAMERATE
+            while time.perf_counter() < next_t:
+                pass
+            start = time.perf_counter()
+            publisher.publish(frames[i % 4], i)
+            publish_times[i] = time.perf_counter() - start
+
+        name, latencies, overruns = results.get(timeout=30)
+        p.join()
+        publisher.close()
+
+        report(f'{shape[1]}x{shape[0]} @ {FRAMERATE}', latencies, overruns)
+        print(f'{"":>20}   (publish: {publish_times.mean() * 1e6:.0f} µs per frame)')
+
+
+def cameras(config):
+    from mokap.core import MultiCam
+
+    mc = MultiCam(config=config, triggered=False, silent=True)
+    if not mc.frame_bus_names:
+        raise SystemExit('frame_bus is not enabled in the config')
+
+    ctx = mp.get_context('spawn')
+    results = ctx.Queue()
+    processes = [ctx.Process(target=subscriber, args=(name, NB_FRAMES, results)) for name in mc.frame_bus_names]
+    [p.start() for p in processes]
+
+    mc.on()
+    for _ in processes:
+        name, latencies, overruns = results.get(timeout=60)
+        report(name, latencies, overruns)
+    [p.join() for p in processes]
+    mc.off()
+    mc.disconnect()
+
+##
+
+if __name__ == '__main__':
+
+    print(f"{'Bus':>20} | {'p50 (ms)':>8} | {'p99 (ms)':>8} | {'max (ms)':>8} | {'Overruns':>8}")
+
+    if len(sys.argv) > 1:
+        cameras(sys.argv[1])
+    else:
+        synthetic()
+
+    os._exit(0)
@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+from threading import Thread, Event
+import numpy as np
+import pypylon.pylon as py
+from mokap.core.hardware import FrameEventHandler
+
+# Polling (RetrieveResult in a Python loop) vs callback (pylon's grab loop + FrameEventHandler) grab engines,
+# on emulated cameras. Emulated frames have no timestamp, but they are produced at a steady rate: latency is how
+# late each frame reaches the Python thread that dispatches it, compared to a straight line fitted to the arrival
+# times (offset so that the earliest frame is 0). CPU is the process CPU time over the wall time.
+# The 'busy' runs add a pure Python thread that competes for the GIL, like the GUI and the writers would.
+#
+#   python grab_engines.py [nb_cameras] [width] [height] [framerate]
+
+##
+
+NB_CAMS = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+WIDTH = int(sys.argv[2]) if len(sys.argv) > 2 else 1440
+HEIGHT = int(sys.argv[3]) if len(sys.argv) > 3 else 1080
+FRAMERATE = float(sys.argv[4]) if len(sys.argv) > 4 else 100
+DURATION = 5.0
+
+##
+
+
+def open_cameras(nb):
+    os.environ['PYLON_CAMEMU'] = str(nb)
+    tl = py.TlFactory.GetInstance()
+    dev_filter = py.DeviceInfo()
+    dev_filter.SetDeviceClass('BaslerCamEmu')
+    cams = []
+    for dev in tl.EnumerateDevices([dev_filter])[:nb]:
+        cam = py.InstantCamera(tl.CreateDevice(dev))
+        cam.Open()
+        cam.Width.Value = WIDTH
+        cam.Height.Value = HEIGHT
+        cam.AcquisitionFrameRateEnable.Value = True
+        cam.AcquisitionFrameRateAbs.Value = FRAMERATE
+        cams.append(cam)
+    return cams
+
+
+def polling(cam, running, log):
+    cam.StartGrabbing()
+    while running.is_set():
+        with cam.RetrieveResult(500, py.TimeoutHandling_Return) as res:
+            if res.IsValid() and res.GrabSucceeded():
+                frame = res.GetArray()
+                log.append((res.ImageNumber, time.time()))
+    cam.StopGrabbing()
+
+
+def callback(cam, running, log):
+    handler = FrameEventHandler()
+    cam.RegisterImageEventHandler(handler, py.RegistrationMode_ReplaceAll, py.Cleanup_None)
+    cam.StartGrabbing(py.GrabStrategy_OneByOne, py.GrabLoop_ProvidedByInstantCamera)
+    while running.is_set():
+        for img_nb, frame, _ in handler.get(0.5):
+            log.append((img_nb, time.time()))
+    cam.StopGrabbing()
+    cam.DeregisterImageEventHandler(handler)
+
+
+def gil_hog(running):
+    x = 0
+    while running.is_set():
+        for i in range(10000):
+            x += i
+
+
+def run(cams, engine, busy=False):
+    running = Event()
+    running.set()
+    logs = [[] for _ in cams]
+    threads = [Thread(target=engine, args=(cam, running, log), daemon=True) for cam, log in zip(cams, logs)]
+    if busy:
+        threads.append(Thread(target=gil_hog, args=(running,), daemon=True))
+
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    [t.start() for t in threads]
+    time.sleep(DURATION)
+    running.clear()
+    [t.join() for t in threads]
+    cpu = (time.process_time() - cpu_start) / (time.perf_counter() - wall_start)
+
+    latencies, received, missed = [], 0, 0
+    for log in logs:
+        if len(log) < 2:
+            continue
+        numbers, host_ts = (np.array(v, dtype=np.float64) for v in zip(*log))
+        host_ts -= host_ts[0]
+        delay = host_ts - np.polyval(np.polyfit(numbers, host_ts, 1), numbers)
+        latencies.append((delay - delay.min()) * 1000)
+        received += len(log)
+        missed += int(numbers[-1] - numbers[0] + 1 - len(log))
+    latencies = np.concatenate(latencies)
+    return received, missed, cpu * 100, np.median(latencies), np.percentile(latencies, 99)
+
+
+if __name__ == '__main__':
+
+    cams = open_cameras(NB_CAMS)
+    print(f'{NB_CAMS} emulated cameras, {WIDTH}x{HEIGHT} @ {FRAMERATE:.0f} fps, {DURATION:.0f} s per run\n')
+    print(f"{'Engine':>16} | {'Frames':>7} | {'Missed':>7} | {'CPU (%)':>7} | {'p50 (ms)':>8} | {'p99 (ms)':>8}")
+
+    for busy in (False, True):
+        for name, engine in (('polling', polling), ('callback', callback)):
+            received, missed, cpu, p50, p99 = run(cams, engine, busy)
+            label = f"{name}{' (busy)' if busy else ''}"
+            print(f'{label:>16} | {received:>7} | {missed:>7} | {cpu:>7.0f} | {p50:>8.3f} | {p99:>8.3f}')
+
+    [cam.Close() for cam in cams]
+    os._exit(0)
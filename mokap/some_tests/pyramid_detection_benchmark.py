@@ -0,0 +1,111 @@
+import time
+import numpy as np
+import cv2
+from mokap.calibration import DetectionTool
+
+# Board detection at full resolution vs on a pyramid level (markers detected on the frame downscaled by 2 or 4, and
+# the board's points refined at full resolution), on synthetic 1440x1080 renders of a 6x5 ChArUco board in random
+# poses, from far (small in the frame) to close, with lens distortion, blur and noise.
+# Corner errors are against the exact projection of the board's points, on the points found by both methods.
+
+##
+
+BOARD = {'rows': 6, 'cols': 5, 'square_length': 30.0, 'markers_size': 4}
+IMSIZE = (1440, 1080)
+K = np.array([[1800.0, 0, 720], [0, 1800.0, 540], [0, 0, 1]])
+DIST = np.array([-0.12, 0.08, 0, 0, 0])
+DISTANCES = [(1500, 2200), (900, 1500), (400, 900)]     # mm, i.e. the board covers ~5%, ~15% and ~50% of the frame
+NB_FRAMES = 60      # per distance range
+LEVELS = [0, 1, 2]
+PPU = 8     # board image pixels per mm
+NOISE = 2.0     # grey levels
+
+##
+
+
+def board_image(board):
+    cols, rows = board.getChessboardSize()
+    size = board.getSquareLength()
+    return board.generateImage((int(cols * size * PPU), int(rows * size * PPU)), marginSize=0, borderBits=1)
+
+
+def camera_rays():
+    u, v = np.meshgrid(np.arange(IMSIZE[0], dtype=np.float32), np.arange(IMSIZE[1], dtype=np.float32))
+    rays = cv2.undistortPoints(np.stack([u.ravel(), v.ravel()], axis=1)[:, None, :], K, DIST).reshape(-1, 2)
+    return np.vstack([rays.T, np.ones(len(rays))])
+
+
+def render(img_board, rays, rvec, tvec, rng):
+    # Intersect each pixel's ray with the board plane (in board pixels, centres at integer coordinates)
+    R = cv2.Rodrigues(rvec)[0]
+    b = np.linalg.inv(np.column_stack([R[:, 0], R[:, 1], tvec])) @ rays
+    with np.errstate(divide='ignore', invalid='ignore'):
+        map_x = np.where(b[2] > 0, b[0] / b[2] * PPU - 0.5, -1e6).reshape(IMSIZE[1], IMSIZE[0]).astype(np.float32)
+        map_y = np.where(b[2] > 0, b[1] / b[2] * PPU - 0.5, -1e6).reshape(IMSIZE[1], IMSIZE[0]).astype(np.float32)
+    background = np.full(img_board.shape, 255, np.uint8)
+    out = cv2.remap(img_board, map_x, map_y, cv2.INTER_AREA, borderMode=cv2.BORDER_CONSTANT, borderValue=255)
+    mask = cv2.remap(background, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=0) / 255
+    out = out * mask + 90 * (1 - mask)
+    out = cv2.GaussianBlur(out, (0, 0), 0.7) + rng.normal(0, NOISE, out.shape)
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+
+def random_pose(board_points, distance, rng):
+    centre = board_points.mean(axis=0)
+    R = cv2.Rodrigues(rng.normal(0, 0.35, 3))[0]      # Facing the camera, +- 20 deg
+    position = np.array([0, 0, distance])
+    # Anywhere in the frame, as long as the board is entirely in it
+    for _ in range(100):
+        offset = rng.uniform(-0.35, 0.35, 2) * np.array(IMSIZE) * distance / K[0, 0]
+        tvec = position + [*offset, 0] - R @ centre
+        rvec = cv2.Rodrigues(R)[0].ravel()
+        proj = cv2.projectPoints(board_points, rvec, tvec, K, DIST)[0].reshape(-1, 2)
+        if ((proj > 20) & (proj < np.array(IMSIZE) - 20)).all():
+            return rvec, tvec, proj
+    return rvec, tvec, proj
+
+
+if __name__ == '__main__':
+
+    rng = np.random.default_rng(0)
+    tools = {level: DetectionTool(BOARD, pyramid_level=level) for level in LEVELS}
+    img_board = board_image(tools[0].board)
+    board_points = tools[0].points3d
+    rays = camera_rays()
+
+    print(f"{'distance (mm)':>13} | {'level':>5} | {'refine':>6} | {'time (ms)':>9} | {'found':>5} | {'points':>6} | {'median (px)':>11} | {'95% (px)':>8} | {'max (px)':>8}")
+
+    for dist_range in DISTANCES:
+        frames = []
+        for _ in range(NB_FRAMES):
+            rvec, tvec, truth = random_pose(board_points, rng.uniform(*dist_range), rng)
+            frames.append((render(img_board, rays, rvec, tvec, rng), truth))
+
+        for refine_points in (False, True):
+            results = {}
+            for level in LEVELS:
+                times, detections = [], []
+                for frame, _ in frames:
+                    start = time.perf_counter()
+                    detections.append(tools[level].detect(frame, refine_markers=True, refine_points=refine_points))
+                    times.append(time.perf_counter() - start)
+                results[level] = (np.array(times), detections)
+
+            for level in LEVELS:
+                times, detections = results[level]
+                errors = []
+                nb_found, nb_points = 0, 0
+                for (_, truth), (points2d, points_ids), (_, reference_ids) in zip(frames, detections, results[0][1]):
+                    if points2d is None:
+                        continue
+                    nb_found += 1
+                    nb_points += len(points_ids)
+                    if reference_ids is None:
+                        continue
+                    common = np.isin(points_ids, reference_ids)
+                    errors.append(np.linalg.norm(points2d[common] - truth[points_ids[common]], axis=1))
+                errors = np.concatenate(errors) if errors else np.array([np.nan])
+                label = f'{dist_range[0]}-{dist_range[1]}'
+                print(f"{label:>13} | {level:>5} | {str(refine_points):>6} | {np.median(times) * 1000:>9.1f} | "
+                      f"{nb_found:>5} | {nb_points / max(nb_found, 1):>6.1f} | {np.median(errors):>11.3f} | "
+                      f"{np.percentile(errors, 95):>8.3f} | {errors.max():>8.3f}")
@@ -0,0 +1,79 @@
+import time
+import numpy as np
+import cv2
+from mokap.calibration import MonocularCalibrationTool
+from pyramid_detection_benchmark import BOARD, IMSIZE, K, board_image, camera_rays, render
+
+# Live detection with and without tracking the board's region, on a synthetic 1440x1080 sequence of a 6x5 ChArUco
+# board moving smoothly (and getting closer and further), which leaves the frame for a while in the middle.
+# Times include everything MonocularCalibrationTool.detect() does. Points are compared to the full frame search.
+
+##
+
+NB_FRAMES = 400
+GONE = (180, 220)       # Frames where the board is out of the frame
+LEVELS = [0, 1]
+
+##
+
+
+def board_trajectory(board_points, nb_frames):
+    centre = board_points.mean(axis=0)
+    poses = []
+    for t in np.linspace(0, 1, nb_frames):
+        a = 2 * np.pi * t
+        R = cv2.Rodrigues(np.array([0.4 * np.sin(2 * a), 0.5 * np.sin(3 * a + 1), 0.3 * np.sin(a)]))[0]
+        distance = 900 + 500 * np.sin(a + 0.5)
+        position = np.array([0.25 * IMSIZE[0] * np.sin(3 * a), 0.2 * IMSIZE[1] * np.cos(2 * a), K[0, 0]]) / K[0, 0] * distance
+        poses.append((cv2.Rodrigues(R)[0].ravel(), position - R @ centre))
+    return poses
+
+
+def run(frames, level, track_roi):
+    tool = MonocularCalibrationTool(BOARD, imsize_hw=IMSIZE[::-1], pyramid_level=level, track_roi=track_roi)
+    times, detections, areas = [], [], []
+    for frame in frames:
+        roi = tool.roi if track_roi else None
+        start = time.perf_counter()
+        tool.detect(frame)
+        times.append(time.perf_counter() - start)
+        detections.append((tool._points2d, tool._points_ids))
+        areas.append(1.0 if roi is None else (roi[2] - roi[0]) * (roi[3] - roi[1]) / (IMSIZE[0] * IMSIZE[1]))
+    return np.array(times), detections, np.array(areas)
+
+
+if __name__ == '__main__':
+
+    rng = np.random.default_rng(0)
+    tool = MonocularCalibrationTool(BOARD, imsize_hw=IMSIZE[::-1])
+    img_board = board_image(tool.dt.board)
+    rays = camera_rays()
+
+    frames = []
+    for i, (rvec, tvec) in enumerate(board_trajectory(tool.dt.points3d, NB_FRAMES)):
+        if GONE[0] <= i < GONE[1]:
+            tvec = tvec + [5000, 0, 0]
+        frame = render(img_board, rays, rvec, tvec, rng)
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB))
+
+    print(f"{'level':>5} | {'tracking':>8} | {'mean (ms)':>9} | {'median (ms)':>11} | {'area (%)':>8} | {'found':>5} | {'points':>6} | {'max diff (px)':>13}")
+
+    for level in LEVELS:
+        reference = None
+        for track_roi in (False, True):
+            times, detections, areas = run(frames, level, track_roi)
+            if reference is None:
+                reference = detections
+
+            nb_found, nb_points, diffs = 0, 0, [0.0]
+            for (points2d, points_ids), (ref_points2d, ref_ids) in zip(detections, reference):
+                if points2d is None:
+                    continue
+                nb_found += 1
+                nb_points += len(points_ids)
+                if ref_ids is not None:
+                    common, a, b = np.intersect1d(points_ids, ref_ids, return_indices=True)
+                    diffs.append(np.abs(points2d[a] - ref_points2d[b]).max(initial=0))
+
+            print(f"{level:>5} | {str(track_roi):>8} | {times.mean() * 1000:>9.1f} | {np.median(times) * 1000:>11.1f} | "
+                  f"{areas.mean() * 100:>8.1f} | {nb_found:>5} | {nb_points / max(nb_found, 1):>6.1f} | {max(diffs):>13.3f}")
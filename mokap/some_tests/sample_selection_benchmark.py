@@ -0,0 +1,111 @@
+import time
+import numpy as np
+import cv2
+from mokap.calibration import MonocularCalibrationTool
+
+# Intrinsics from a subset of the samples picked by MonocularCalibrationTool.select_samples() vs a random subset of the
+# same size vs the whole stack. The stack is like what live sampling collects: mostly frontal views at a comfortable
+# distance, and a few tilted, close or far ones. The board's points are projected with a known camera (1440x1080,
+# radial distortion) and noise, and the points out of the frame are dropped.
+# Errors: focal, distortion (largest displacement over the image compared to the true model), and the reprojection
+# error on held-out views (each one's pose from solvePnP with the estimated intrinsics). Averaged over a few stacks.
+
+##
+
+BOARD = {'rows': 6, 'cols': 5, 'square_length': 30.0, 'markers_size': 4}
+IMSIZE = (1440, 1080)
+K = np.array([[1800.0, 0, 720], [0, 1800.0, 540], [0, 0, 1]])
+DIST = np.array([-0.25, 0.12, 0, 0, 0])
+NOISE = 0.3     # px
+STACK_SIZE = 100
+FRONTAL = 0.8       # Proportion of frontal views in the stack
+NB_TEST = 60
+SUBSETS = [15, 25, 40]
+NB_STACKS = 5
+NB_RANDOM = 5   # Random subsets per stack and size
+
+##
+
+
+def make_view(board_points, rng, frontal):
+    centre = board_points.mean(axis=0)
+    for _ in range(100):
+        if frontal:
+            R = cv2.Rodrigues(rng.normal(0, np.deg2rad(8), 3))[0]
+            distance = rng.uniform(600, 900)
+        else:
+            axis = rng.normal(0, 1, 3)
+            axis[2] *= 0.3
+            R = cv2.Rodrigues(axis / np.linalg.norm(axis) * np.deg2rad(rng.uniform(15, 55)))[0]
+            distance = np.exp(rng.uniform(np.log(350), np.log(1600)))
+        offset = rng.uniform(-0.45, 0.45, 2) * np.array(IMSIZE) * distance / K[0, 0]
+        tvec = np.array([*offset, distance]) - R @ centre
+        rvec = cv2.Rodrigues(R)[0].ravel()
+        proj = cv2.projectPoints(board_points, rvec, tvec, K, DIST)[0].reshape(-1, 2)
+        # Without distortion too, or points way out of the field of view can fold back into the image
+        pinhole = cv2.projectPoints(board_points, rvec, tvec, K, None)[0].reshape(-1, 2)
+        proj += rng.normal(0, NOISE, proj.shape)
+        inside = ((proj > 0) & (proj < IMSIZE)).all(axis=1) & ((pinhole > 0) & (pinhole < IMSIZE)).all(axis=1)
+        if inside.sum() >= 8:
+            return proj[inside].astype(np.float32), np.flatnonzero(inside).astype(np.int32)
+    return None
+
+
+def distortion_error(camera_matrix, dist_coeffs):
+    u, v = np.meshgrid(np.linspace(0, IMSIZE[0], 40), np.linspace(0, IMSIZE[1], 30))
+    pixels = np.stack([u.ravel(), v.ravel()], axis=1)
+    rays = cv2.undistortPointsIter(pixels[:, None, :], K, DIST, None, None,
+                                   (cv2.TERM_CRITERIA_COUNT | cv2.TERM_CRITERIA_EPS, 100, 1e-9)).reshape(-1, 2)
+    rays = np.hstack([rays, np.ones((len(rays), 1))])
+    reproj = cv2.projectPoints(rays, np.zeros(3), np.zeros(3), camera_matrix, dist_coeffs)[0].reshape(-1, 2)
+    return np.linalg.norm(reproj - pixels, axis=1).max()
+
+
+def test_error(camera_matrix, dist_coeffs, test_views, board_points):
+    errors = []
+    for points2d, points_ids in test_views:
+        ok, rvec, tvec = cv2.solvePnP(board_points[points_ids], points2d, camera_matrix, dist_coeffs)
+        proj = cv2.projectPoints(board_points[points_ids], rvec, tvec, camera_matrix, dist_coeffs)[0].reshape(-1, 2)
+        errors.append(np.sum((proj - points2d) ** 2, axis=1))
+    return np.sqrt(np.mean(np.concatenate(errors)))
+
+
+def calibrate(views, max_samples=None):
+    tool = MonocularCalibrationTool(BOARD, imsize_hw=IMSIZE[::-1])
+    for points2d, points_ids in views:
+        tool.set_detection(points2d, points_ids)
+        tool.register_sample()
+    start = time.perf_counter()
+    tool.compute_intrinsics(clear_stack=False, fix_aspect_ratio=False, simple_distortion=True, max_samples=max_samples)
+    return tool.intrinsics, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+
+    rng = np.random.default_rng(0)
+    board_points = MonocularCalibrationTool(BOARD).dt.points3d
+
+    results = {}
+    for s in range(NB_STACKS):
+        stack = [v for v in (make_view(board_points, rng, rng.random() < FRONTAL) for _ in range(STACK_SIZE)) if v is not None]
+        test_views = [v for v in (make_view(board_points, rng, rng.random() < 0.5) for _ in range(NB_TEST)) if v is not None]
+
+        runs = [('all', len(stack), lambda: calibrate(stack))]
+        for k in SUBSETS:
+            runs.append(('greedy', k, lambda k=k: calibrate(stack, max_samples=k)))
+            for _ in range(NB_RANDOM):
+                runs.append(('random', k, lambda k=k: calibrate([stack[i] for i in rng.choice(len(stack), k, replace=False)])))
+
+        for method, k, run in runs:
+            (camera_matrix, dist_coeffs), elapsed = run()
+            if camera_matrix is None:
+                continue
+            focal = abs(camera_matrix[0, 0] / K[0, 0] - 1) * 100
+            results.setdefault((method, k if method != 'all' else STACK_SIZE), []).append(
+                (elapsed, focal, distortion_error(camera_matrix, dist_coeffs),
+                 test_error(camera_matrix, dist_coeffs, test_views, board_points)))
+
+    print(f"{'method':>6} | {'samples':>7} | {'time (s)':>8} | {'focal (%)':>9} | {'distortion (px)':>15} | {'test RMS (px)':>13}")
+    for (method, k), values in sorted(results.items(), key=lambda item: (item[0][1], item[0][0])):
+        elapsed, focal, distortion, test = np.mean(values, axis=0)
+        print(f"{method:>6} | {k:>7} | {elapsed:>8.3f} | {focal:>9.3f} | {distortion:>15.3f} | {test:>13.3f}")
@@ -0,0 +1,77 @@
+import sys
+import time
+import shutil
+import tempfile
+from pathlib import Path
+from mokap.core import MultiCam
+
+# Checks that the 'rotate' disk quota policy moves the recording to the other volume, in image mode: an emulated
+# camera records a bit on the first volume, the storage manager rotates it to the second one, and it records a bit
+# more. Both volumes should have frames, and the second session's frame count in the metadata should match what is
+# on the second volume.
+#
+#   python storage_rotation.py [save_format]
+
+##
+
+SAVE_FORMAT = sys.argv[1] if len(sys.argv) > 1 else 'bmp'
+FRAMERATE = 20
+DURATION = 1.5      # Seconds of recording on each volume
+
+##
+
+CONFIG = """
+base_path:
+    - {root}/vol_a
+    - {root}/vol_b
+save_format: '{save_format}'
+save_quality: 80
+gpu: false
+sources:
+    strawberry:
+        type: basler
+        virtual: true
+        serial: 0815-0000
+        color: da141d
+"""
+
+
+def nb_files(folder):
+    return len(list(folder.rglob(f'*.{SAVE_FORMAT}'))) if folder.exists() else 0
+
+
+if __name__ == '__main__':
+
+    root = Path(tempfile.mkdtemp(prefix='mokap_rotation_'))
+    config = root / 'config.yaml'
+    config.write_text(CONFIG.format(root=root.as_posix(), save_format=SAVE_FORMAT))
+
+    mc = MultiCam(config=config, triggered=False, silent=True)
+    mc.framerate = FRAMERATE
+    try:
+        mc.on()
+        mc.record()
+        time.sleep(DURATION)
+
+        mc.storage._measure()
+        rotated = mc.storage._rotate(mc._cameras_volumes[0])
+        time.sleep(DURATION)
+        mc.pause()
+
+        folders = [f / mc.session_name for f in mc._base_folders]
+        sessions = mc._metadata['sessions']
+    finally:
+        mc.off()
+        mc.disconnect()
+
+    on_a, on_b = nb_files(folders[0]), nb_files(folders[1])
+    frames = [s['cameras'][0].get('frames') for s in sessions]
+    print(f"rotated: {rotated}")
+    print(f"frames on {folders[0]}: {on_a}")
+    print(f"frames on {folders[1]}: {on_b}")
+    print(f"frames per session (metadata): {frames}")
+
+    ok = rotated and on_a > 0 and on_b > 0 and frames == [on_a, on_b]
+    print('OK' if ok else 'FAILED')
+    shutil.rmtree(root, ignore_errors=True)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,103 @@
+import time
+import numpy as np
+from scipy.linalg import svd
+from mokap.utils.geometry import triangulate_points_svd
+
+# Batched triangulation vs the previous per-point loop, for a growing number of points (P) and views (V).
+# Cameras are on a ring looking at the origin, 10% of the observations are missing, and half of the runs use weights
+# and Tikhonov regularisation. The loop is only timed up to LOOP_MAX points. Points seen by a single view can't be
+# triangulated (both implementations return something meaningless for them), so they are left out of the comparison.
+
+##
+
+NB_POINTS = [100, 1000, 10000, 100000, 1000000]
+NB_VIEWS = [2, 4, 8, 16]
+LOOP_MAX = 10000
+MISSING = 0.1
+NOISE = 0.5     # px
+
+##
+
+
+def loop_triangulation(points2d, projection_matrices, weights=None, lambda_reg=None):
+    """ The previous implementation, as a reference """
+    nb_views, nb_points = points2d.shape[:2]
+    weights = np.ones((nb_views, nb_points)) if weights is None else weights.astype(float).copy()
+    weights[weights <= 0] = np.nan
+    points_3d = np.full((nb_points, 3), np.nan)
+
+    for p in range(nb_points):
+        A = np.zeros((nb_views * 2, 4))
+        for i, ii in enumerate(range(0, nb_views * 2, 2)):
+            P = projection_matrices[i]
+            u, v = points2d[i, p, :]
+            A[ii, :] = (u * P[2, :] - P[0, :]) * weights[i, p]
+            A[ii + 1, :] = (v * P[2, :] - P[1, :]) * weights[i, p]
+        A = A[~np.isnan(A).any(axis=1), :]
+        if A.shape[0] < 2:
+            continue
+        if lambda_reg is not None:
+            U, s, Vt = svd(A.T @ A + lambda_reg * np.eye(4), full_matrices=False)
+        else:
+            U, s, Vt = svd(A, full_matrices=False)
+        X = Vt[-1]
+        points_3d[p, :] = X[:3] / X[-1]
+    return points_3d
+
+
+def ring_cameras(nb_views, radius=2.0):
+    K = np.array([[1200.0, 0, 720], [0, 1200.0, 540], [0, 0, 1]])
+    matrices = []
+    for a in np.linspace(0, 2 * np.pi, nb_views, endpoint=False):
+        centre = np.array([radius * np.cos(a), radius * np.sin(a), 0.5])
+        z = -centre / np.linalg.norm(centre)
+        x = np.cross([0, 0, 1], z)
+        x /= np.linalg.norm(x)
+        y = np.cross(z, x)
+        R = np.stack([x, y, z])
+        matrices.append(K @ np.hstack([R, (-R @ centre)[:, None]]))
+    return np.stack(matrices)
+
+
+def observations(projection_matrices, nb_points, rng):
+    points3d = rng.uniform(-0.3, 0.3, (nb_points, 3))
+    hom = np.hstack([points3d, np.ones((nb_points, 1))])
+    proj = np.einsum('vij,pj->vpi', projection_matrices, hom)
+    points2d = proj[..., :2] / proj[..., 2:] + rng.normal(0, NOISE, (len(projection_matrices), nb_points, 2))
+    points2d[rng.random(points2d.shape[:2]) < MISSING] = np.nan
+    weights = rng.uniform(0.5, 1.0, points2d.shape[:2])
+    return points3d, points2d, weights
+
+
+if __name__ == '__main__':
+
+    rng = np.random.default_rng(0)
+    print(f"{'V':>3} | {'P':>8} | {'batched (ms)':>12} | {'loop (ms)':>10} | {'speedup':>8} | {'max diff':>9} | {'RMSE (mm)':>9}")
+
+    for nb_views in NB_VIEWS:
+        P_mats = ring_cameras(nb_views)
+        for nb_points in NB_POINTS:
+            truth, points2d, weights = observations(P_mats, nb_points, rng)
+
+            for kwargs in ({}, {'weights': weights, 'lambda_reg': 1e-6}):
+                start = time.perf_counter()
+                batched = triangulate_points_svd(points2d, P_mats, **kwargs)
+                t_batched = time.perf_counter() - start
+
+                seen = (~np.isnan(points2d).any(axis=2)).sum(axis=0) >= 2
+                valid = seen & ~np.isnan(batched).any(axis=1)
+                rmse = np.sqrt(np.mean((batched[valid] - truth[valid]) ** 2)) * 1000
+
+                if nb_points <= LOOP_MAX:
+                    start = time.perf_counter()
+                    looped = loop_triangulation(points2d, P_mats, **kwargs)
+                    t_loop = time.perf_counter() - start
+                    both = valid & ~np.isnan(looped).any(axis=1)
+                    same_nans = np.array_equal(np.isnan(batched).any(axis=1), np.isnan(looped).any(axis=1))
+                    diff = f'{np.abs(batched[both] - looped[both]).max():.1e}' + ('' if same_nans else '!')
+                    loop_cols = f'{t_loop * 1000:>10.1f} | {t_loop / t_batched:>7.0f}x | {diff:>9}'
+                else:
+                    loop_cols = f"{'-':>10} | {'-':>8} | {'-':>9}"
+
+                label = f'{nb_points}' + ('w' if kwargs else '')
+                print(f'{nb_views:>3} | {label:>8} | {t_batched * 1000:>12.1f} | {loop_cols} | {rmse:>9.2f}')
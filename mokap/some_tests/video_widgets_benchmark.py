@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import numpy as np
+import cv2
+from PySide6.QtCore import Qt
+from PySide6.QtGui import QImage, QPixmap
+from PySide6.QtWidgets import QApplication, QLabel
+from mokap.gui.glvideo import GLVideoFeed
+
+# Compares the QLabel + QPixmap video feed with the OpenGL texture one, driving N windows with synthetic frames
+# (use LIBGL_ALWAYS_SOFTWARE=1 to test with Mesa's software renderer)
+
+##
+
+NB_WINDOWS = [1, 4, 8, 12]
+SENSOR_SIZE = (1080, 1440)      # h, w
+WINDOW_SIZE = (540, 720)        # h, w
+NB_TICKS = 300
+NB_SYNTHETIC_FRAMES = 16
+
+##
+
+# Pre-generate some frames so that the frame generation is not part of the benchmark
+rng = np.random.default_rng(0)
+yy, xx = np.mgrid[0:SENSOR_SIZE[0], 0:SENSOR_SIZE[1]]
+frames = []
+for i in range(NB_SYNTHETIC_FRAMES):
+    base = ((np.sin((xx + i * 20) / 60.0) + np.cos((yy - i * 10) / 45.0)) * 60 + 128)
+    noise = rng.normal(0, 8, SENSOR_SIZE)
+    frames.append(np.clip(base + noise, 0, 255).astype(np.uint8))
+
+# The window only receives preview-sized frames (like with MultiCam.set_preview_size())
+previews = [cv2.resize(f, (WINDOW_SIZE[1], WINDOW_SIZE[0]), interpolation=cv2.INTER_AREA) for f in frames]
+
+##
+
+class PixmapFeed(QLabel):
+    """ What the VideoWindows do without OpenGL """
+
+    def __init__(self):
+        super().__init__()
+        self.setAlignment(Qt.AlignCenter)
+        self.setMinimumSize(1, 1)
+        self._rgb = None
+
+    def set_frame(self, frame):
+        self._rgb = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB, dst=self._rgb)
+        h, w = self._rgb.shape[:2]
+        q_img = QImage(self._rgb.data, w, h, 3 * w, QImage.Format.Format_RGB888)
+        self.setPixmap(QPixmap.fromImage(q_img))
+
+
+def run(app, widget_class, nb_windows):
+
+    windows = []
+    for i in range(nb_windows):
+        w = widget_class()
+        w.resize(WINDOW_SIZE[1], WINDOW_SIZE[0])
+        w.show()
+        windows.append(w)
+
+    # Warm-up
+    for t in range(10):
+        for w in windows:
+            w.set_frame(previews[t % NB_SYNTHETIC_FRAMES])
+        app.processEvents()
+
+    frame_times = np.zeros(NB_TICKS)
+    for t in range(NB_TICKS):
+        start = time.perf_counter()
+        for w in windows:
+            w.set_frame(previews[t % NB_SYNTHETIC_FRAMES])
+            w.repaint()
+        app.processEvents()
+        frame_times[t] = time.perf_counter() - start
+
+    for w in windows:
+        w.close()
+        w.deleteLater()
+    app.processEvents()
+
+    return frame_times
+
+##
+
+if __name__ == '__main__':
+
+    GLVideoFeed.set_default_format()
+    app = QApplication(sys.argv)
+
+    print(f'Sensor {SENSOR_SIZE[1]}x{SENSOR_SIZE[0]}, windows {WINDOW_SIZE[1]}x{WINDOW_SIZE[0]}, {NB_TICKS} ticks')
+    print(f"{'Windows':>8} | {'Widget':>8} | {'Mean (ms)':>10} | {'p95 (ms)':>10} | {'Max FPS':>8}")
+
+    for n in NB_WINDOWS:
+        for name, widget_class in [('pixmap', PixmapFeed), ('opengl', GLVideoFeed)]:
+            ft = run(app, widget_class, n) * 1000
+            print(f'{n:>8} | {name:>8} | {ft.mean():>10.2f} | {np.percentile(ft, 95):>10.2f} | {1000 / ft.mean():>8.1f}')
+
+    os._exit(0)
@@ -1,4 +1,5 @@
 import re
+import json
 from pathlib import Path
 import yaml
 import toml
@@ -292,6 +293,138 @@ def SLEAP_to_csv(slp_path, output_csv_path=None):
         print(f"\nUnexpected error processing {slp_path}: {e}")
 
 
+def raw_record_dtype(frame_shape):
+    """
+    Layout of one frame in a .raw stream: the frame number (uint64) followed by the uncompressed pixels.
+    A .raw file is just these records back to back, so it can be read with np.memmap(file, dtype=raw_record_dtype(...))
+    """
+    return np.dtype([('number', '<u8'), ('frame', np.uint8, tuple(int(v) for v in frame_shape))])
+
+
+def frame_stats_dtype(bins=16):
+    """
+    Layout of one record of a .stats file (per-frame image statistics, written alongside the recordings)
+    """
+    return np.dtype([('number', '<u8'),
+                     ('timestamp', '<f8'),
+                     ('mean', '<f4'),
+                     ('saturation', '<f4'),
+                     ('sharpness', '<f4'),
+                     ('histogram', '<f2', (int(bins),))])
+
+
+def dtype_from_descr(descr):
+    """
+    Rebuilds a numpy dtype from its descr, as stored in a json file (where tuples became lists)
+    """
+    return np.dtype([tuple(f[:2]) + ((tuple(f[2]),) if len(f) > 2 else ()) for f in descr])
+
+
+def read_frame_stats(path, dtype=None):
+    """
+    Reads a .stats file (per-frame image statistics) as a numpy structured array.
+    The layout is read from the metadata.json next to it if possible, otherwise the default one is used.
+
+    Returns
+    -------
+    np.ndarray with fields number, timestamp, mean, saturation, sharpness, histogram
+    """
+    path = Path(path)
+
+    if dtype is None:
+        dtype = frame_stats_dtype()
+        try:
+            metadata = read_metadata(path.parent)
+            for session in metadata['sessions']:
+                if any(c.get('stats_file') == path.name for c in session['cameras']) and 'stats_dtype' in session:
+                    dtype = dtype_from_descr(session['stats_dtype'])
+        except FileNotFoundError:
+            pass
+
+    nb_records = path.stat().st_size // dtype.itemsize    # The last record may be incomplete
+    return np.fromfile(path, dtype=dtype, count=nb_records)
+
+
+def read_metadata(path):
+    """
+    Reads the metadata file of a recording. The path can be the acquisition folder (on any of its volumes)
+    or the metadata file itself.
+    """
+    path = Path(path)
+    if path.is_dir():
+        path = path / 'metadata.json'
+    if not path.is_file():
+        raise FileNotFoundError(f"Can't find {path}!")
+
+    with open(path, 'r', encoding='utf-8') as f:
+        metadata = json.load(f)
+    return metadata
+
+
+def session_folders(path):
+    """
+    Returns the folders of an acquisition on all the volumes it was striped to (the given folder comes first).
+    Volumes that can't be found (e.g. disconnected drive, or files moved elsewhere) are skipped.
+    """
+    path = Path(path)
+    if path.is_file():
+        path = path.parent
+
+    folders = [path]
+    try:
+        metadata = read_metadata(path)
+    except FileNotFoundError:
+        return folders
+
+    for volume in metadata.get('volumes', []):
+        folder = Path(volume) / path.name
+        if folder.is_dir() and folder.resolve() not in [f.resolve() for f in folders]:
+            folders.append(folder)
+    return folders
+
+
+def session_streams(path):
+    """
+    Locates every camera stream (video file or images folder) of an acquisition, for each recording session.
+
+    Returns
+    -------
+    list of dict (one per recording session) of {camera_name: Path} (Path is None if the stream can't be found)
+    """
+    path = Path(path)
+    if path.is_file():
+        path = path.parent
+
+    metadata = read_metadata(path)
+    volumes = metadata.get('volumes', [])
+    folders = session_folders(path)
+
+    streams = []
+    for s, session in enumerate(metadata['sessions']):
+        session_streams_dict = {}
+        for cam in session['cameras']:
+            filename = cam.get('file')
+            if filename is None:
+                # Older recordings did not store the file names, so let's find them the old way
+                pattern = f"*_cam{cam['idx']}_{cam['name']}*"
+                candidates = [f for d in folders for f in d.glob(pattern)
+                              if f.is_dir() or f.name.endswith(f'_session{s}{f.suffix}')]
+                session_streams_dict[cam['name']] = candidates[0] if candidates else None
+                continue
+
+            # Look on the volume it was written to first, then everywhere else
+            candidates = []
+            v = cam.get('volume')
+            if v is not None and v < len(volumes):
+                candidates.append(Path(volumes[v]) / path.name / filename)
+            candidates += [d / filename for d in folders]
+
+            session_streams_dict[cam['name']] = next((c for c in candidates if c.exists()), None)
+        streams.append(session_streams_dict)
+
+    return streams
+
+
 def load_session(path, session=''):
     path = Path(path)
 
@@ -304,7 +437,8 @@ def load_session(path, session=''):
     else:
         parent_folder = path
 
-    files_match = sorted(parent_folder.glob(f'*{session}.*'))
+    # The acquisition may be spread across multiple volumes
+    files_match = sorted([f for folder in session_folders(parent_folder) for f in folder.glob(f'*{session}.*')])
     if len(files_match) == 0:
         raise FileNotFoundError(f"Can't find any tracking result files in {parent_folder}!")
 
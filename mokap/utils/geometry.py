@@ -1,7 +1,6 @@
 import numpy as np
 np.set_printoptions(precision=3, suppress=True, threshold=150)
 import cv2
-from scipy.linalg import svd
 from scipy.spatial.transform import Rotation
 from typing import Iterable
 from mokap.calibration import multiview
@@ -241,19 +240,24 @@ def triangulate_points_svd(points2d, projection_matrices, weights=None, lambda_r
 
     We use SVD to solve the system AX=0. The solution X is the last row of V^t from SVD
 
+    All the points are solved at once: the A matrices are stacked into a (n, 2m, 4) tensor, and the rows of the
+    missing views (NaN coordinates or weight <= 0) are zeroed, which leaves the right singular vectors unchanged.
+    These are then obtained from the eigendecomposition of the stacked A^T A.
+
     See https://people.math.wisc.edu/~chr/am205/g_act/svd_slides.pdf for more info and sources
 
     Parameters
     ----------
     points2d:     Array or list of n 2D points from m cameras: m x n x 2 (u, v)
     projection_matrices: Array or List of n projection matrices: m x P (3 x 4)
+    weights:      Array of per-view, per-point weights: m x n
     lambda_reg:   Regularisation term for Tikhonov Regularisation
 
     Returns: Array of n 3D points coordinates
 
     """
-    points2d = np.asarray(points2d)
-    projection_matrices = np.asarray(projection_matrices)
+    points2d = np.asarray(points2d, dtype=np.float64)
+    projection_matrices = np.asarray(projection_matrices, dtype=np.float64)
 
     if points2d.ndim == 2:
         points2d = points2d[:, np.newaxis, :]
@@ -263,7 +267,7 @@ def triangulate_points_svd(points2d, projection_matrices, weights=None, lambda_r
         raise ValueError("Number of 2D points series must match the number of projection matrices!")
 
     if weights is not None:
-        weights = np.array(weights)
+        weights = np.array(weights, dtype=np.float64)
         if weights.shape[1] != nb_points:
             raise ValueError("Number of weights must match the number of 2D points!")
         weights[weights <= 0] = np.nan
@@ -272,35 +276,62 @@ def triangulate_points_svd(points2d, projection_matrices, weights=None, lambda_r
 
     points_3d = np.full((nb_points, 3), np.nan)
 
-    for p in range(nb_points):
+    # Limit the size of the stacked A matrices (in points)
+    chunk = max(1, 2 ** 22 // (nb_views * 2 * projection_matrices.shape[-1]))
 
-        A = np.zeros((nb_views * 2, projection_matrices.shape[-1]))
+    for start in range(0, nb_points, chunk):
+        stop = min(start + chunk, nb_points)
+        points_3d[start:stop] = _triangulate_chunk(points2d[:, start:stop], projection_matrices,
+                                                   weights[:, start:stop], lambda_reg)
 
-        for i, ii in enumerate(range(0, nb_views * 2, 2)):
-            P = projection_matrices[i]
-            u, v = points2d[i, p, :]
-            A[ii, :] = (u * P[2, :] - P[0, :]) * weights[i, p]
-            A[ii + 1, :] = (v * P[2, :] - P[1, :]) * weights[i, p]
+    return points_3d
 
-        A = A[~np.isnan(A).any(axis=1), :]
 
-        if A.shape[0] < 2:
-            # Not enough views to triangulate this point
-            points_3d[p, :] = np.nan
-        else:
-            if lambda_reg is not None:
-                # Regularize by adding lambda * I to A^T * A
-                ATA = A.T @ A + lambda_reg * np.eye(A.shape[1])
-                U, s, Vt = svd(ATA, full_matrices=False)
-            else:
-                U, s, Vt = svd(A, full_matrices=False)
+def _triangulate_chunk(points2d, projection_matrices, weights, lambda_reg):
+    nb_views, nb_points = points2d.shape[:2]
+    nb_cols = projection_matrices.shape[-1]
+
+    u = points2d[..., 0].T[:, :, np.newaxis]   # (n, m, 1)
+    v = points2d[..., 1].T[:, :, np.newaxis]
+    w = weights.T[:, :, np.newaxis]
+
+    A = np.empty((nb_points, nb_views, 2, nb_cols))
+    A[:, :, 0, :] = (u * projection_matrices[:, 2, :] - projection_matrices[:, 0, :]) * w
+    A[:, :, 1, :] = (v * projection_matrices[:, 2, :] - projection_matrices[:, 1, :]) * w
+    A = A.reshape(nb_points, nb_views * 2, nb_cols)
+
+    invalid = np.isnan(A).any(axis=2)
+    A[invalid] = 0.0
+    nb_rows = nb_views * 2 - invalid.sum(axis=1)
+
+    # Scaling each A doesn't change its solution, but keeps A^T A well within floating point range
+    scale = np.abs(A).max(axis=(1, 2))
+    scale[scale == 0] = 1.0
+    A /= scale[:, np.newaxis, np.newaxis]
+
+    # The right singular vectors of A are the eigenvectors of A^T A, and one (batched) 4x4 eigendecomposition
+    # per point is a lot cheaper than an SVD of each A
+    ATA = A.transpose(0, 2, 1) @ A
+
+    if lambda_reg is not None:
+        # Regularize by adding lambda * I to A^T * A
+        ATA += (lambda_reg / scale ** 2)[:, np.newaxis, np.newaxis] * np.eye(nb_cols)
+        last = np.full(nb_points, nb_cols - 1)
+    else:
+        # Same singular vector as the last one of the A without its missing rows (which is not the null vector when
+        # there are fewer rows than columns)
+        last = np.clip(np.minimum(nb_rows, nb_cols) - 1, 0, None)
 
-            X = Vt[-1]
-            X /= X[-1]  # Normalize to ensure the homogeneous coordinate is 1
+    _, eigenvectors = np.linalg.eigh(ATA)     # Ascending eigenvalues, i.e. descending singular values
+    X = eigenvectors[np.arange(nb_points), :, nb_cols - 1 - last]
 
-            points_3d[p, :] = X[:3]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        X = X[:, :3] / X[:, 3:]     # Normalize to ensure the homogeneous coordinate is 1
 
-    return points_3d
+    # Not enough views to triangulate these points
+    X[nb_rows < 2] = np.nan
+
+    return X
 
 
 def find_affine(Ps, Ps_2):